@@ -0,0 +1,289 @@
+#!/bin/python3
+""" Data of the spatial coarse-graining: state points, RDFs and interaction tables
+
+statepoint.in maps the labels N of the files to state points (box length and temperature).
+For every label, cg-rdf/<N>t.rdf and ref-rdf/<N>t.rdf hold centre-of-mass radial distribution
+functions (180 bins up to half the box length), and cg-interaction/<N>t.table the coarse-grained
+pair potential and force (on a grid of 0.02 Å, in the LAMMPS table format). load_dataset reads
+all of them into stacked arrays, in the order of statepoint.in:
+
+    data = load_dataset()
+    i = data.position(temperature=600, box_length=35.5)
+    r, g_cg, g_ref = data.rdf_r[i], data.rdf_cg[i], data.rdf_ref[i]
+    deviation = rdf_deviation(data.rdf_r, data.rdf_cg, data.rdf_ref)  # All state points
+
+The tables start at different distances, so they are stacked on a common grid with NaN
+where a table has no value. The arrays are cached as NumPy files, that are memory-mapped
+by later loads, until any of the files changes. The cache directory is
+`~/.cache/cg_in_time/spatial`, or the value of the environment variable `SPATIAL_CACHE_DIR`.
+
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+CACHE_VERSION = 1
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+TABLE_SPACING = 0.02  # Å
+
+
+def default_cache_dir():
+    ''' Directory for cached spatial coarse-graining data '''
+    return os.environ.get('SPATIAL_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'cg_in_time', 'spatial'))
+
+
+def read_state_points(filename='statepoint.in'):
+    ''' Labels, box lengths and temperatures of the state points in statepoint.in
+
+    Returns a list of dictionaries with Label, Box_Length and Temperature.
+    '''
+    state_points = []
+    with open(filename) as file:
+        for line in file:
+            elements = line.split()
+            if len(elements) != 3 or not elements[0].isdigit():
+                continue
+            state_points.append({
+                'Label': int(elements[0]),
+                'Box_Length': float(elements[1]),
+                'Temperature': float(elements[2])
+            })
+    return state_points
+
+
+def state_point_table(filename='statepoint.in'):
+    ''' DataFrame of the state points of statepoint.in, indexed by label '''
+    import pandas as pd
+    return pd.DataFrame(read_state_points(filename)).set_index('Label')
+
+
+def load_rdf(filename):
+    ''' Distances and g(r) of an RDF file with lines as `r = 0.049922<tab>g(r) = 0.000000` '''
+    with open(filename) as file:
+        elements = file.read().split()
+    return np.array(elements[2::6], dtype=float), np.array(elements[5::6], dtype=float)
+
+
+def load_table(filename):
+    ''' Header and columns of a LAMMPS pair table file (one keyword)
+
+    Returns a dictionary with keyword, N, r_min and r_max of the header
+    (`N 595 R 4.140000 10.000000`) and arrays index, r, U and F.
+    '''
+    with open(filename) as file:
+        lines = file.read().splitlines()
+    for i, line in enumerate(lines):
+        if line.startswith('N '):
+            break
+    else:
+        raise ValueError(f'No N line in table file {filename}')
+    header = lines[i].split()
+    keyword = next(line.strip() for line in reversed(lines[:i]) if line.strip() and not line.startswith('#'))
+    values = np.array(' '.join(lines[i + 1:]).split(), dtype=float).reshape(-1, 4)
+    table = {'keyword': keyword, 'N': int(header[1]), 'r_min': np.nan, 'r_max': np.nan}
+    if 'R' in header:
+        table['r_min'], table['r_max'] = float(header[header.index('R') + 1]), float(header[header.index('R') + 2])
+    table.update({'index': values[:, 0].astype(int), 'r': values[:, 1], 'U': values[:, 2], 'F': values[:, 3]})
+    return table
+
+
+def write_table(filename, table):
+    ''' Write a table (as returned by load_table) in the format of cg-interaction/<N>t.table '''
+    header = f'N {table["N"]}'
+    if np.isfinite(table['r_min']):
+        header += f' R {table["r_min"]:.6f} {table["r_max"]:.6f}'
+    rows = ''.join(f'{i} {r:.6f} {U:.6f} {F:.6f}\n'
+                   for i, r, U, F in zip(table['index'], table['r'], table['U'], table['F']))
+    with open(filename, 'w') as file:
+        file.write(f'# Header information on force file\n\n{table["keyword"]}\n{header}\n\n{rows}')
+
+
+def _files(directory, labels):
+    return {
+        'rdf_cg': [os.path.join(directory, 'cg-rdf', f'{label}t.rdf') for label in labels],
+        'rdf_ref': [os.path.join(directory, 'ref-rdf', f'{label}t.rdf') for label in labels],
+        'table': [os.path.join(directory, 'cg-interaction', f'{label}t.table') for label in labels]
+    }
+
+
+def _fingerprint(filenames):
+    ''' Size and modification time of files '''
+    stats = [os.stat(filename) for filename in filenames]
+    return [[os.path.abspath(filename), stat.st_size, stat.st_mtime_ns] for filename, stat in zip(filenames, stats)]
+
+
+def _parse_dataset(directory, labels):
+    ''' Stacked arrays of the RDF and table files of labels '''
+    files = _files(directory, labels)
+    rdf_cg = [load_rdf(filename) for filename in files['rdf_cg']]
+    rdf_ref = [load_rdf(filename) for filename in files['rdf_ref']]
+    for label, (r_cg, _), (r_ref, _) in zip(labels, rdf_cg, rdf_ref):
+        if len(r_cg) != len(r_ref) or not np.allclose(r_cg, r_ref, atol=1e-5):
+            raise ValueError(f'The RDFs of label {label} have different distances')
+    tables = [load_table(filename) for filename in files['table']]
+    # Common grid of the tables, with grid points as integer multiples of TABLE_SPACING
+    first = [int(round(table['r'][0] / TABLE_SPACING)) for table in tables]
+    last = [int(round(table['r'][-1] / TABLE_SPACING)) for table in tables]
+    grid = np.arange(min(first), max(last) + 1)
+    table_U = np.full((len(tables), len(grid)), np.nan)
+    table_F = np.full((len(tables), len(grid)), np.nan)
+    for i, table in enumerate(tables):
+        columns = np.round(table['r'] / TABLE_SPACING).astype(int) - grid[0]
+        table_U[i, columns] = table['U']
+        table_F[i, columns] = table['F']
+    return {
+        'rdf_r': np.stack([r for r, _ in rdf_cg]),
+        'rdf_cg': np.stack([g for _, g in rdf_cg]),
+        'rdf_ref': np.stack([g for _, g in rdf_ref]),
+        'table_r': grid * TABLE_SPACING,
+        'table_U': table_U,
+        'table_F': table_F,
+        'table_N': np.array([table['N'] for table in tables]),
+        'table_range': np.array([[table['r_min'], table['r_max']] for table in tables])
+    }
+
+
+class CoarseGrainingData:
+    ''' State points, RDFs and interaction tables as stacked arrays (see load_dataset)
+
+    Attributes:
+        state_points: DataFrame of Label, Box_Length and Temperature (rows in array order)
+        rdf_r, rdf_cg, rdf_ref: arrays of shape (state points, 180)
+        table_r: common grid of the tables, table_U and table_F: arrays (state points, grid)
+        table_N, table_range: N and (r_min, r_max) of the table headers
+    '''
+
+    def __init__(self, state_points, arrays):
+        import pandas as pd
+        self.state_points = pd.DataFrame(state_points)
+        for name, array in arrays.items():
+            setattr(self, name, array)
+
+    def __len__(self):
+        return len(self.state_points)
+
+    def __repr__(self):
+        return f'CoarseGrainingData(state_points={len(self)}, tables={self.table_U.shape})'
+
+    def position(self, temperature, box_length):
+        ''' Row of the arrays of a state point '''
+        match = (np.isclose(self.state_points.Temperature, temperature)
+                 & np.isclose(self.state_points.Box_Length, box_length))
+        if not match.any():
+            raise KeyError(f'No state point with T = {temperature} K and L = {box_length} Å')
+        return int(np.flatnonzero(match)[0])
+
+    def table(self, temperature, box_length):
+        ''' Distances, potential and force of the table of a state point (without NaN) '''
+        i = self.position(temperature, box_length)
+        valid = np.isfinite(self.table_U[i])
+        return self.table_r[valid], self.table_U[i, valid], self.table_F[i, valid]
+
+
+def load_dataset(directory=DATA_DIR, cache=True, cache_dir=None, verbose=False):
+    ''' All state points, RDFs and tables of a coarse-graining directory as CoarseGrainingData
+
+    With cache=True, the arrays are memory-mapped from the cache, and the files are only
+    parsed if any of them changed since they were cached.
+    '''
+    state_points_filename = os.path.join(directory, 'statepoint.in')
+    state_points = read_state_points(state_points_filename)
+    labels = [state_point['Label'] for state_point in state_points]
+    if not cache:
+        return CoarseGrainingData(state_points, _parse_dataset(directory, labels))
+    files = _files(directory, labels)
+    meta = {'version': CACHE_VERSION,
+            'files': _fingerprint([state_points_filename] + files['rdf_cg'] + files['rdf_ref'] + files['table'])}
+    key = hashlib.sha1(os.path.abspath(directory).encode()).hexdigest()[:16]
+    entry = os.path.join(cache_dir or default_cache_dir(), key)
+    meta_filename = os.path.join(entry, 'meta.json')
+    try:
+        with open(meta_filename) as file:
+            stored = json.load(file)
+        names = stored.pop('arrays')
+        if stored == meta:
+            arrays = {name: np.load(os.path.join(entry, f'{name}.npy'), mmap_mode='r') for name in names}
+            if verbose:
+                print(f'Loaded coarse-graining data of {directory} from cache {entry}')
+            return CoarseGrainingData(state_points, arrays)
+    except (OSError, ValueError, KeyError):
+        pass
+    if verbose:
+        print(f'Reading coarse-graining data from {directory}')
+    arrays = _parse_dataset(directory, labels)
+    try:
+        os.makedirs(entry, exist_ok=True)
+        if os.path.exists(meta_filename):
+            os.remove(meta_filename)
+        for name, array in arrays.items():
+            np.save(os.path.join(entry, f'{name}.npy'), array)
+        # Written last, so a cache entry is only used when complete
+        with open(meta_filename, 'w') as file:
+            json.dump(dict(meta, arrays=list(arrays)), file)
+    except OSError as error:
+        if verbose:
+            print(f'Could not write cache {entry}: {error}')
+    return CoarseGrainingData(state_points, arrays)
+
+
+def rdf_deviation(r, g, g_reference, r_min=None, r_max=None):
+    r''' Deviations of RDFs from reference RDFs, for all state points at once
+
+    r, g and g_reference are arrays of shape (..., bins), e.g. (state points, 180).
+    Only bins with r_min <= r <= r_max (default all) are compared. Returns a dictionary
+    of arrays of shape (...):
+
+        rms: root mean square deviation
+        max: maximum absolute deviation
+        integrated: :math:`\int |g - g_{ref}| dr / \int dr`
+        weighted: :math:`\int r^2 |g - g_{ref}| dr / \int r^2 g_{ref} dr`
+            (the relative error of the number of neighbours)
+        peak_shift: position of the first peak of g minus that of g_reference
+    '''
+    r, g, g_reference = np.broadcast_arrays(np.asarray(r, dtype=float), g, g_reference)
+    mask = np.ones(r.shape, dtype=bool)
+    if r_min is not None:
+        mask &= r >= r_min
+    if r_max is not None:
+        mask &= r <= r_max
+    difference = np.where(mask, np.abs(g - g_reference), 0.0)
+    dr = np.gradient(r, axis=-1)
+    bins = mask.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        deviation = {
+            'rms': np.sqrt((difference**2).sum(axis=-1) / bins),
+            'max': difference.max(axis=-1),
+            'integrated': (difference * dr).sum(axis=-1) / np.where(mask, dr, 0.0).sum(axis=-1),
+            'weighted': ((r**2 * difference * dr).sum(axis=-1)
+                         / np.where(mask, r**2 * g_reference * dr, 0.0).sum(axis=-1)),
+        }
+    peak = np.argmax(np.where(mask, g, -np.inf), axis=-1)
+    peak_reference = np.argmax(np.where(mask, g_reference, -np.inf), axis=-1)
+    deviation['peak_shift'] = (np.take_along_axis(r, peak[..., np.newaxis], axis=-1)[..., 0]
+                               - np.take_along_axis(r, peak_reference[..., np.newaxis], axis=-1)[..., 0])
+    return deviation
+
+
+def main():
+    import argparse
+    import time
+    import pandas as pd
+    parser = argparse.ArgumentParser(description='Deviations of cg-rdf from ref-rdf for all state points')
+    parser.add_argument('directory', nargs='?', default=DATA_DIR)
+    parser.add_argument('--r-min', type=float, default=None, help='Smallest distance compared [Å]')
+    parser.add_argument('--r-max', type=float, default=None, help='Largest distance compared [Å]')
+    parser.add_argument('--no-cache', dest='cache', action='store_false')
+    args = parser.parse_args()
+    tic = time.perf_counter()
+    data = load_dataset(args.directory, cache=args.cache, verbose=True)
+    print(f'Loaded {data!r} in {time.perf_counter() - tic:.3f} s')
+    deviation = rdf_deviation(data.rdf_r, data.rdf_cg, data.rdf_ref, args.r_min, args.r_max)
+    print(pd.concat([data.state_points, pd.DataFrame(deviation)], axis=1).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#!/bin/python3
+r""" Energy and virial of centre-of-mass configurations with tabulated CG pair potentials
+
+The pair potential :math:`u(r)` and force :math:`f(r) = -u'(r)` of a table file
+(cg-interaction/<N>t.table) are interpolated with cubic splines, that are computed once
+per table and kept in memory. For every frame, the coarse-grained energy and virial are
+
+ .. math::
+
+     U = \sum_{i<j} u(r_{ij}) \qquad W = \frac{1}{3} \sum_{i<j} r_{ij} f(r_{ij})
+
+over the pairs within the cutoff, found with the periodic KD-tree of rdf.pair_distances.
+Frames are handled in batches: the pair distances of all frames of a batch are evaluated
+with one call of each spline, and summed per frame with np.bincount. The series of U and W
+can then be analysed as those of the all-atom simulations, e.g. the scaling exponent
+:math:`\gamma = \mathrm{cov}(\bar W, \bar U)/\mathrm{var}(\bar U)` of boxcar averages:
+
+    python3 cg_potential.py ../../cg-in-time/constant_volume/T380_L35.944/dump.constant_volume --label 1
+
+"""
+
+import functools
+import os
+
+import numpy as np
+
+from rdf import ANALYSIS_DIR, open_trajectory, pair_distances
+
+SCALING_EXPONENTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'cg-in-time',
+                                 'table_coarse_graining_in_time', 'scaling_exponents.csv')
+
+
+class TabulatedPotential:
+    ''' Cubic spline interpolation of a tabulated pair potential and force
+
+    r, U and F are the columns of a table (F default -dU/dr of the spline of U). Pairs
+    beyond the cutoff (default the last distance of the table) do not interact; pairs
+    closer than the first distance of the table are an error.
+    '''
+
+    def __init__(self, r, U, F=None, cutoff=None):
+        from scipy.interpolate import CubicSpline
+        r, U = np.asarray(r, dtype=float), np.asarray(U, dtype=float)
+        valid = np.isfinite(r) & np.isfinite(U)
+        self.r_min, self.r_max = r[valid][0], r[valid][-1]
+        self.cutoff = self.r_max if cutoff is None else min(cutoff, self.r_max)
+        self.energy_spline = CubicSpline(r[valid], U[valid])
+        if F is None:
+            self.force_spline = self.energy_spline.derivative()
+            self._force_sign = -1.0
+        else:
+            self.force_spline = CubicSpline(r[valid], np.asarray(F, dtype=float)[valid])
+            self._force_sign = 1.0
+
+    def __repr__(self):
+        return f'TabulatedPotential(r_min={self.r_min}, cutoff={self.cutoff})'
+
+    def _check(self, r):
+        if r.size and r.min() < self.r_min:
+            raise ValueError(f'Pair distance {r.min():.4f} Å is below the first distance of the table, {self.r_min} Å')
+
+    def energy(self, r):
+        r = np.asarray(r, dtype=float)
+        self._check(r)
+        return np.where(r <= self.cutoff, self.energy_spline(r), 0.0)
+
+    def force(self, r):
+        r = np.asarray(r, dtype=float)
+        self._check(r)
+        return np.where(r <= self.cutoff, self._force_sign * self.force_spline(r), 0.0)
+
+
+@functools.lru_cache(maxsize=64)
+def _load_potential(filename, mtime_ns, cutoff):
+    from cg_data import load_table
+    table = load_table(filename)
+    return TabulatedPotential(table['r'], table['U'], table['F'], cutoff)
+
+
+def load_potential(filename, cutoff=None):
+    ''' TabulatedPotential of a table file, splined once (until the file changes) '''
+    filename = os.path.abspath(filename)
+    return _load_potential(filename, os.stat(filename).st_mtime_ns, cutoff)
+
+
+def energy_and_virial(frames, potential, box_lengths):
+    ''' Energy and virial of frames of shape (frames, particles, 3)
+
+    box_lengths is an array of shape (3,) or (frames, 3). Returns arrays U and W
+    of shape (frames,).
+    '''
+    frames = np.asarray(frames, dtype=float)
+    box_lengths = np.broadcast_to(np.asarray(box_lengths, dtype=float), (len(frames), 3))
+    if potential.cutoff > box_lengths.min() / 2:
+        raise ValueError(f'Cutoff {potential.cutoff} Å is beyond half the box length {box_lengths.min() / 2} Å')
+    distances, frame_ids = [], []
+    for frame, (positions, lengths) in enumerate(zip(frames, box_lengths)):
+        distance = pair_distances(positions, lengths, potential.cutoff)[1]
+        distances.append(distance)
+        frame_ids.append(np.full(len(distance), frame))
+    r = np.concatenate(distances)
+    frame_ids = np.concatenate(frame_ids)
+    U = np.bincount(frame_ids, weights=potential.energy(r), minlength=len(frames))
+    W = np.bincount(frame_ids, weights=r * potential.force(r), minlength=len(frames)) / 3
+    return U, W
+
+
+def evaluate_trajectory(trajectory, potential, data_filename=None, indices=None, frames_per_batch=64,
+                        box_lengths=None):
+    ''' Energy and virial of the molecular centres of mass of a trajectory
+
+    trajectory is a dump file name, a DumpTrajectory or TrajectoryStore (whose atoms are mapped
+    to centres of mass with the molecule ids and masses of data_filename, default data.initial
+    of the analysis directory), or an array of centre-of-mass frames (with box_lengths).
+    Returns a dictionary with frame indices, steps (if known), U and W.
+    '''
+    from molecules import molecule_mapping, center_of_mass
+    if isinstance(trajectory, str):
+        trajectory = open_trajectory(trajectory)
+    if isinstance(trajectory, np.ndarray):
+        if box_lengths is None:
+            raise ValueError('box_lengths are needed for an array of frames')
+        mapping = None
+        boxes = np.broadcast_to(np.asarray(box_lengths, dtype=float), (len(trajectory), 3))
+    else:
+        from trajectory_store import read_lammps_data
+        data = read_lammps_data(data_filename or os.path.join(ANALYSIS_DIR, 'data.initial'))
+        mapping = molecule_mapping(data['molecule'], data['mass'])[:2]
+        boxes = trajectory.boxes[:, :, 1] - trajectory.boxes[:, :, 0]
+    if indices is None:
+        indices = np.arange(len(trajectory))
+    U, W = np.zeros(len(indices)), np.zeros(len(indices))
+    for start in range(0, len(indices), frames_per_batch):
+        batch = indices[start:start + frames_per_batch]
+        if mapping is None:
+            frames = trajectory[batch]
+        else:
+            frames = center_of_mass(trajectory.read(batch), *mapping)
+        U[start:start + len(batch)], W[start:start + len(batch)] = energy_and_virial(frames, potential, boxes[batch])
+    steps = getattr(trajectory, 'steps', None)
+    return {'frame': indices, 'step': None if steps is None else steps[indices], 'U': U, 'W': W}
+
+
+def reference_scaling_exponent(temperature, box_length, filename=SCALING_EXPONENTS):
+    ''' Scaling exponent gamma of the all-atom state point in scaling_exponents.csv, or None '''
+    import pandas as pd
+    table = pd.read_csv(filename)
+    match = table[np.isclose(table.temperature, temperature) & np.isclose(table.box_length, box_length)]
+    return None if match.empty else float(match.gamma.iloc[0])
+
+
+def main():
+    import argparse
+    import pandas as pd
+    from cg_data import read_state_points
+    from boxcar import boxcar_scaling_exponent, dyadic_window_lengths
+    parser = argparse.ArgumentParser(description='CG energy, virial and scaling exponent of a trajectory')
+    parser.add_argument('dump', help='LAMMPS dump file (or its trajectory store)')
+    parser.add_argument('--label', type=int, required=True, help='Label of the state point (see statepoint.in)')
+    parser.add_argument('--table', help='Table file (default cg-interaction/<label>t.table)')
+    parser.add_argument('--data', dest='data_filename', help='LAMMPS data file with molecule ids and masses')
+    parser.add_argument('--cutoff', type=float, help='Cutoff of the pair potential [Å]')
+    parser.add_argument('--frame-stride', type=int, default=1)
+    parser.add_argument('--output', default='cg_energy.csv', help='Table of U and W of every frame')
+    args = parser.parse_args()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    state_point = {s['Label']: s for s in read_state_points(os.path.join(directory, 'statepoint.in'))}[args.label]
+    table = args.table or os.path.join(directory, 'cg-interaction', f'{args.label}t.table')
+    potential = load_potential(table, args.cutoff)
+    trajectory = open_trajectory(args.dump)
+    result = evaluate_trajectory(trajectory, potential, args.data_filename,
+                                 indices=np.arange(0, len(trajectory), args.frame_stride))
+    df = pd.DataFrame({'Step': result['step'], 'U': result['U'], 'W': result['W']})
+    df.to_csv(args.output, index=False)
+    print(f'U and W of {len(df)} frames written to {args.output}')
+    print(boxcar_scaling_exponent(df.U.to_numpy(), df.W.to_numpy(), dyadic_window_lengths(len(df))))
+    gamma = reference_scaling_exponent(state_point['Temperature'], state_point['Box_Length'])
+    print(f'All-atom scaling exponent (scaling_exponents.csv): {gamma = }')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#!/bin/python3
+r""" Iterative Boltzmann inversion of the CG interaction tables
+
+Starting from a table (cg-interaction/<N>t.table) and the reference RDF of the state point
+(ref-rdf/<N>t.rdf), the pair potential is refined as
+
+ .. math::
+
+     u_{k+1}(r) = u_k(r) + \alpha k_B T \ln \frac{g_k(r)}{g_{ref}(r)}
+
+where :math:`g_k` is the RDF of the centres of mass with :math:`u_k`. It is sampled with a
+built-in Metropolis Monte Carlo simulation of N = 125 particles in the box of the state
+point. Independent replicas are simulated side by side: the trial move of particle i is
+made in all replicas at once, with the energies of the moved particle evaluated with one
+call of the table spline (cg_potential.TabulatedPotential). Every iteration continues from
+the configurations of the last, after a few equilibration sweeps with the new potential.
+
+The updated tables are written in the format of cg-interaction (`N 595 R ...` header, rows of
+index, r, U and F), and the deviation of every iteration (see cg_data.rdf_deviation) is
+logged to `<N>t.ibi.csv`. The state points are refined in parallel:
+
+    python3 ibi.py --labels 1 14 23 --iterations 10 --output-directory ibi
+
+"""
+
+import os
+import time
+
+import numpy as np
+
+from cg_data import DATA_DIR, load_rdf, load_table, rdf_deviation, read_state_points, write_table
+from cg_potential import TabulatedPotential
+from rdf import bin_edges, radial_distribution_function
+
+k_B = 0.0019872041  # Boltzmann constant in kcal/(mol K), as the energies of the tables
+NUMBER_OF_MOLECULES = 125
+
+
+def lattice(number_of_particles, box_length, replicas=1, seed=0):
+    ''' Positions on a simple cubic lattice, with small random displacements per replica '''
+    n = int(np.ceil(number_of_particles ** (1 / 3)))
+    grid = np.stack(np.meshgrid(*[np.arange(n)] * 3, indexing='ij'), axis=-1).reshape(-1, 3)
+    positions = (grid[:number_of_particles] + 0.5) * box_length / n
+    rng = np.random.default_rng(seed)
+    return positions[np.newaxis] + rng.normal(scale=0.01 * box_length / n, size=(replicas, number_of_particles, 3))
+
+
+def _pair_energy(potential, r):
+    ''' Pair energies, infinite below the first distance of the table (rejected moves) '''
+    energy = potential.energy_spline(np.maximum(r, potential.r_min))
+    energy = np.where(r <= potential.cutoff, energy, 0.0)
+    return np.where(r < potential.r_min, np.inf, energy)
+
+
+def _distances(positions, particle, box_length):
+    ''' Distances of a particle (shape (replicas, 3)) to all particles (replicas, N, 3) '''
+    separation = positions - particle[:, np.newaxis, :]
+    separation -= box_length * np.round(separation / box_length)
+    return np.sqrt((separation**2).sum(axis=2))
+
+
+def _pair_histograms(positions, box_length, edges):
+    ''' Histogram of the pair distances of all replicas, with minimum images '''
+    separation = positions[:, :, np.newaxis, :] - positions[:, np.newaxis, :, :]
+    separation -= box_length * np.round(separation / box_length)
+    i, j = np.triu_indices(positions.shape[1], 1)
+    distance = np.sqrt((separation[:, i, j]**2).sum(axis=2))
+    return np.histogram(distance, bins=edges)[0]
+
+
+def monte_carlo_rdf(potential, positions, box_length, temperature, sweeps=200, equilibration=20,
+                    sample_interval=5, max_displacement=0.5, target_acceptance=0.4, rng=None):
+    ''' RDF of a Metropolis Monte Carlo simulation of particles with a tabulated pair potential
+
+    positions has shape (replicas, particles, 3) and is updated in place. The maximum
+    displacement is tuned to the target acceptance during the equilibration sweeps.
+    Returns r, g(r) (in the bins of rdf.bin_edges), the acceptance ratio and the
+    maximum displacement.
+    '''
+    rng = rng or np.random.default_rng()
+    replicas, number_of_particles, _ = positions.shape
+    beta = 1 / (k_B * temperature)
+    edges = bin_edges(box_length)
+    histogram = np.zeros(len(edges) - 1)
+    normalization = 0.0
+    accepted = trials = 0
+    everyone = np.arange(replicas)
+    for sweep in range(equilibration + sweeps):
+        sweep_accepted = 0
+        for i in rng.permutation(number_of_particles):
+            others = np.arange(number_of_particles) != i
+            old = positions[:, i].copy()
+            new = old + rng.uniform(-max_displacement, max_displacement, size=(replicas, 3))
+            r_old = _distances(positions[:, others], old, box_length)
+            r_new = _distances(positions[:, others], new, box_length)
+            energies = _pair_energy(potential, np.stack([r_old, r_new]))
+            change = energies[1].sum(axis=1) - energies[0].sum(axis=1)
+            with np.errstate(over='ignore'):
+                accept = rng.random(replicas) < np.exp(-beta * change)
+            positions[everyone[accept], i] = np.mod(new[accept], box_length)
+            sweep_accepted += accept.sum()
+        acceptance = sweep_accepted / (replicas * number_of_particles)
+        if sweep < equilibration:
+            max_displacement *= np.clip(acceptance / target_acceptance, 0.5, 1.5)
+            max_displacement = min(max_displacement, box_length / 4)
+            continue
+        accepted += sweep_accepted
+        trials += replicas * number_of_particles
+        if (sweep - equilibration) % sample_interval == 0:
+            histogram += _pair_histograms(positions, box_length, edges)
+            normalization += replicas * number_of_particles**2 / box_length**3
+    r, g = radial_distribution_function(histogram, normalization, edges)
+    return r, g, accepted / max(trials, 1), max_displacement
+
+
+def ibi_update(table, r_rdf, g, g_reference, temperature, alpha=0.2, g_min=1e-3):
+    ''' Table with the potential updated by Boltzmann inversion of g/g_reference
+
+    g and g_reference are interpolated to the distances of the table. Where either is
+    below g_min (in the core), the potential is not changed. The potential is shifted to
+    zero at the last distance, and the force of the table is changed by the derivative
+    of the correction only, so it is kept where the potential is not changed.
+    '''
+    r = table['r']
+    g_table = np.interp(r, r_rdf, g, right=1.0)
+    g_reference_table = np.interp(r, r_rdf, g_reference, right=1.0)
+    valid = (g_table > g_min) & (g_reference_table > g_min)
+    correction = np.zeros_like(r)
+    correction[valid] = alpha * k_B * temperature * np.log(g_table[valid] / g_reference_table[valid])
+    U = table['U'] + correction
+    U -= U[-1]
+    return dict(table, U=U, F=table['F'] - np.gradient(correction, r))
+
+
+def refine(label, box_length, temperature, table_filename, reference_filename, output_directory,
+           iterations=10, alpha=0.2, replicas=16, sweeps=200, equilibration=20, sample_interval=5,
+           number_of_particles=NUMBER_OF_MOLECULES, seed=0, tolerance=None):
+    ''' Iterative Boltzmann inversion of the table of a state point
+
+    Writes the table of every iteration to `<label>t.table` in output_directory (the last
+    is the refined table), and the convergence of every iteration to `<label>t.ibi.csv`.
+    Stops early if the RMS deviation of the RDF is below tolerance. Returns a list of
+    the deviations of all iterations.
+    '''
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    table = load_table(table_filename)
+    r_reference, g_reference = load_rdf(reference_filename)
+    positions = lattice(number_of_particles, box_length, replicas, seed)
+    max_displacement = 0.5
+    log = []
+    log_filename = os.path.join(output_directory, f'{label}t.ibi.csv')
+    for iteration in range(iterations + 1):
+        tic = time.perf_counter()
+        potential = TabulatedPotential(table['r'], table['U'], table['F'])
+        r, g, acceptance, max_displacement = monte_carlo_rdf(
+            potential, positions, box_length, temperature, sweeps, equilibration, sample_interval,
+            max_displacement, rng=rng)
+        deviation = rdf_deviation(r, g, g_reference)
+        log.append({'label': label, 'iteration': iteration, 'acceptance': acceptance,
+                    'max_displacement': max_displacement, 'wall_time': time.perf_counter() - tic,
+                    **{key: float(value) for key, value in deviation.items()}})
+        pd.DataFrame(log).to_csv(log_filename, index=False)
+        print(f'Label {label}, iteration {iteration}: rms = {deviation["rms"]:.4f}, '
+              f'max = {deviation["max"]:.4f}, acceptance = {acceptance:.2f}', flush=True)
+        if iteration == iterations or (tolerance is not None and deviation['rms'] < tolerance):
+            break
+        table = ibi_update(table, r_reference, g, g_reference, temperature, alpha)
+        write_table(os.path.join(output_directory, f'{label}t.table'), table)
+    return log
+
+
+def refine_state_points(state_points, output_directory='ibi', processes=None, directory=DATA_DIR, **parameters):
+    ''' Refine the tables of state points (from cg_data.read_state_points) in a process pool
+
+    The tables and reference RDFs are read from cg-interaction and ref-rdf in directory.
+    Keyword arguments are passed on to refine. Returns a DataFrame of the deviations of
+    all iterations of all state points.
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    import pandas as pd
+    os.makedirs(output_directory, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {state_point['Label']: executor.submit(
+            refine, state_point['Label'], state_point['Box_Length'], state_point['Temperature'],
+            os.path.join(directory, 'cg-interaction', f'{state_point["Label"]}t.table'),
+            os.path.join(directory, 'ref-rdf', f'{state_point["Label"]}t.rdf'), output_directory, **parameters)
+            for state_point in state_points}
+        logs = []
+        for label, future in futures.items():
+            try:
+                logs += future.result()
+            except Exception as error:
+                print(f'Label {label} failed: {error!r}')
+    return pd.DataFrame(logs)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Iterative Boltzmann inversion of the CG interaction tables')
+    parser.add_argument('--labels', type=int, nargs='+', help='Labels of state points (default all)')
+    parser.add_argument('--output-directory', default='ibi', help='Directory of the refined tables and logs')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--alpha', type=float, default=0.2, help='Damping of the potential update')
+    parser.add_argument('--replicas', type=int, default=16, help='Monte Carlo replicas per state point')
+    parser.add_argument('--sweeps', type=int, default=200, help='Monte Carlo sweeps per iteration')
+    parser.add_argument('--equilibration', type=int, default=20, help='Sweeps before sampling in every iteration')
+    parser.add_argument('--tolerance', type=float, default=None, help='Stop below this RMS deviation of g(r)')
+    parser.add_argument('--processes', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    state_points = read_state_points(os.path.join(DATA_DIR, 'statepoint.in'))
+    if args.labels:
+        state_points = [state_point for state_point in state_points if state_point['Label'] in args.labels]
+    tic = time.perf_counter()
+    logs = refine_state_points(state_points, args.output_directory, args.processes, iterations=args.iterations,
+                               alpha=args.alpha, replicas=args.replicas, sweeps=args.sweeps,
+                               equilibration=args.equilibration, tolerance=args.tolerance, seed=args.seed)
+    if len(logs) > 0:
+        logs.to_csv(os.path.join(args.output_directory, 'ibi.csv'), index=False)
+        print(logs.groupby('label').last()[['iteration', 'rms', 'max', 'integrated']])
+    print(f'Refined {len(state_points)} state points in {time.perf_counter() - tic:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
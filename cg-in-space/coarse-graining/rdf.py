@@ -0,0 +1,195 @@
+#!/bin/python3
+r""" Centre-of-mass radial distribution functions of the constant volume state points
+
+The molecular centres of mass are computed from the dump file of a state point (or its
+trajectory store, see trajectory_store.py, if it was converted) with the molecule ids
+and masses of data.initial. Pairs within half the box length are found with a periodic
+KD-tree (scipy.spatial.cKDTree with boxsize), and the pair distances are histogrammed as
+
+ .. math::
+
+     g(r) = \frac{V}{N^2} \frac{2 \, n(r)}{4 \pi r^2 \Delta r}
+
+in 180 bins from 0 to L/2, as the files in cg-rdf/ and ref-rdf/. The frames of all state
+points are spread over a process pool, and the RDF of label N in statepoint.in is written as
+`<N>t.rdf`:
+
+    python3 rdf.py --output-directory rdf              # All 23 state points
+    python3 rdf.py --labels 1 14 --frame-stride 10
+
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from cg_data import read_state_points
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'cg-in-time')
+ANALYSIS_DIR = os.path.join(ROOT, 'T380_L35.944')
+CONSTANT_VOLUME_DIR = os.path.join(ROOT, 'constant_volume')
+sys.path.insert(0, ANALYSIS_DIR)
+
+NUMBER_OF_BINS = 180
+
+
+def state_point_directory(temperature, box_length, root=CONSTANT_VOLUME_DIR):
+    ''' Directory T<temperature>_L<box length> of a state point (without suffix), or None '''
+    from glob import glob
+    for directory in sorted(glob(os.path.join(root, 'T*_L*'))):
+        elements = os.path.basename(directory)[1:].split('_L')
+        try:
+            T, L = float(elements[0]), float(elements[1])
+        except (IndexError, ValueError):  # E.g. a suffix as in T380_L35.944_c0
+            continue
+        if np.isclose(T, temperature) and np.isclose(L, box_length):
+            return directory
+    return None
+
+
+def open_trajectory(dump_filename):
+    ''' Trajectory store of a dump file if one was converted, otherwise a DumpTrajectory '''
+    store = f'{dump_filename}.store'
+    if os.path.exists(os.path.join(store, 'meta.json')):
+        from trajectory_store import open_store
+        return open_store(dump_filename, store)
+    from trajectory import DumpTrajectory
+    return DumpTrajectory(dump_filename)
+
+
+def bin_edges(box_length, number_of_bins=NUMBER_OF_BINS):
+    ''' Edges of number_of_bins bins from 0 to half the box length '''
+    return np.linspace(0, box_length / 2, number_of_bins + 1)
+
+
+def pair_distances(positions, box_lengths, cutoff):
+    ''' Indices (pairs, 2) and distances of all pairs within cutoff under periodic boundaries
+
+    positions is an array of shape (particles, 3), in an orthogonal box with box_lengths.
+    Each pair is found once, with a periodic KD-tree (the cutoff must be at most half
+    the box length).
+    '''
+    from scipy.spatial import cKDTree
+    box_lengths = np.broadcast_to(np.asarray(box_lengths, dtype=float), (3,))
+    wrapped = np.mod(positions, box_lengths)
+    wrapped[wrapped >= box_lengths] = 0.0  # np.mod can round up to the box length
+    tree = cKDTree(wrapped, boxsize=box_lengths)
+    pairs = tree.query_pairs(cutoff, output_type='ndarray')
+    separation = wrapped[pairs[:, 1]] - wrapped[pairs[:, 0]]
+    separation -= box_lengths * np.round(separation / box_lengths)
+    return pairs, np.sqrt((separation**2).sum(axis=1))
+
+
+def pair_distance_histogram(positions, box_lengths, edges):
+    ''' Histogram of distances of all pairs within edges[-1] under periodic boundaries '''
+    return np.histogram(pair_distances(positions, box_lengths, edges[-1])[1], bins=edges)[0]
+
+
+def _rdf_frames(dump_filename, data_filename, indices, edges, frames_per_chunk=64):
+    ''' Sum of pair histograms and of the ideal gas normalization N^2/V of frames (in a worker) '''
+    from molecules import molecule_mapping, center_of_mass
+    from trajectory_store import read_lammps_data
+    trajectory = open_trajectory(dump_filename)
+    data = read_lammps_data(data_filename)
+    index, weights, _ = molecule_mapping(data['molecule'], data['mass'])
+    histogram = np.zeros(len(edges) - 1)
+    normalization = 0.0
+    for start in range(0, len(indices), frames_per_chunk):
+        chunk = indices[start:start + frames_per_chunk]
+        com = center_of_mass(trajectory.read(chunk), index, weights)
+        for frame, positions in zip(chunk, com):
+            box_lengths = trajectory.boxes[frame, :, 1] - trajectory.boxes[frame, :, 0]
+            histogram += pair_distance_histogram(positions, box_lengths, edges)
+            normalization += len(positions)**2 / np.prod(box_lengths)
+    return histogram, normalization
+
+
+def radial_distribution_function(histogram, normalization, edges):
+    ''' Bin centres and g(r) from summed pair histograms and N^2/V (see _rdf_frames) '''
+    r = (edges[1:] + edges[:-1]) / 2
+    shell_volumes = 4 / 3 * np.pi * (edges[1:]**3 - edges[:-1]**3)
+    return r, 2 * histogram / (normalization * shell_volumes)
+
+
+def write_rdf(filename, r, g):
+    ''' Write an RDF in the format of cg-rdf/ and ref-rdf/ (r = ...<tab>g(r) = ...) '''
+    with open(filename, 'w') as file:
+        file.write(''.join(f'r = {r_i:.6f}\tg(r) = {g_i:.6f}\n' for r_i, g_i in zip(r, g)))
+
+
+def rdf_state_points(state_points, output_directory='rdf', dump_filename='dump.constant_volume',
+                     data_filename='data.initial', first_frame=0, frame_stride=1, last_frame=None,
+                     frames_per_task=256, processes=None, root=CONSTANT_VOLUME_DIR):
+    ''' Centre-of-mass RDFs of state points (see cg_data.read_state_points) with frames in a process pool
+
+    The data file is taken from the state point directory, or else from the analysis
+    directory (../../cg-in-time/T380_L35.944; all state points have the same molecules).
+    Writes `<label>t.rdf` to output_directory, and returns a dictionary of label: (r, g(r)).
+    State points without a dump file are reported and skipped.
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    os.makedirs(output_directory, exist_ok=True)
+    tic = time.perf_counter()
+    jobs = {}
+    for state_point in state_points:
+        label = state_point['Label']
+        directory = state_point_directory(state_point['Temperature'], state_point['Box_Length'], root)
+        dump = directory and os.path.join(directory, dump_filename)
+        if dump is None or not os.path.exists(dump):
+            print(f'Label {label}: no {dump_filename} for T = {state_point["Temperature"]} K, '
+                  f'L = {state_point["Box_Length"]} Å, skipped')
+            continue
+        data = os.path.join(directory, data_filename)
+        if not os.path.exists(data):
+            data = os.path.join(ANALYSIS_DIR, data_filename)
+        trajectory = open_trajectory(dump)  # Builds the frame index once, before the workers read it
+        indices = np.arange(len(trajectory))[first_frame:last_frame:frame_stride]
+        jobs[label] = {'dump': dump, 'data': data, 'indices': indices,
+                       'edges': bin_edges(state_point['Box_Length'])}
+    results = {}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {label: [executor.submit(_rdf_frames, job['dump'], job['data'],
+                                           job['indices'][start:start + frames_per_task], job['edges'])
+                           for start in range(0, len(job['indices']), frames_per_task)]
+                   for label, job in jobs.items()}
+        for label, tasks in futures.items():
+            histogram, normalization = 0.0, 0.0
+            for task in tasks:
+                task_histogram, task_normalization = task.result()
+                histogram = histogram + task_histogram
+                normalization += task_normalization
+            r, g = radial_distribution_function(histogram, normalization, jobs[label]['edges'])
+            write_rdf(os.path.join(output_directory, f'{label}t.rdf'), r, g)
+            results[label] = (r, g)
+            print(f'Label {label}: {len(jobs[label]["indices"])} frames of {jobs[label]["dump"]}')
+    print(f'Wrote {len(results)} of {len(state_points)} RDFs to {output_directory} '
+          f'in {time.perf_counter() - tic:.1f} s')
+    return results
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Centre-of-mass RDFs of the state points of statepoint.in')
+    parser.add_argument('--state-points', default='statepoint.in', help='Label, box length and temperature table')
+    parser.add_argument('--labels', type=int, nargs='+', help='Labels of state points (default all)')
+    parser.add_argument('--root', default=CONSTANT_VOLUME_DIR, help='Directory with the T*_L* state points')
+    parser.add_argument('--output-directory', default='rdf', help='Directory of the <label>t.rdf files')
+    parser.add_argument('--dump', dest='dump_filename', default='dump.constant_volume')
+    parser.add_argument('--data', dest='data_filename', default='data.initial')
+    parser.add_argument('--first-frame', type=int, default=0)
+    parser.add_argument('--frame-stride', type=int, default=1)
+    parser.add_argument('--last-frame', type=int, default=None)
+    parser.add_argument('--processes', type=int, default=None, help='Number of worker processes')
+    args = parser.parse_args()
+    state_points = read_state_points(args.state_points)
+    if args.labels:
+        state_points = [state_point for state_point in state_points if state_point['Label'] in args.labels]
+    rdf_state_points(state_points, args.output_directory, args.dump_filename, args.data_filename,
+                     args.first_frame, args.frame_stride, args.last_frame, processes=args.processes,
+                     root=args.root)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,130 +2,214 @@
 
 import numpy as np
 
+from tracing import span, traced
+from trajectory import _dump_columns, _dump_positions
+
+
+def _count_dump_frames(filename, chunk_size=2**26):
+    ''' Count frames in a LAMMPS dump file by scanning raw bytes for the TIMESTEP item '''
+    key = b'ITEM: TIMESTEP'
+    count = 0
+    tail = b''
+    with open(filename, 'rb') as file:
+        chunk = file.read(chunk_size)
+        while chunk:
+            data = tail + chunk
+            count += data.count(key)
+            tail = data[-(len(key) - 1):]
+            chunk = file.read(chunk_size)
+    return count
+
+
+@traced('parse')
 def read_dump(filename='dump.lammps', verbose=False):
-    c = 0
-    box=[[0, 10],[0, 10],[0, 10]]
-    with open(filename) as file:
+    ''' Read unwrapped positions from a LAMMPS dump file
+
+    The frames are counted in a fast scan of the file, so positions can be written
+    straight into a preallocated array of shape (frames, atoms, 3). The columns of the
+    ATOMS header are mapped once per file, and each ATOMS block is parsed with a single
+    NumPy call. Scaled coordinates are converted with the box of their own frame,
+    so boxes that change between frames are handled.
+
+    Returns::
+
+        frames, box, types
+
+    where box is the box of the last frame.
+    '''
+    from itertools import islice
+    number_of_frames = _count_dump_frames(filename)
+    if verbose:
+        print(f'{number_of_frames=}')
+    frames = np.zeros((number_of_frames, 0, 3), dtype=float)
+    types = np.zeros(0, dtype=int)
+    box = np.array([[0, 10], [0, 10], [0, 10]], dtype=float)
+    columns, layout = None, None
+    frame = 0
+    with open(filename, 'rb') as file:
         line = file.readline()
-        frames=[]
         while line:
-            c = c + 1
-            if 'ITEM: NUMBER OF ATOMS' in line:
-                line = file.readline()
-                number_of_atoms = int(line)
-                types = np.zeros(number_of_atoms, dtype=int)
-                if verbose:
-                    print(f'{number_of_atoms=}')
-            if 'ITEM: BOX BOUNDS' in line:
+            if line.startswith(b'ITEM: NUMBER OF ATOMS'):
+                number_of_atoms = int(file.readline())
+                if frame == 0:
+                    frames = np.zeros((number_of_frames, number_of_atoms, 3), dtype=float)
+                    types = np.zeros(number_of_atoms, dtype=int)
+                    if verbose:
+                        print(f'{number_of_atoms=}')
+                elif number_of_atoms != frames.shape[1]:
+                    raise ValueError(f'Number of atoms changed from {frames.shape[1]} to {number_of_atoms} in frame {frame}')
+            elif line.startswith(b'ITEM: BOX BOUNDS'):
                 for dim in 0, 1, 2:
                     elms = file.readline().split()
-                    box[dim] = [float(elms[0]), float(elms[1])]
-                if verbose:
-                    print(f'{box=}')
-            if 'ITEM: ATOMS' in line:
-                pos = np.zeros((number_of_atoms, 3), dtype=float)
-                elms = line.split()
-                columns = elms[2:]
-                if verbose:
-                    print(f'{columns=}')
-                def find(c, s):
-                    for i, e in enumerate(c):
-                        if s in e:
-                            return i
-                idx_id = find(columns, 'id')
-                idx_type = find(columns, 'type')
-                idx_xs = find(columns, 'xs')
-                idx_ys = find(columns, 'ys')
-                idx_zs = find(columns, 'zs')
-                idx_ix = find(columns, 'ix')
-                idx_iy = find(columns, 'iy')
-                idx_iz = find(columns, 'iz')                
-                for _ in range(number_of_atoms):
-                    elms = file.readline().split()
-                    i = int(elms[idx_id])-1  # Note: LAMMPS start counting at zero
-                    t = int(elms[idx_type])
-                    x = (float(elms[idx_xs])+float(elms[idx_ix]))
-                    x = x*(box[0][1]-box[0][0])
-                    y = (float(elms[idx_ys])+float(elms[idx_iy]))
-                    y = y*(box[1][1]-box[1][0])
-                    z = (float(elms[idx_zs])+float(elms[idx_iz]))
-                    z = z*(box[0][1]-box[0][0])
-                    types[i] = t
-                    pos[i, 0] = x
-                    pos[i, 1] = y
-                    pos[i, 2] = z
-                frames.append(pos)
+                    box[dim] = float(elms[0]), float(elms[1])
+            elif line.startswith(b'ITEM: ATOMS'):
+                if line.split()[2:] != columns:
+                    columns = line.split()[2:]
+                    layout = _dump_columns([c.decode() for c in columns])
+                    if verbose:
+                        print(f'{columns=}')
+                block = b''.join(islice(file, number_of_atoms))
+                data = np.fromstring(block, sep=' ')
+                if data.size != number_of_atoms * len(columns):
+                    if file.read(1):
+                        raise ValueError(f'Frame {frame} of {filename} is incomplete')
+                    break  # Incomplete last frame, e.g. of a running simulation
+                data = data.reshape(number_of_atoms, len(columns))
+                if layout['id'] is None:
+                    ids = np.arange(number_of_atoms)
+                else:
+                    ids = data[:, layout['id']].astype(int) - 1  # Note: LAMMPS start counting at one
+                frames[frame, ids] = _dump_positions(data, layout, box)
+                if layout['type'] is not None:
+                    types[ids] = data[:, layout['type']]
+                frame = frame + 1
             line = file.readline()
-    return np.array(frames), np.array(box), types
+    return frames[:frame], box, types
 
 def remove_drift(frames):
     """ Remove drift of geometric_center"""
     geometric_center = frames.mean(axis=1)
     return frames - geometric_center[:,np.newaxis,:]
 
+@traced('msd')
 def compute_mean_squared_displacement(frames, f_i = 0):
+    """ Mean squared displacement from frame f_i
+
+    frames is either an array of shape (frames, atoms, 3), or a lazy trajectory
+    (e.g. trajectory.DumpTrajectory) that is streamed one frame at a time.
+    """
+    if not isinstance(frames, np.ndarray):
+        reference = remove_drift(frames[f_i][np.newaxis])[0]
+        return np.array([((reference - remove_drift(frame[np.newaxis])[0])**2).mean() for frame in frames])
     frames = remove_drift(frames)
     MSD = ((frames[f_i, :]-frames)**2).mean(axis=1).mean(axis=1)
     return MSD
 
-def thermo_data_as_dataframe(filename='log.lammps', time_step=None, first_frame=0, stride_frame=1, last_frame=None):
-    ''' Read thermodynamic data from LAMMPS log file '''
+@traced('msd')
+def compute_multi_origin_mean_squared_displacement(frames, atoms_per_chunk=128):
+    r""" Mean squared displacement averaged over all time origins
+
+    The average over origins is computed for each atom with the FFT decomposition
+
+     .. math::
+
+         \frac{1}{N-m}\sum_{k=0}^{N-m-1} [r(k+m) - r(k)]^2 = S_1(m) - 2 S_2(m)
+
+    where :math:`S_2(m)` is the autocorrelation of the positions (computed with
+    the FFT algorithm and zero padding), and :math:`S_1(m)` is computed
+    with a recursion over the squared positions. Thus the calculation scales
+    as $N\ln(N)$. As in compute_mean_squared_displacement the drift of the geometric
+    center is removed, and the result is the mean over atoms and Cartesian directions.
+    Atoms are handled in chunks of atoms_per_chunk to bound the memory use.
+
+    frames is either an array of shape (frames, atoms, 3), or a lazy trajectory
+    (e.g. trajectory.DumpTrajectory) that is read into memory once.
+
+    Returns::
+
+        MSD, counts, standard_error
+
+    where counts is the number of (origin, atom) samples for each lag time,
+    and standard_error is the standard error of the mean over atoms.
+    """
+    from numpy.fft import rfft, irfft
+    if not isinstance(frames, np.ndarray):
+        frames = frames.read()
+    number_of_frames, number_of_atoms, dimensions = frames.shape
+    geometric_center = frames.mean(axis=1)
+    origins = number_of_frames - np.arange(number_of_frames)
+    msd_sum = np.zeros(number_of_frames)
+    msd_squared_sum = np.zeros(number_of_frames)
+    for start in range(0, number_of_atoms, atoms_per_chunk):
+        r = frames[:, start:start + atoms_per_chunk] - geometric_center[:, np.newaxis, :]
+        fr = rfft(r, n=2 * number_of_frames, axis=0)
+        S2 = irfft(fr * np.conj(fr), n=2 * number_of_frames, axis=0)[:number_of_frames].sum(axis=2)
+        del fr
+        r2 = (r**2).sum(axis=2)
+        head = np.cumsum(r2, axis=0) - r2           # sum_{k < m} r2(k)
+        tail = np.cumsum(r2[::-1], axis=0) - r2[::-1]  # sum_{k > N-1-m} r2(k)
+        S1 = 2 * r2.sum(axis=0) - head - tail
+        msd = (S1 - 2 * S2) / origins[:, np.newaxis] / dimensions
+        msd_sum += msd.sum(axis=1)
+        msd_squared_sum += (msd**2).sum(axis=1)
+    MSD = msd_sum / number_of_atoms
+    variance = np.maximum(msd_squared_sum / number_of_atoms - MSD**2, 0)
+    standard_error = np.sqrt(variance / max(number_of_atoms - 1, 1))
+    counts = origins * number_of_atoms
+    return MSD, counts, standard_error
+
+@traced('parse')
+def thermo_data_as_dataframe(filename='log.lammps', time_step=None, first_frame=0, stride_frame=1, last_frame=None,
+                             usecols=None, dtype=float, processes=None, cache=True):
+    ''' Read thermodynamic data from LAMMPS log file
+
+    Only the columns in usecols (default all) are returned, in the chosen dtype.
+    The log file is parsed in parallel byte ranges, and the parsed columns are cached
+    on disk, so later calls memory-map the cache instead (see thermo_log.py).
+    '''
     import pandas as pd
-    with open(filename) as file:
-        not_found_beginning = True
-        while not_found_beginning:
-            elements = file.readline().split()
-            if len(elements) > 0:
-                if elements[0] == 'Step':
-                    not_found_beginning = False
-        columns = elements
-        elements = file.readline().split()
-        data = []
-        frame = 0
-        while len(elements) == len(columns):
-            frame = frame + 1
-            if frame > first_frame and (frame-1)%stride_frame==0:
-                data.append([float(x) for x in elements])
-            if last_frame and frame > last_frame:
-                break
-            elements = file.readline().split()
-    dataframe = pd.DataFrame(columns=columns, data=data)
+    from thermo_log import read_thermo_log, frame_slice
+    if usecols is not None and time_step and 'Step' not in usecols:
+        usecols = ['Step'] + list(usecols)
+    columns = read_thermo_log(filename, usecols=usecols, dtype=dtype,
+                              selection=frame_slice(first_frame, stride_frame, last_frame),
+                              processes=processes, cache=cache)
+    dataframe = pd.DataFrame({column: np.array(data) for column, data in columns.items()})
     if time_step:
         dataframe.insert(loc=0, column='Time', value=dataframe['Step'] * time_step)
     return dataframe
 
 
+@traced('parse')
+def thermo_runs_as_dataframe(filenames, time_step=None, usecols=None, dtype=float, processes=None, verbose=False):
+    ''' Read thermodynamic data of several runs (restarts and continuation logs)
+
+    filenames is a list of LAMMPS log files, e.g. ['log.lammps', 'log_2nd.lammps'],
+    or a single log file with several runs. The runs are joined into one contiguous
+    time series (see thermo_log.read_thermo_runs).
+    '''
+    import pandas as pd
+    from thermo_log import read_thermo_runs
+    columns = read_thermo_runs(filenames, usecols=usecols, dtype=dtype, time_step=time_step,
+                               processes=processes, verbose=verbose)
+    return pd.DataFrame(columns, copy=False)
+
+
+@traced('binning')
 def run_avg(x, n=128):
     '''  Running average of n data points. '''
-    from numpy import mean, zeros
-    N = int(len(x) / n)
-    out = zeros(N)
-    for i in range(N):
-        start = i * n
-        stop = (i + 1) * n
-        out[i] = mean(x[start:stop])
-    return out
+    from binning import linear_average
+    return linear_average(x, n)
 
 
+@traced('binning')
 def run_avg_log(x, points_per_decade=24, base=None):
     """ Logarithmic averaging."""
-    from numpy import mean, array
-    if not base:
-        base = 10 ** (1 / points_per_decade)
-    if base < 1:
-        print('Warning: Base should be larger than 1')
-    floor, ceil, next_ceil = 0, 1, 1.0
-    out = []
-    while ceil < x.size:
-        out.append(mean(x[floor:ceil]))
-        # Set limits for next average range
-        floor = ceil
-        while int(next_ceil) == ceil:
-            next_ceil = next_ceil * base
-        ceil = int(next_ceil)
-    return array(out)
+    from binning import log_average
+    return log_average(x, points_per_decade, base)
 
 
+@traced('fft')
 def time_correlation(x, y=None):
     r''' Compute the time correlation function 
     The time correlation function :math:`C(t)` is computed using
@@ -152,6 +236,7 @@ def time_correlation(x, y=None):
     return real(xy)
 
 
+@traced('fft')
 def frequency_dependent_response(x, y=None, dt=1.0, prefactor=1.0):
     r''' Frequency dependent responce
     The frequency dependent responce :math:`\mu(\omega)` is estimate from time-series
@@ -196,111 +281,431 @@ def frequency_dependent_response(x, y=None, dt=1.0, prefactor=1.0):
     return omega, mu
 
 
-def main():
+def _result_cache(cache):
+    ''' ResultCache of cache=True (default cache), False/None (no cache) or a ResultCache '''
+    if cache is True:
+        from result_cache import ResultCache
+        return ResultCache()
+    return cache or None
+
+
+def _cached(cache, name, compute, inputs, parameters):
+    cache = _result_cache(cache)
+    if cache is None:
+        return compute()
+    return cache.cached(name, compute, inputs=inputs, parameters=parameters)[0]
+
+
+def thermo_statistics(filename='log.lammps', time_step=2e-15, first_frame=0, stride_frame=1,
+                      last_frame=None, cache=True, processes=None):
+    ''' Summary statistics (df.describe()) of thermodynamic data, as in thermo_stats.csv
+
+    The result is stored in the result cache (see result_cache.py), and is loaded
+    from the cache if the log file and the parameters are unchanged. processes is the
+    number of processes parsing the log file (see thermo_log.parse_thermo_log).
+    '''
+    def compute():
+        return thermo_data_as_dataframe(filename, time_step, first_frame, stride_frame, last_frame,
+                                        processes=processes).describe()
+    parameters = {'time_step': time_step, 'first_frame': first_frame,
+                  'stride_frame': stride_frame, 'last_frame': last_frame}
+    return _cached(cache, 'thermo_statistics', compute, [filename], parameters)
+
+
+def energy_time_correlation(filename='log.lammps', time_step=2e-15, first_frame=0, stride_frame=1,
+                            last_frame=None, points_per_decade=24, cache=True, processes=None):
+    ''' Normalized potential energy time correlation on a logarithmic time scale (in ns)
+
+    The last 2**k frames are used, as in time_correlation.csv. Returns a DataFrame
+    with columns Time and C_EE, cached as thermo_statistics.
+    '''
+    def compute():
+        import pandas as pd
+        df = thermo_data_as_dataframe(filename, time_step, first_frame, stride_frame, last_frame,
+                                      usecols=['PotEng'], processes=processes)
+        Nl2 = 2**int(np.log2(len(df)))
+        xx = df.Time[:Nl2]
+        yy = df.PotEng[-Nl2:]
+        c = time_correlation(yy) / yy.var()
+        return pd.DataFrame({
+            'Time': run_avg_log(xx * 1e9, points_per_decade),
+            'C_EE': run_avg_log(c, points_per_decade)
+        })
+    parameters = {'time_step': time_step, 'first_frame': first_frame, 'stride_frame': stride_frame,
+                  'last_frame': last_frame, 'points_per_decade': points_per_decade}
+    return _cached(cache, 'energy_time_correlation', compute, [filename], parameters)
+
+
+def mean_squared_displacement(filename='dump.constant_volume', time_step=2e-15, cache=True):
+    ''' Multi-origin mean squared displacement of a dump file, as in mean_squared_displacement.csv
+
+    Returns a DataFrame with columns Time (in ns), MSD, MSD_error and Count, cached as
+    thermo_statistics.
+    '''
+    def compute():
+        import pandas as pd
+        from trajectory import DumpTrajectory
+        frames = DumpTrajectory(filename)
+        MSD, counts, MSD_error = compute_multi_origin_mean_squared_displacement(frames)
+        return pd.DataFrame({
+            'Time': (frames.steps - frames.steps[0]) * time_step * 1e9,
+            'MSD': MSD,
+            'MSD_error': MSD_error,
+            'Count': counts
+        })
+    return _cached(cache, 'mean_squared_displacement', compute, [filename], {'time_step': time_step})
+
+
+def molecular_mean_squared_displacement(filename='dump.constant_volume', data_filename='data.initial',
+                                        time_step=2e-15, cache=True):
+    ''' Multi-origin mean squared displacement of the molecular centres of mass
+
+    Molecule ids and masses of the atoms are read from the LAMMPS data file. Returns a
+    DataFrame with columns Time (in ns), MSD, MSD_error and Count, cached as
+    thermo_statistics, as in molecular_mean_squared_displacement.csv.
+    '''
+    def compute():
+        import pandas as pd
+        from molecules import molecular_mean_squared_displacement as com_msd
+        from trajectory import DumpTrajectory
+        from trajectory_store import read_lammps_data
+        frames = DumpTrajectory(filename)
+        data = read_lammps_data(data_filename)
+        if len(data['id']) != frames.number_of_atoms:
+            raise ValueError(f'{data_filename} has {len(data["id"])} atoms, but {filename} has {frames.number_of_atoms}')
+        MSD, counts, MSD_error = com_msd(frames, data['molecule'], data['mass'])
+        return pd.DataFrame({
+            'Time': (frames.steps - frames.steps[0]) * time_step * 1e9,
+            'MSD': MSD,
+            'MSD_error': MSD_error,
+            'Count': counts
+        })
+    return _cached(cache, 'molecular_mean_squared_displacement', compute, [filename, data_filename],
+                   {'time_step': time_step})
+
+
+def self_intermediate_scattering(filename='dump.constant_volume', data_filename='data.initial', time_step=2e-15,
+                                 q_values=(0.5, 1.0, 1.5, 2.0), molecular=False, points_per_decade=10,
+                                 cache=True):
+    ''' Self-intermediate scattering function, MSD and non-Gaussian parameter of a dump file
+
+    The dump file is converted to a trajectory store (see trajectory_store.py) for fast
+    access to the frames of many time origins. Returns a DataFrame with columns Time (in ns),
+    MSD, alpha_2, Count and F_s(q) for every q (in 1/Angstrom), e.g. F_s_1.00, cached as
+    thermo_statistics. With molecular=True, molecular centres of mass are used.
+    '''
+    def compute():
+        import pandas as pd
+        from dynamics import self_dynamics
+        from trajectory_store import open_store
+        store = open_store(filename, data_filename=data_filename if molecular else None)
+        result = self_dynamics(store, q_values, points_per_decade=points_per_decade, molecular=molecular)
+        df = pd.DataFrame({
+            'Time': (store.steps[result['lags']] - store.steps[0]) * time_step * 1e9,
+            'MSD': result['MSD'],
+            'alpha_2': result['alpha_2'],
+            'Count': result['count']
+        })
+        for i, q in enumerate(result['q']):
+            df[f'F_s_{q:.2f}'] = result['F_s'][:, i]
+        return df
+    inputs = [filename, data_filename] if molecular else [filename]
+    parameters = {'time_step': time_step, 'q_values': [float(q) for q in q_values], 'molecular': molecular,
+                  'points_per_decade': points_per_decade}
+    return _cached(cache, 'self_intermediate_scattering', compute, inputs, parameters)
+
+
+def dynamic_susceptibility(filename='dump.constant_volume', data_filename='data.initial', time_step=2e-15,
+                           thresholds=(0.3, 0.5, 1.0), molecular=False, points_per_decade=10,
+                           number_of_blocks=8, cache=True):
+    ''' Overlap function and four-point susceptibility chi_4 of a dump file
+
+    Returns a DataFrame with columns Time (in ns), and Q_a, chi4_a and chi4_error_a for
+    every threshold a (in Angstrom), e.g. chi4_0.50, cached as thermo_statistics, as in
+    four_point_susceptibility.csv. With molecular=True, molecular centres of mass are used.
+    '''
+    def compute():
+        import pandas as pd
+        from heterogeneity import overlap_series, four_point_susceptibility
+        from trajectory_store import open_store
+        store = open_store(filename, data_filename=data_filename if molecular else None)
+        overlap = overlap_series(store, thresholds, points_per_decade=points_per_decade, molecular=molecular)
+        Q_mean, chi_4, chi_4_error = four_point_susceptibility(overlap['Q'], overlap['number_of_particles'],
+                                                               number_of_blocks)
+        df = pd.DataFrame({'Time': (store.steps[overlap['lags']] - store.steps[0]) * time_step * 1e9})
+        for i, a in enumerate(overlap['thresholds']):
+            df[f'Q_{a:.2f}'] = Q_mean[:, i]
+            df[f'chi4_{a:.2f}'] = chi_4[:, i]
+            df[f'chi4_error_{a:.2f}'] = chi_4_error[:, i]
+        return df
+    inputs = [filename, data_filename] if molecular else [filename]
+    parameters = {'time_step': time_step, 'thresholds': [float(a) for a in thresholds], 'molecular': molecular,
+                  'points_per_decade': points_per_decade, 'number_of_blocks': number_of_blocks}
+    return _cached(cache, 'dynamic_susceptibility', compute, inputs, parameters)
+
+
+@traced('fitting')
+def diffusion_coefficient(t, MSD):
+    ''' Diffusion coefficient from the first half of the mean squared displacement '''
+    ii = int(len(MSD) / 2)
+    return float(np.mean(MSD[:ii]) / np.mean(t[:ii]) / 6)
+
+
+def thermo_summary(thermo_stats):
+    ''' Text of thermo_stats.txt from the summary statistics of thermodynamic data '''
+    mean = thermo_stats.loc['mean']
+    return ''.join(f'df.{column}.mean() = {float(mean[column])!r}\n'
+                   for column in ['Temp', 'Density', 'Press', 'PotEng']) + '\n'
+
+
+def read_sim_info(filename='sim_info.toml'):
+    ''' Settings of a state point from sim_info.toml (empty if there is no such file) '''
+    import os
+    if not os.path.exists(filename):
+        return {}
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11
+        import tomli as tomllib
+    with open(filename, 'rb') as file:
+        return tomllib.load(file)
+
+
+STAGES = ['thermo', 'correlation', 'msd', 'com_msd', 'fs', 'chi4']
+
+# Settings of the command line, and their default values (unless given in sim_info.toml).
+# The sim_info.toml files of the state points give the thermo lines per nanosecond as
+# steps_per_nanosecond, from which steps_per_printout is derived if it is not given.
+DEFAULTS = {
+    'log_filename': 'log.lammps',
+    'dump_filename': 'dump.constant_volume',
+    'data_filename': 'data.initial',
+    'time_step': 2e-15,
+    'steps_per_printout': 40,
+    'first_frame': 0,
+    'frame_stride': 1,
+    'last_frame': None,
+    'q_values': [0.5, 1.0, 1.5, 2.0],
+    'thresholds': [0.3, 0.5, 1.0]
+}
+
+
+def parse_arguments(argv=None):
+    ''' Command line arguments, with defaults from sim_info.toml and DEFAULTS '''
+    import argparse
+    parser = argparse.ArgumentParser(description='Analyse a LAMMPS simulation of a state point')
+    parser.add_argument('stages', nargs='*', help=f'Stages to run (default all): {", ".join(STAGES)}')
+    parser.add_argument('--log', dest='log_filename', help='LAMMPS log file')
+    parser.add_argument('--dump', dest='dump_filename', help='LAMMPS dump file')
+    parser.add_argument('--data', dest='data_filename', help='LAMMPS data file with molecule ids and masses')
+    parser.add_argument('--time-step', type=float, help='Time step in seconds')
+    parser.add_argument('--steps-per-printout', type=int, help='Time steps between thermo lines')
+    parser.add_argument('--first-frame', type=int)
+    parser.add_argument('--frame-stride', type=int)
+    parser.add_argument('--last-frame', type=int)
+    parser.add_argument('--q', dest='q_values', type=float, nargs='+', help='Wave numbers of F_s(q, t) [1/Å]')
+    parser.add_argument('--thresholds', type=float, nargs='+', help='Overlap thresholds of chi_4(t) [Å]')
+    parser.add_argument('--molecular', action='store_true',
+                        help='F_s(q, t) and chi_4(t) of molecular centres of mass')
+    parser.add_argument('--sim-info', default='sim_info.toml', help='Settings file (used if it exists)')
+    parser.add_argument('--plot', action='store_true', help='Save figures (PNG)')
+    parser.add_argument('--show', action='store_true', help='Save and show figures')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help='Do not use the result cache')
+    parser.add_argument('--trace', nargs='?', const='trace.jsonl', default=None,
+                        help='Append timing and memory spans to a JSON-lines file (default trace.jsonl)')
+    args = parser.parse_args(argv)
+    unknown = [stage for stage in args.stages if stage not in STAGES]
+    if unknown:
+        parser.error(f'Unknown stages {unknown}, choose from {STAGES}')
+    sim_info = read_sim_info(args.sim_info)
+    derive_printout = args.steps_per_printout is None and 'steps_per_printout' not in sim_info
+    for key, default in DEFAULTS.items():
+        if getattr(args, key) is None:
+            setattr(args, key, sim_info.get(key, default))
+    if derive_printout and 'steps_per_nanosecond' in sim_info:
+        args.steps_per_printout = round(1e-9 / args.time_step / sim_info['steps_per_nanosecond'])
+    args.stages = args.stages or STAGES
+    args.plot = args.plot or args.show
+    return args
+
+
+def _figure(args):
+    ''' New figure, importing matplotlib (headless unless figures are shown) '''
+    import matplotlib
+    if not args.show:
+        matplotlib.use('Agg')
     import matplotlib.pyplot as plt
-    import time
-    import numpy as np
-    import pandas as pd
+    plt.figure()
+    return plt
+
+
+def _save_figure(plt, args, filename):
+    with span('plot', filename=filename):
+        plt.savefig(filename, dpi=72, bbox_inches='tight')
+    if args.show:
+        plt.show()
+    plt.close()
 
-    # Load data
-    tic = time.perf_counter()
-    first_frame = 0
-    frame_stride = 1    
-    last_frame = None
-    time_step = 2e-15
-    steps_per_printout = 40
-    print(f'{first_frame = } {frame_stride = } {last_frame = } {steps_per_printout = }')
-    spns = int(1e-9 / time_step / steps_per_printout / frame_stride)  # Steps per nanosecond
+
+def main(argv=None):
+    import time
+    args = parse_arguments(argv)
+    if args.trace:
+        from tracing import enable
+        enable(args.trace)
+    selection = dict(time_step=args.time_step, first_frame=args.first_frame,
+                     stride_frame=args.frame_stride, last_frame=args.last_frame)
+    print(f'{args.first_frame = } {args.frame_stride = } {args.last_frame = } {args.steps_per_printout = }')
+    spns = int(1e-9 / args.time_step / args.steps_per_printout / args.frame_stride)  # Steps per nanosecond
     print(f'Steps per nanosecond: {spns = }')
-    df = thermo_data_as_dataframe(filename='log.lammps',
-                                  time_step=time_step,
-                                  first_frame=first_frame,
-                                  stride_frame=frame_stride,
-                                  last_frame=last_frame)
-    toc = time.perf_counter()
-    print(f'Wallclock time to load data: {toc-tic} s')
-
-    print(df.head())
-    print(df.tail())
-    print(f'Trajectory of {df.Time.max()/1e-9} ns')
-    
-    for column in df:
-        print(f'Mean {column}: {df[column].mean() }')
-    
-    # Plot pressure
-    plt.figure()
-    # plt.plot(df.Time, df.Press, color='gray')
-    n = spns
-    plt.plot(run_avg(df.Time * 1e9, n), run_avg(df.Press, n), 'bo')
-    plt.title(f'{df.Press.mean()=}')
-    plt.ylabel('Pressure [atm]')
-    plt.xlabel('Time [ns]')
-    plt.savefig('Press.png', dpi=72, bbox_inches='tight')
-    plt.show()
-
-    # Thermodynamic summary
-    df.describe().to_csv('thermo_stats.csv')
-    print(f'{df.Temp.mean() = }\n'
-          f'{df.Density.mean() = }\n'
-          f'{df.Press.mean() = }\n'
-          f'{df.PotEng.mean() = }\n'
-          , file=open('thermo_stats.txt', 'w'))
-
-    N = len(df)
-    Nl2 = 2**int(np.log2(N))
-    print(f"{N} is near {Nl2} = 2**{int(np.log2(Nl2))} ")
-    
-    # Energy time correlation
-    plt.figure()
-    tic = time.perf_counter()
-    xx = df.Time[:Nl2]
-    yy = df.PotEng[-Nl2:]
-    c = time_correlation(yy) / yy.var()
-    toc = time.perf_counter()
-    print(f'Wallclock time for FFT: {toc-tic} s')
-    x, y = run_avg_log(xx * 1e9), run_avg_log(c)
-    plt.plot(x, y)
-    plt.xlabel(r'Time, $t$ [ns]')
-    plt.ylabel(r'$\langle \Delta U(0) \Delta U(t) \rangle/\langle (\Delta U)^2 \rangle$')
-    plt.ylim(-0.02, 0.1)
-    plt.xscale('log')
-    plt.savefig('energy_correlation.png', dpi=72, bbox_inches='tight')
-    plt.show()
-    
-    pd.DataFrame({
-        'Time': x,
-        'C_EE': y
-    }).to_csv('time_correlation.csv', index=False)
-
-    # Mean squared displacement
-    tic = time.perf_counter()
-    frames, box, types = read_dump('dump.constant_volume')
-    toc = time.perf_counter()
-    print(f'Wall clock time to read positions: {toc-tic} s')
-    tic = time.perf_counter()
-    MSD = compute_mean_squared_displacement(frames)
-    toc = time.perf_counter()
-    print(f'Wall clock time to compute MSD: {toc-tic} s')
-    t = 50000*2e-15*1e9*np.arange(len(MSD))
-    ii = int(len(MSD)/2)
-    D = np.mean(MSD[:ii])/np.mean(t[:ii])/6
-    print(f'{D= }')
-    print(f'{D= }', file=open('info.txt', 'a'))    
-    plt.figure()
-    plt.title(f'{D= }')
-    plt.plot(t, MSD, 'o-')
-    plt.plot(t, 6*D*t, '--')
-    plt.xlabel(r'Time, $t$ [ns]')
-    plt.ylabel(r'Mean Squared Displacement [Å$^2$]')
-    plt.xscale('log')
-    plt.yscale('log')
-    plt.savefig('mean_squared_displacement.png', dpi=72, bbox_inches='tight')
-    plt.show()
-
-    pd.DataFrame({
-        'Time': t,
-        'MSD': MSD
-    }).to_csv('mean_squared_displacement.csv', index=False)
+
+    if 'thermo' in args.stages:
+        # Thermodynamic summary
+        tic = time.perf_counter()
+        with span('thermo'):
+            thermo_stats = thermo_statistics(args.log_filename, cache=args.cache, **selection)
+        toc = time.perf_counter()
+        print(f'Wallclock time for thermodynamic summary: {toc-tic} s')
+        print(thermo_stats)
+        with span('write', filename='thermo_stats.csv'):
+            thermo_stats.to_csv('thermo_stats.csv')
+            with open('thermo_stats.txt', 'w') as file:
+                file.write(thermo_summary(thermo_stats))
+        if args.plot:
+            # Plot pressure
+            df = thermo_data_as_dataframe(args.log_filename, usecols=['Press'], **selection)
+            plt = _figure(args)
+            n = spns
+            plt.plot(run_avg(df.Time * 1e9, n), run_avg(df.Press, n), 'bo')
+            plt.title(f'{df.Press.mean()=}')
+            plt.ylabel('Pressure [atm]')
+            plt.xlabel('Time [ns]')
+            _save_figure(plt, args, 'Press.png')
+
+    if 'correlation' in args.stages:
+        # Energy time correlation
+        tic = time.perf_counter()
+        with span('correlation'):
+            correlation = energy_time_correlation(args.log_filename, cache=args.cache, **selection)
+        toc = time.perf_counter()
+        print(f'Wallclock time for energy time correlation: {toc-tic} s')
+        with span('write', filename='time_correlation.csv'):
+            correlation.to_csv('time_correlation.csv', index=False)
+        if args.plot:
+            plt = _figure(args)
+            plt.plot(correlation.Time, correlation.C_EE)
+            plt.xlabel(r'Time, $t$ [ns]')
+            plt.ylabel(r'$\langle \Delta U(0) \Delta U(t) \rangle/\langle (\Delta U)^2 \rangle$')
+            plt.ylim(-0.02, 0.1)
+            plt.xscale('log')
+            _save_figure(plt, args, 'energy_correlation.png')
+
+    if 'msd' in args.stages:
+        # Mean squared displacement
+        tic = time.perf_counter()
+        with span('msd') as record:
+            msd = mean_squared_displacement(args.dump_filename, args.time_step, cache=args.cache)
+            t, MSD, MSD_error = msd.Time, msd.MSD, msd.MSD_error
+            D = diffusion_coefficient(t, MSD)
+            record['D'] = D
+        toc = time.perf_counter()
+        print(f'Wall clock time to compute MSD: {toc-tic} s')
+        print(f'{D= }')
+        with span('write', filename='mean_squared_displacement.csv'):
+            with open('info.txt', 'a') as file:
+                file.write(f'{D= }\n')
+            msd.to_csv('mean_squared_displacement.csv', index=False)
+        if args.plot:
+            plt = _figure(args)
+            plt.title(f'{D= }')
+            plt.errorbar(t, MSD, yerr=MSD_error, fmt='o-')
+            plt.plot(t, 6*D*t, '--')
+            plt.xlabel(r'Time, $t$ [ns]')
+            plt.ylabel(r'Mean Squared Displacement [Å$^2$]')
+            plt.xscale('log')
+            plt.yscale('log')
+            _save_figure(plt, args, 'mean_squared_displacement.png')
+
+    if 'com_msd' in args.stages:
+        # Mean squared displacement of molecular centres of mass
+        tic = time.perf_counter()
+        with span('msd', molecular=True) as record:
+            msd = molecular_mean_squared_displacement(args.dump_filename, args.data_filename, args.time_step,
+                                                      cache=args.cache)
+            t, MSD, MSD_error = msd.Time, msd.MSD, msd.MSD_error
+            D_com = diffusion_coefficient(t, MSD)
+            record['D'] = D_com
+        toc = time.perf_counter()
+        print(f'Wall clock time to compute molecular MSD: {toc-tic} s')
+        print(f'{D_com= }')
+        with span('write', filename='molecular_mean_squared_displacement.csv'):
+            with open('info.txt', 'a') as file:
+                file.write(f'{D_com= }\n')
+            msd.to_csv('molecular_mean_squared_displacement.csv', index=False)
+        if args.plot:
+            plt = _figure(args)
+            plt.title(f'{D_com= }')
+            plt.errorbar(t, MSD, yerr=MSD_error, fmt='o-')
+            plt.plot(t, 6*D_com*t, '--')
+            plt.xlabel(r'Time, $t$ [ns]')
+            plt.ylabel(r'Molecular Mean Squared Displacement [Å$^2$]')
+            plt.xscale('log')
+            plt.yscale('log')
+            _save_figure(plt, args, 'molecular_mean_squared_displacement.png')
+
+    if 'fs' in args.stages:
+        # Self-intermediate scattering function and non-Gaussian parameter
+        from dynamics import relaxation_time
+        tic = time.perf_counter()
+        with span('fs', molecular=args.molecular) as record:
+            fs = self_intermediate_scattering(args.dump_filename, args.data_filename, args.time_step,
+                                              args.q_values, molecular=args.molecular, cache=args.cache)
+            columns = [column for column in fs.columns if column.startswith('F_s_')]
+            tau_alpha = {column[4:]: relaxation_time(fs.Time, fs[column]) for column in columns}
+            record['tau_alpha'] = tau_alpha
+        toc = time.perf_counter()
+        print(f'Wall clock time to compute F_s(q, t): {toc-tic} s')
+        for q, tau in tau_alpha.items():
+            print(f'q = {q} 1/Å: tau_alpha = {tau} ns')
+        filename = 'self_intermediate_scattering' + ('_molecular' if args.molecular else '') + '.csv'
+        with span('write', filename=filename):
+            fs.to_csv(filename, index=False)
+        if args.plot:
+            plt = _figure(args)
+            for column in columns:
+                plt.plot(fs.Time, fs[column], 'o-', label=f'q = {column[4:]} 1/Å')
+            plt.legend()
+            plt.xlabel(r'Time, $t$ [ns]')
+            plt.ylabel(r'Self-intermediate scattering function, $F_s(q, t)$')
+            plt.xscale('log')
+            _save_figure(plt, args, filename.replace('.csv', '.png'))
+
+    if 'chi4' in args.stages:
+        # Four-point susceptibility of the overlap function
+        from heterogeneity import chi4_peak
+        tic = time.perf_counter()
+        with span('chi4', molecular=args.molecular) as record:
+            chi4 = dynamic_susceptibility(args.dump_filename, args.data_filename, args.time_step,
+                                          args.thresholds, molecular=args.molecular, cache=args.cache)
+            thresholds = [f'{a:.2f}' for a in args.thresholds]
+            peaks = {a: chi4_peak(chi4.Time, chi4[f'chi4_{a}']) for a in thresholds}
+            record['peaks'] = peaks
+        toc = time.perf_counter()
+        print(f'Wall clock time to compute chi_4(t): {toc-tic} s')
+        for a, (peak, t_peak) in peaks.items():
+            print(f'a = {a} Å: chi_4 peak {peak} at t = {t_peak} ns')
+        filename = 'four_point_susceptibility' + ('_molecular' if args.molecular else '') + '.csv'
+        with span('write', filename=filename):
+            chi4.to_csv(filename, index=False)
+        if args.plot:
+            plt = _figure(args)
+            for a in thresholds:
+                plt.errorbar(chi4.Time, chi4[f'chi4_{a}'], yerr=chi4[f'chi4_error_{a}'], fmt='o-', label=f'a = {a} Å')
+            plt.legend()
+            plt.xlabel(r'Time, $t$ [ns]')
+            plt.ylabel(r'Four-point susceptibility, $\chi_4(t)$')
+            plt.xscale('log')
+            _save_figure(plt, args, filename.replace('.csv', '.png'))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,245 @@
+#!/bin/python3
+""" Benchmarks of the analysis functions on synthetic LAMMPS files
+
+Deterministic thermo logs and dump files are generated in the formats of the simulations
+here (thermo_style custom step temp press pe ke evdwl ecoul emol vol density c_virial, and
+dump atom with images), and every stage of the analysis is timed for a series of sizes.
+The peak memory (as traced by tracemalloc, and of child processes) is measured in a
+separate run, so tracing does not slow down the timed runs. The results are saved as
+JSON, and can be compared with an earlier run to flag slowdowns:
+
+    python3 benchmark.py --sizes small medium --output baseline.json
+    python3 benchmark.py --compare baseline.json --threshold 1.25
+
+Without --output, the results are written to benchmark_<date>_<time>.json, so that a
+run never overwrites the baseline it is compared with.
+
+"""
+
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+THERMO_COLUMNS = ['Step', 'Temp', 'Press', 'PotEng', 'KinEng', 'E_vdwl', 'E_coul', 'E_mol',
+                  'Volume', 'Density', 'c_virial']
+# Typical means and standard deviations at T = 380 K (see log.lammps_head)
+THERMO_MEANS = {'Temp': 380.0, 'Press': 100.0, 'PotEng': 4958.4, 'KinEng': 4529.0, 'E_vdwl': -400.0,
+                'E_coul': 2490.0, 'E_mol': 5600.0, 'Volume': 46438.611, 'Density': 1.0294201,
+                'c_virial': -3000.0}
+THERMO_STDS = {'Temp': 6.0, 'Press': 1500.0, 'PotEng': 60.0, 'KinEng': 70.0, 'E_vdwl': 40.0,
+               'E_coul': 10.0, 'E_mol': 50.0, 'Volume': 0.0, 'Density': 0.0, 'c_virial': 1500.0}
+
+# Number of thermo lines, and of dump frames and atoms
+SIZES = {
+    'small': {'thermo_lines': 10_000, 'dump_frames': 20, 'atoms': 4000},
+    'medium': {'thermo_lines': 200_000, 'dump_frames': 100, 'atoms': 4000},
+    'large': {'thermo_lines': 2_000_000, 'dump_frames': 400, 'atoms': 4000},
+}
+
+
+def write_thermo_log(filename, number_of_lines, columns=None, seed=0, steps_per_printout=40,
+                     lines_per_write=10_000):
+    ''' Write a LAMMPS log file with one thermo block of number_of_lines lines
+
+    The columns (default THERMO_COLUMNS, the first must be Step) are written with the
+    header and number formats of LAMMPS, and have correlated (AR(1)) fluctuations.
+    '''
+    from scipy.signal import lfilter
+    columns = columns or THERMO_COLUMNS
+    rng = np.random.default_rng(seed)
+    values = columns[1:]
+    mean = np.array([THERMO_MEANS.get(column, 0.0) for column in values])
+    std = np.array([THERMO_STDS.get(column, 1.0) for column in values])
+    state = np.zeros(len(values))
+    with open(filename, 'w') as file:
+        file.write('LAMMPS (23 Jun 2022 - Update 1)\n'
+                   f'thermo {steps_per_printout}\n'
+                   'Per MPI rank memory allocation (min/avg/max) = 12.97 | 12.98 | 12.98 Mbytes\n')
+        file.write(f'{columns[0]:^11}' + ''.join(f' {column:^14}' for column in values) + '\n')
+        for start in range(0, number_of_lines, lines_per_write):
+            size = min(lines_per_write, number_of_lines - start)
+            noise = np.sqrt(1 - 0.9**2) * rng.normal(size=(size, len(values)))
+            data, state = lfilter([1.0], [1.0, -0.9], noise, axis=0, zi=0.9 * state[np.newaxis, :])
+            state = data[-1]
+            data = mean + std * data
+            steps = (start + np.arange(size)) * steps_per_printout
+            file.write(''.join(f'{step:10d}' + ''.join(f'{value:^15.8g}' for value in row) + ' \n'
+                               for step, row in zip(steps, data)))
+        steps = (number_of_lines - 1) * steps_per_printout
+        file.write(f'Loop time of 233829 on 32 procs for {steps} steps with 4000 atoms\n\n'
+                   'Performance: 73.900 ns/day, 0.325 hours/ns, 427.663 timesteps/s\n'
+                   'Total wall time: 64:57:09\n')
+
+
+def write_dump(filename, number_of_frames, number_of_atoms, box_length=35.944, seed=0,
+               steps_per_dump=50000, atom_types=3):
+    ''' Write a LAMMPS dump file (dump atom with images) of diffusing atoms
+
+    Atoms are written in random order in every frame, with scaled wrapped coordinates
+    (xs ys zs) and image flags (ix iy iz), as `dump atom` with `dump_modify image yes`.
+    '''
+    rng = np.random.default_rng(seed)
+    positions = rng.random((number_of_atoms, 3)) * box_length
+    ids = np.arange(1, number_of_atoms + 1)
+    types = (ids - 1) % atom_types + 1
+    with open(filename, 'w') as file:
+        for frame in range(number_of_frames):
+            file.write(f'ITEM: TIMESTEP\n{frame * steps_per_dump}\n'
+                       f'ITEM: NUMBER OF ATOMS\n{number_of_atoms}\n'
+                       'ITEM: BOX BOUNDS pp pp pp\n'
+                       + f'0.0000000000000000e+00 {box_length:.16e}\n' * 3
+                       + 'ITEM: ATOMS id type xs ys zs ix iy iz\n')
+            images = np.floor(positions / box_length).astype(int)
+            scaled = positions / box_length - images
+            order = rng.permutation(number_of_atoms)
+            rows = np.column_stack([ids[order], types[order], scaled[order], images[order]])
+            np.savetxt(file, rows, fmt='%d %d %.6g %.6g %.6g %d %d %d')
+            positions = positions + rng.normal(scale=0.5, size=positions.shape)
+
+
+def measure(function, *args, **kwargs):
+    ''' Wall time and CPU time of a function call
+
+    Returns::
+
+        result, seconds, cpu_seconds
+    '''
+    tic, cpu = time.perf_counter(), time.process_time()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - tic, time.process_time() - cpu
+
+
+def measure_memory(function, *args, **kwargs):
+    ''' Peak memory of a function call, in a run of its own (tracing slows it down)
+
+    Returns the peak memory traced by tracemalloc in this process, and the maximum
+    resident set size of child processes (e.g. of a process pool) if it grew during
+    the call, as getrusage only gives the maximum over all finished children (else 0).
+    '''
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    tracemalloc.start()
+    function(*args, **kwargs)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    children_bytes = children_after * 1024 if children_after > children_before else 0  # Linux reports kB
+    return peak_bytes, children_bytes
+
+
+def benchmark_size(name, size, directory, repeats=3):
+    ''' Time all stages on generated files of a given size '''
+    from analyse import (thermo_data_as_dataframe, read_dump, time_correlation, run_avg_log,
+                         compute_mean_squared_displacement,
+                         compute_multi_origin_mean_squared_displacement)
+    from correlation import correlation_matrix
+    from trajectory import DumpTrajectory
+    import pandas  # noqa: F401 (imported here, so the import time is not part of the first stage)
+
+    log_filename = os.path.join(directory, f'log_{name}.lammps')
+    dump_filename = os.path.join(directory, f'dump_{name}.lammps')
+    print(f'Generating {name} files: {size}')
+    write_thermo_log(log_filename, size['thermo_lines'])
+    write_dump(dump_filename, size['dump_frames'], size['atoms'])
+    os.environ['THERMO_CACHE_DIR'] = os.path.join(directory, 'thermo_cache')
+
+    state = {}
+    stages = [
+        ('thermo_data_as_dataframe', lambda: thermo_data_as_dataframe(log_filename, 2e-15, cache=False)),
+        ('thermo_data_as_dataframe_cached', lambda: thermo_data_as_dataframe(log_filename, 2e-15)),
+        ('time_correlation', lambda: time_correlation(state['U'])),
+        ('correlation_matrix', lambda: correlation_matrix(state['channels'])),
+        ('run_avg_log', lambda: run_avg_log(state['C'])),
+        ('read_dump', lambda: read_dump(dump_filename)),
+        ('DumpTrajectory', lambda: DumpTrajectory(dump_filename, index_filename=dump_filename + '.bench.npz').read()),
+        ('compute_mean_squared_displacement', lambda: compute_mean_squared_displacement(state['frames'])),
+        ('compute_multi_origin_mean_squared_displacement',
+         lambda: compute_multi_origin_mean_squared_displacement(state['frames'])),
+    ]
+    results = []
+    for stage, function in stages:
+        best = None
+        for _ in range(repeats):
+            result, seconds, cpu_seconds = measure(function)
+            if best is None or seconds < best['seconds']:
+                best = {'seconds': seconds, 'cpu_seconds': cpu_seconds}
+        best['peak_bytes'], best['children_peak_rss_bytes'] = measure_memory(function)
+        if stage == 'thermo_data_as_dataframe':
+            state['U'] = result.PotEng.to_numpy()
+            state['channels'] = {column: result[column].to_numpy() for column in ['PotEng', 'c_virial', 'Press']}
+        elif stage == 'time_correlation':
+            state['C'] = result
+        elif stage == 'read_dump':
+            state['frames'] = result[0]
+        print(f'{name:>8} {stage:>48}: {best["seconds"]:9.4f} s, {best["peak_bytes"] / 2**20:8.1f} MiB'
+              + (f' (children {best["children_peak_rss_bytes"] / 2**20:.1f} MiB)' if best['children_peak_rss_bytes'] else ''))
+        results.append({'size': name, 'stage': stage, **best, **size})
+    return results
+
+
+def compare(results, baseline, threshold=1.25):
+    ''' Stages (and sizes) that are more than threshold times slower than in the baseline '''
+    reference = {(entry['size'], entry['stage']): entry for entry in baseline['results']}
+    regressions = []
+    for entry in results['results']:
+        old = reference.get((entry['size'], entry['stage']))
+        if old is None or old['seconds'] <= 0:
+            continue
+        ratio = entry['seconds'] / old['seconds']
+        if ratio > threshold:
+            regressions.append({'size': entry['size'], 'stage': entry['stage'], 'ratio': ratio,
+                                'seconds': entry['seconds'], 'baseline_seconds': old['seconds']})
+    return regressions
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the analysis on synthetic LAMMPS files')
+    parser.add_argument('--sizes', nargs='+', default=['small'], choices=list(SIZES))
+    parser.add_argument('--repeats', type=int, default=3, help='Repeats of every stage (best is kept)')
+    parser.add_argument('--output', help='JSON file of results (default benchmark_<date>_<time>.json)')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Slowdown ratio flagged as regression')
+    args = parser.parse_args()
+    if args.output is None:
+        args.output = f'benchmark_{time.strftime("%Y%m%d_%H%M%S")}.json'
+    if args.compare and os.path.exists(args.output) and os.path.samefile(args.output, args.compare):
+        parser.error(f'--output {args.output} would overwrite the baseline of --compare')
+    results = {
+        'meta': {
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'results': []
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.sizes:
+            results['results'] += benchmark_size(name, SIZES[name], directory, args.repeats)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'Results written to {args.output}')
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f'Regression: {regression["stage"]} ({regression["size"]}) is {regression["ratio"]:.2f} times '
+                  f'slower ({regression["seconds"]:.4f} s vs {regression["baseline_seconds"]:.4f} s)')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions beyond a factor {args.threshold}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/bin/python3
+""" Linear and logarithmic binning of time series with cached bin plans
+
+The bin edges only depend on the length of the series and the binning parameters,
+so they are computed once and cached. The averages are then a single np.add.reduceat
+along the time axis (the last axis by default), for real or complex 1-D series, or
+stacked 2-D series of several channels:
+
+    edges = log_bin_edges(len(C_UU), points_per_decade=24)
+    t_log = bin_average(df.Time, edges)
+    C_log = bin_average(np.array([C_UU, C_WW, C_WU]), edges)
+
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=128)
+def log_bin_edges(size, points_per_decade=24, base=None):
+    ''' Edges of the bins of run_avg_log for a series of the given size
+
+    The bins are 0:1, 1:2, ..., with a width growing by a factor base (default
+    10**(1/points_per_decade)), and the data after the last complete bin is dropped.
+    '''
+    if not base:
+        base = 10 ** (1 / points_per_decade)
+    if base < 1:
+        print('Warning: Base should be larger than 1')
+    edges = [0]
+    ceil, next_ceil = 1, 1.0
+    while ceil < size:
+        edges.append(ceil)
+        while int(next_ceil) == ceil:
+            next_ceil = next_ceil * base
+        ceil = int(next_ceil)
+    edges = np.array(edges, dtype=np.int64)
+    edges.flags.writeable = False
+    return edges
+
+
+@lru_cache(maxsize=128)
+def linear_bin_edges(size, n=128):
+    ''' Edges of the bins of run_avg, i.e. size // n bins of n data points '''
+    edges = np.arange(0, size // n * n + 1, n, dtype=np.int64)
+    edges.flags.writeable = False
+    return edges
+
+
+def _sums(x, edges, axis):
+    x = np.moveaxis(np.asarray(x), axis, -1)
+    if len(edges) < 2:
+        return x, np.zeros(x.shape[:-1] + (0,), dtype=np.result_type(x, float))
+    return x, np.add.reduceat(x[..., :edges[-1]], edges[:-1], axis=-1)
+
+
+def bin_average(x, edges, axis=-1):
+    ''' Averages of x between consecutive bin edges along an axis '''
+    x, sums = _sums(x, edges, axis)
+    return np.moveaxis(sums / np.diff(edges), -1, axis)
+
+
+def bin_statistics(x, edges, axis=-1):
+    ''' Averages, counts and standard errors of x in bins along an axis
+
+    The standard error of a bin is the standard deviation of the data in the bin
+    (ddof=1) divided by the square root of the count, and NaN for bins of one point.
+    For complex x, it is computed from the absolute deviations.
+
+    Returns::
+
+        mean, count, standard_error
+    '''
+    x, sums = _sums(x, edges, axis)
+    count = np.diff(edges)
+    mean = sums / count
+    if len(edges) < 2:
+        standard_error = np.zeros(mean.shape)
+    else:
+        deviation = x[..., :edges[-1]] - np.repeat(mean, count, axis=-1)
+        squares = np.add.reduceat(np.abs(deviation)**2, edges[:-1], axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            standard_error = np.sqrt(squares / (count - 1) / count)
+    return np.moveaxis(mean, -1, axis), count, np.moveaxis(standard_error, -1, axis)
+
+
+def log_average(x, points_per_decade=24, base=None, axis=-1):
+    ''' Logarithmic averaging along an axis (see log_bin_edges) '''
+    edges = log_bin_edges(np.shape(x)[axis], points_per_decade, base)
+    return bin_average(x, edges, axis)
+
+
+def linear_average(x, n=128, axis=-1):
+    ''' Averages of consecutive blocks of n data points along an axis '''
+    edges = linear_bin_edges(np.shape(x)[axis], n)
+    return bin_average(x, edges, axis)
@@ -0,0 +1,120 @@
+#!/bin/python3
+r""" Multi-scale boxcar statistics from prefix sums
+
+For a boxcar (running) average over windows of :math:`\tau` frames,
+
+ .. math::
+
+     \bar x_j(\tau) = \frac{1}{\tau}\sum_{i=j}^{j+\tau-1} x_i = \frac{P_{j+\tau} - P_j}{\tau}
+
+where :math:`P` is the prefix sum of :math:`x`. The variances and covariances of the
+boxcar averages over all windows, :math:`j = 0, 1, \ldots, N-\tau`, then need sums of
+:math:`P_j P_j` (prefix sums of products) and of :math:`P_j P_{j+\tau}`, which are
+cross-correlations of prefix sums and are computed for all :math:`\tau` at once with the
+FFT algorithm. The statistics of any set of window lengths, for all pairs of channels,
+thus cost :math:`N\ln(N)`, instead of a new filter of the full series for every window length.
+
+Only complete windows are used, whereas scipy.ndimage.uniform_filter1d (used in the
+notebooks) also includes windows reflected at the ends of the series. Variances
+and covariances are population statistics (ddof=0).
+
+"""
+
+import numpy as np
+
+
+def dyadic_window_lengths(number_of_frames, max_fraction=0.1):
+    ''' Window lengths 2, 4, 8, ... as in the boxcar loops of analyse.ipynb '''
+    sizes = []
+    size = 1
+    while size < number_of_frames * max_fraction:
+        size = size * 2
+        sizes.append(size)
+    return np.array(sizes, dtype=int)
+
+
+def _stack(series):
+    if isinstance(series, dict):
+        return list(series), np.array([np.asarray(x, dtype=float) for x in series.values()])
+    series = np.atleast_2d(np.asarray(series, dtype=float))
+    return list(range(len(series))), series
+
+
+def boxcar_scan(series, window_lengths):
+    r''' Boxcar means, covariances, correlation coefficients and scaling exponents
+
+    series is a dictionary of equally long time series (channels), e.g.
+    {'PotEng': df.PotEng, 'c_virial': df.c_virial}, or an array of shape (channels, frames).
+    window_lengths are the boxcar lengths :math:`\tau` in frames (any integers from 1 to
+    the number of frames).
+
+    Returns a dictionary with
+
+    * names: the channel names (or indices)
+    * tau: the window lengths, shape (windows,)
+    * mean: the mean of the boxcar averages, shape (windows, channels)
+    * covariance: the covariance of boxcar averages, shape (windows, channels, channels)
+    * sigma: the standard deviations, shape (windows, channels)
+    * R: the Pearson correlation coefficients, shape (windows, channels, channels)
+    * gamma: the scaling exponents gamma[:, a, b] = cov(a, b) / var(b), e.g.
+      :math:`\gamma = \langle\Delta\bar W\Delta\bar U\rangle/\langle(\Delta\bar U)^2\rangle`
+      for a=W and b=U.
+    '''
+    from numpy.fft import rfft, irfft
+    names, x = _stack(series)
+    channels, n = x.shape
+    tau = np.asarray(window_lengths, dtype=int)
+    if np.any((tau < 1) | (tau > n)):
+        raise ValueError(f'Window lengths must be between 1 and the number of frames ({n})')
+    offset = x.mean(axis=1)
+    # Prefix sums of the deviations from the mean (for numerical accuracy)
+    P = np.zeros((channels, n + 1))
+    np.cumsum(x - offset[:, np.newaxis], axis=1, out=P[:, 1:])
+    windows = n - tau + 1
+    # Sums of P over the index ranges tau..n and 0..n-tau
+    cumulative = np.cumsum(P, axis=1)
+    upper = cumulative[:, n:] - cumulative[:, tau - 1]
+    lower = cumulative[:, n - tau]
+    mean = (upper - lower).T / tau[:, np.newaxis] / windows[:, np.newaxis]
+    fP = rfft(P, n=2 * (n + 1), axis=1)
+    covariance = np.zeros((len(tau), channels, channels))
+    for a in range(channels):
+        for b in range(a, channels):
+            product = np.cumsum(P[a] * P[b])
+            same = (product[-1] - product[tau - 1]) + product[n - tau]
+            correlation = irfft(np.conj(fP[a]) * fP[b], n=2 * (n + 1))
+            forward = correlation[tau]  # sum_j P_a(j) P_b(j + tau)
+            backward = correlation[-tau]  # sum_j P_a(j + tau) P_b(j)
+            products = same - forward - backward
+            covariance[:, a, b] = products / tau**2 / windows - mean[:, a] * mean[:, b]
+            covariance[:, b, a] = covariance[:, a, b]
+    mean = mean + offset
+    variance = np.maximum(np.diagonal(covariance, axis1=1, axis2=2), 0)
+    sigma = np.sqrt(variance)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        R = covariance / (sigma[:, :, np.newaxis] * sigma[:, np.newaxis, :])
+        gamma = covariance / variance[:, np.newaxis, :]
+    return {
+        'names': names,
+        'tau': tau,
+        'mean': mean,
+        'covariance': covariance,
+        'sigma': sigma,
+        'R': R,
+        'gamma': gamma
+    }
+
+
+def boxcar_scaling_exponent(U, W, window_lengths, frames_per_unit=1):
+    ''' Table of the W-U correlation coefficient and scaling exponent versus window length
+
+    Returns a DataFrame with columns tau (window length divided by frames_per_unit,
+    e.g. steps per nanosecond), R and gamma, as in boxcar.csv.
+    '''
+    import pandas as pd
+    scan = boxcar_scan({'U': U, 'W': W}, window_lengths)
+    return pd.DataFrame({
+        'tau': scan['tau'] / frames_per_unit,
+        'R': scan['R'][:, 0, 1],
+        'gamma': scan['gamma'][:, 1, 0]
+    })
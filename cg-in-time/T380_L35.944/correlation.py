@@ -0,0 +1,138 @@
+#!/bin/python3
+r""" Batched auto- and cross-correlation functions of several time series
+
+All channels are transformed with one batched real FFT, padded to a fast FFT length
+of at least 2n, and all products are transformed back row by row, so
+
+ .. math::
+
+     C_{ab}(t) = \frac{1}{n}\sum_{\tau} \Delta x_a(\tau) \Delta x_b(\tau + t)
+
+is computed for every pair of channels with the same normalization as
+analyse.time_correlation, i.e. correlation_matrix(...)[a, b] equals
+time_correlation(x_a, x_b). The FFTs are multithreaded with the workers of scipy.fft.
+
+The frequency-dependent responses (see analyse.frequency_dependent_response)
+
+ .. math::
+
+     \mu_{ab}(\omega) = A\int_0^\infty \dot C_{ab}(t)\exp(-i \omega t) dt
+
+are computed from the same spectra with real FFTs, pair by pair in batches that fit a
+given memory budget, and are averaged on a logarithmic scale straight away,
+so only the ~100 binned values of every pair are kept.
+
+"""
+
+import numpy as np
+
+from binning import log_bin_edges, bin_average
+
+
+def correlation_matrix(series, points_per_decade=None, base=None, workers=-1):
+    ''' Time correlation functions of all pairs of channels
+
+    series is a dictionary of equally long time series (channels), e.g.
+    {'PotEng': df.PotEng, 'c_virial': df.c_virial}, or an array of shape (channels, frames).
+    If points_per_decade (or base) is given, the correlation functions are averaged on a
+    logarithmic scale as analyse.run_avg_log while they are computed, so only the
+    binned values are kept in memory.
+    workers is the number of threads of scipy.fft (-1 for all CPUs).
+
+    Returns::
+
+        names, C
+
+    where C[a, b] is the correlation function of channels names[a] and names[b],
+    an array of shape (channels, channels, lags).
+    '''
+    from scipy.fft import rfft, irfft, next_fast_len
+    if isinstance(series, dict):
+        names = list(series)
+        x = np.array([np.asarray(y, dtype=float) for y in series.values()])
+    else:
+        x = np.atleast_2d(np.asarray(series, dtype=float))
+        names = list(range(len(x)))
+    channels, n = x.shape
+    length = next_fast_len(2 * n, real=True)
+    fx = rfft(x - x.mean(axis=1, keepdims=True), n=length, axis=1, workers=workers)
+    edges = None
+    if points_per_decade or base:
+        edges = log_bin_edges(n, points_per_decade, base)
+        C = np.zeros((channels, channels, max(len(edges) - 1, 0)))
+    else:
+        C = np.zeros((channels, channels, n))
+    for a in range(channels):
+        row = irfft(np.conj(fx[a]) * fx, n=length, axis=1, workers=workers)[:, :n] / n
+        C[a] = row if edges is None else bin_average(row, edges)
+    return names, C
+
+
+def response_matrix(series, dt=1.0, prefactor=1.0, points_per_decade=24, base=None,
+                    max_memory=2**30, workers=-1):
+    ''' Log-binned frequency-dependent responses of all pairs of channels
+
+    The result is the same as run_avg_log of analyse.frequency_dependent_response for every
+    pair, i.e. mu[a, b] is the response of x=names[a] and y=names[b], with the same
+    frequencies omega. Pairs are transformed in batches, so that the working arrays
+    need at most max_memory bytes; a ValueError is raised if a single pair needs more.
+
+    Returns::
+
+        names, omega, mu
+
+    where omega has shape (bins,) and mu has shape (channels, channels, bins).
+    '''
+    from scipy.fft import rfft, irfft, next_fast_len
+    if isinstance(series, dict):
+        names = list(series)
+        x = np.array([np.asarray(y, dtype=float) for y in series.values()])
+    else:
+        x = np.atleast_2d(np.asarray(series, dtype=float))
+        names = list(range(len(x)))
+    channels, n = x.shape
+    length = next_fast_len(2 * n, real=True)
+    # Spectra of all channels, and the arrays of a single pair (product, correlation,
+    # its derivative and the transform of length 2n)
+    fixed_bytes = 8 * channels * n + 16 * channels * (length // 2 + 1)
+    bytes_per_pair = 16 * (length // 2 + 1) + 8 * length + 16 * n + 16 * (n + 1)
+    pairs_per_batch = (max_memory - fixed_bytes) // bytes_per_pair
+    if pairs_per_batch < 1:
+        raise ValueError(f'At least {fixed_bytes + bytes_per_pair} bytes are needed for series of length {n}')
+    fx = rfft(x - x.mean(axis=1, keepdims=True), n=length, axis=1, workers=workers)
+    edges = log_bin_edges(n, points_per_decade, base)
+    omega = bin_average(2 * np.pi * np.arange(n) / dt / n, edges)
+    mu = np.zeros((channels, channels, len(omega)), dtype=complex)
+    pairs = [(a, b) for a in range(channels) for b in range(channels)]
+    for start in range(0, len(pairs), pairs_per_batch):
+        a, b = np.array(pairs[start:start + pairs_per_batch]).T
+        C = irfft(np.conj(fx[a]) * fx[b], n=length, axis=1, workers=workers)[:, :n] / n
+        C = np.gradient(C, axis=1)
+        transform = rfft(C, n=2 * n, axis=1, workers=workers)[:, :n]
+        mu[a, b] = prefactor * bin_average(transform, edges)
+    return names, omega, mu
+
+
+def scaling_exponent_response(U, W, dt=1.0, prefactor=1.0, points_per_decade=24, base=None,
+                              max_memory=2**30, workers=-1):
+    r''' Log-binned responses of U and W, and the frequency-dependent scaling exponent
+
+     .. math::
+
+         \gamma_\mu(\omega) = \frac{\Im\mu_{UW}(\omega)}{\Im\mu_{UU}(\omega)}
+
+    Returns a dictionary with omega, mu_UU, mu_WW, mu_UW and gamma_mu, as computed in
+    coarse_graining_in_time.ipynb with frequency_dependent_response and run_avg_log.
+    '''
+    _, omega, mu = response_matrix({'U': U, 'W': W}, dt=dt, prefactor=prefactor,
+                                   points_per_decade=points_per_decade, base=base,
+                                   max_memory=max_memory, workers=workers)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gamma_mu = np.imag(mu[0, 1]) / np.imag(mu[0, 0])
+    return {
+        'omega': omega,
+        'mu_UU': mu[0, 0],
+        'mu_WW': mu[1, 1],
+        'mu_UW': mu[0, 1],
+        'gamma_mu': gamma_mu
+    }
@@ -0,0 +1,142 @@
+#!/bin/python3
+r""" Self-intermediate scattering function and non-Gaussian parameter
+
+For displacements :math:`\Delta r_i(t) = r_i(t_0 + t) - r_i(t_0)` (with the drift of
+the geometric center removed, as in analyse.remove_drift) the isotropic
+self-intermediate scattering function and the non-Gaussian parameter are
+
+ .. math::
+
+     F_s(q, t) = \left\langle \frac{\sin(q |\Delta r_i(t)|)}{q |\Delta r_i(t)|} \right\rangle
+
+     \alpha_2(t) = \frac{3 \langle |\Delta r_i(t)|^4 \rangle}{5 \langle |\Delta r_i(t)|^2 \rangle^2} - 1
+
+where the average is over atoms (or molecular centres of mass) and time origins
+:math:`t_0`. All q values are evaluated at once for logarithmically spaced lag times.
+Time origins are handled in blocks, so only the frames of one block of origins (and their
+lags) are in memory at a time, within max_memory bytes. The frames are read from an array,
+a DumpTrajectory or (fastest, as it is memory-mapped) a TrajectoryStore:
+
+    store = open_store('dump.constant_volume', data_filename='data.initial')
+    result = self_dynamics(store, q_values=np.linspace(0.25, 2.5, 10), molecular=True)
+    tau_alpha = relaxation_time(result['lags'], result['F_s'][:, 4])
+
+"""
+
+import numpy as np
+
+from trajectory import log_spaced_lags
+
+# Default wave numbers in 1/Angstrom
+Q_VALUES = np.linspace(0.25, 2.5, 10)
+
+
+def _read_frames(frames, indices):
+    ''' Positions of selected frames with the drift of the geometric center removed '''
+    if isinstance(frames, np.ndarray):
+        positions = frames[indices]
+    else:
+        positions = frames.read(indices)
+    positions = np.asarray(positions, dtype=float)
+    return positions - positions.mean(axis=1)[:, np.newaxis, :]
+
+
+def displacement_blocks(frames, lags, origin_stride=1, max_memory=2**28, bytes_per_displacement=0):
+    ''' Yield displacements of blocks of time origins for all lags
+
+    frames is an array (frames, particles, 3) or a lazy trajectory with a read(indices) method.
+    Time origins are every origin_stride frames. For every block of origins and every lag,
+    (lag index, origins, displacements of shape (origins, particles, 3)) is yielded, for the
+    origins with origin + lag within the trajectory. The number of origins of a block is chosen so
+    the frames of the block, and bytes_per_displacement bytes per displacement vector of
+    the caller, fit in max_memory bytes.
+    '''
+    number_of_frames = len(frames)
+    number_of_particles = frames.shape[1] if isinstance(frames, np.ndarray) else frames.number_of_atoms
+    lags = np.asarray(lags, dtype=int)
+    origins = np.arange(0, number_of_frames - lags.min(), origin_stride)
+    bytes_per_origin = number_of_particles * (3 * 8 * (len(lags) + 1) + bytes_per_displacement)
+    origins_per_block = int(max_memory // bytes_per_origin)
+    if origins_per_block < 1:
+        raise ValueError(f'max_memory = {max_memory} bytes is too small, at least {bytes_per_origin} bytes '
+                         'are needed for one time origin')
+    for start in range(0, len(origins), origins_per_block):
+        block = origins[start:start + origins_per_block]
+        indices = block[:, np.newaxis] + lags[np.newaxis, :]
+        valid = indices < number_of_frames
+        needed = np.unique(np.concatenate([block, indices[valid]]))
+        positions = _read_frames(frames, needed)
+        reference = positions[np.searchsorted(needed, block)]
+        for k in range(len(lags)):
+            if not valid[:, k].any():
+                continue
+            later = positions[np.searchsorted(needed, indices[valid[:, k], k])]
+            yield k, block[valid[:, k]], later - reference[valid[:, k]]
+        del positions, reference
+
+
+def self_dynamics(frames, q_values=Q_VALUES, lags=None, points_per_decade=10, origin_stride=None,
+                  molecular=False, molecules=None, masses=None, max_memory=2**28):
+    ''' Self-intermediate scattering function, MSD and non-Gaussian parameter
+
+    frames is an array (frames, atoms, 3), a DumpTrajectory or a TrajectoryStore. Lags are
+    in frames (default log_spaced_lags), and time origins are every origin_stride frames
+    (default so that there are about 100 origins). With molecular=True, the molecular centres
+    of mass are used (see molecules.com_trajectory; molecule ids and masses are taken from
+    the trajectory if not given).
+
+    Returns a dictionary with lags, q, F_s (lags, q), MSD, alpha_2 and count, the number
+    of (origin, particle) samples of every lag.
+    '''
+    if molecular:
+        from molecules import com_trajectory
+        frames = com_trajectory(frames, molecules, masses)
+    number_of_frames = len(frames)
+    q_values = np.atleast_1d(np.asarray(q_values, dtype=float))
+    if lags is None:
+        lags = log_spaced_lags(number_of_frames, points_per_decade)
+    lags = np.asarray(lags, dtype=int)
+    if origin_stride is None:
+        origin_stride = max(1, number_of_frames // 100)
+    F_s = np.zeros((len(lags), len(q_values)))
+    r2_sum = np.zeros(len(lags))
+    r4_sum = np.zeros(len(lags))
+    count = np.zeros(len(lags), dtype=np.int64)
+    blocks = displacement_blocks(frames, lags, origin_stride, max_memory,
+                                 bytes_per_displacement=8 * (2 * len(q_values) + 8))
+    for k, _, displacement in blocks:
+        r2 = (displacement**2).sum(axis=2).ravel()
+        r = np.sqrt(r2)
+        # np.sinc(x) = sin(pi x)/(pi x), and is 1 for zero displacement
+        F_s[k] += np.sinc(np.multiply.outer(r, q_values / np.pi)).sum(axis=0)
+        r2_sum[k] += r2.sum()
+        r4_sum[k] += (r2**2).sum()
+        count[k] += len(r2)
+    samples = np.maximum(count, 1)
+    MSD = r2_sum / samples
+    with np.errstate(invalid='ignore', divide='ignore'):
+        alpha_2 = np.where(MSD > 0, 3 * (r4_sum / samples) / (5 * MSD**2) - 1, 0.0)
+    return {
+        'lags': lags,
+        'q': q_values,
+        'F_s': F_s / samples[:, np.newaxis],
+        'MSD': MSD,
+        'alpha_2': alpha_2,
+        'count': count
+    }
+
+
+def relaxation_time(t, F, level=np.exp(-1)):
+    ''' First time where F decays to level (default 1/e), interpolated in log(t)
+
+    Returns NaN if F does not decay to level.
+    '''
+    t, F = np.asarray(t, dtype=float), np.asarray(F, dtype=float)
+    below = np.flatnonzero(F <= level)
+    if len(below) == 0 or below[0] == 0:
+        return np.nan
+    i = below[0]
+    if t[i - 1] <= 0:
+        return float(t[i])
+    fraction = (F[i - 1] - level) / (F[i - 1] - F[i])
+    return float(np.exp(np.log(t[i - 1]) + fraction * (np.log(t[i]) - np.log(t[i - 1]))))
@@ -0,0 +1,99 @@
+#!/bin/python3
+r""" Overlap function and four-point susceptibility of dynamic heterogeneity
+
+The overlap of a time origin :math:`t_0` and lag :math:`t` counts the particles that moved
+less than a threshold distance :math:`a`
+
+ .. math::
+
+     Q_a(t_0, t) = \frac{1}{N} \sum_i \Theta(a - |\Delta r_i(t_0, t)|)
+
+and the four-point susceptibility is the variance of the overlap over time origins
+
+ .. math::
+
+     \chi_4(t) = N \left[ \langle Q_a(t)^2 \rangle - \langle Q_a(t) \rangle^2 \right]
+
+The displacements are those of dynamics.displacement_blocks (drift removed, time origins in
+blocks within a memory budget), and all thresholds are evaluated at once. The error of
+:math:`\chi_4` is estimated from consecutive blocks of time origins.
+
+"""
+
+import warnings
+
+import numpy as np
+
+# Default threshold distances in Angstrom
+THRESHOLDS = (0.3, 0.5, 1.0)
+
+
+def overlap_series(frames, thresholds=THRESHOLDS, lags=None, points_per_decade=10, origin_stride=None,
+                   molecular=False, molecules=None, masses=None, max_memory=2**28):
+    ''' Overlap Q_a(t_0, t) of all time origins, lags and thresholds
+
+    The arguments are as for dynamics.self_dynamics. Returns a dictionary with lags,
+    origins, thresholds, Q of shape (lags, origins, thresholds), which is NaN where
+    origin + lag is beyond the trajectory, and number_of_particles.
+    '''
+    from dynamics import displacement_blocks, log_spaced_lags
+    if molecular:
+        from molecules import com_trajectory
+        frames = com_trajectory(frames, molecules, masses)
+    number_of_frames = len(frames)
+    number_of_particles = frames.shape[1] if isinstance(frames, np.ndarray) else frames.number_of_atoms
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype=float))
+    if lags is None:
+        lags = log_spaced_lags(number_of_frames, points_per_decade)
+    lags = np.asarray(lags, dtype=int)
+    if origin_stride is None:
+        origin_stride = max(1, number_of_frames // 100)
+    origins = np.arange(0, number_of_frames - lags.min(), origin_stride)
+    Q = np.full((len(lags), len(origins), len(thresholds)), np.nan)
+    blocks = displacement_blocks(frames, lags, origin_stride, max_memory,
+                                 bytes_per_displacement=8 * 5 + len(thresholds))
+    for k, block, displacement in blocks:
+        distance = np.sqrt((displacement**2).sum(axis=2))
+        Q[k, block // origin_stride] = (distance[:, :, np.newaxis] < thresholds).mean(axis=1)
+    return {
+        'lags': lags,
+        'origins': origins,
+        'thresholds': thresholds,
+        'Q': Q,
+        'number_of_particles': number_of_particles
+    }
+
+
+def four_point_susceptibility(Q, number_of_particles, number_of_blocks=8):
+    ''' Mean overlap and chi_4 with block errors from an array Q (lags, origins, thresholds)
+
+    chi_4 is the variance over all (valid) origins. Its error is the standard error of the
+    chi_4 of number_of_blocks consecutive blocks of origins (NaN with fewer than two blocks
+    of at least two origins).
+
+    Returns::
+
+        Q_mean, chi_4, chi_4_error
+
+    each of shape (lags, thresholds).
+    '''
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)  # Lags with fewer than two origins
+        Q_mean = np.nanmean(Q, axis=1)
+        chi_4 = number_of_particles * np.nanvar(Q, axis=1, ddof=1)
+        blocks = np.array_split(np.arange(Q.shape[1]), max(1, min(number_of_blocks, Q.shape[1])))
+        block_chi_4 = np.stack([number_of_particles * np.nanvar(Q[:, block], axis=1, ddof=1)
+                                for block in blocks])
+        valid = np.isfinite(block_chi_4).sum(axis=0)
+        chi_4_error = np.nanstd(block_chi_4, axis=0, ddof=1) / np.sqrt(valid)
+    chi_4_error[valid < 2] = np.nan
+    return Q_mean, chi_4, chi_4_error
+
+
+def chi4_peak(t, chi_4):
+    ''' Maximum of chi_4 (ignoring NaN), and the time of the maximum '''
+    chi_4 = np.asarray(chi_4, dtype=float)
+    if not np.any(np.isfinite(chi_4)):
+        return np.nan, np.nan
+    i = np.nanargmax(chi_4)
+    return float(chi_4[i]), float(np.asarray(t)[i])
@@ -0,0 +1,100 @@
+#!/bin/python3
+r""" Centre-of-mass trajectories of molecules
+
+The atoms are mapped to molecules with the molecule ids and masses of a LAMMPS data
+file (e.g. data.initial, see trajectory_store.read_lammps_data) or a trajectory store.
+The centre of mass of molecule :math:`J` is
+
+ .. math::
+
+     R_J = \frac{\sum_{i \in J} m_i r_i}{\sum_{i \in J} m_i}
+
+and is computed for a chunk of frames at once with a single np.bincount over
+the combined (frame, dimension, molecule) index. The molecular mean squared displacement
+is then that of the (far fewer) centres of mass, e.g. 125 ortho-terphenyl molecules
+instead of 4000 atoms, without the intramolecular vibrations.
+
+"""
+
+import numpy as np
+
+
+def molecule_mapping(molecules, masses):
+    ''' Molecule index (0, 1, ...) of every atom, mass weights and molecular masses
+
+    Returns::
+
+        index, weights, molecular_masses
+
+    where weights are the atom masses divided by the mass of their molecule.
+    '''
+    molecules = np.asarray(molecules)
+    masses = np.asarray(masses, dtype=float)
+    if np.any(~np.isfinite(masses)):
+        raise ValueError('Atom masses must be finite (is there a mass for every atom type?)')
+    _, index = np.unique(molecules, return_inverse=True)
+    molecular_masses = np.bincount(index, weights=masses)
+    return index, masses / molecular_masses[index], molecular_masses
+
+
+def center_of_mass(positions, index, weights):
+    ''' Centres of mass of molecules in frames of shape (frames, atoms, 3) or (atoms, 3)
+
+    index and weights are from molecule_mapping. Returns an array of shape
+    (frames, molecules, 3), or (molecules, 3) for a single frame.
+    '''
+    positions = np.asarray(positions)
+    single = positions.ndim == 2
+    if single:
+        positions = positions[np.newaxis]
+    number_of_frames, _, dimensions = positions.shape
+    number_of_molecules = index.max() + 1
+    # Combined index of (frame, dimension, molecule), with atoms on the last axis
+    offsets = np.arange(number_of_frames * dimensions)[:, np.newaxis] * number_of_molecules
+    combined = (offsets + index[np.newaxis, :]).ravel()
+    weighted = (positions * weights[np.newaxis, :, np.newaxis]).transpose(0, 2, 1).ravel()
+    com = np.bincount(combined, weights=weighted, minlength=number_of_frames * dimensions * number_of_molecules)
+    com = com.reshape(number_of_frames, dimensions, number_of_molecules).transpose(0, 2, 1)
+    return com[0] if single else com
+
+
+def com_trajectory(frames, molecules=None, masses=None, frames_per_chunk=256):
+    ''' Centre-of-mass trajectory of all molecules, shape (frames, molecules, 3)
+
+    frames is an array (frames, atoms, 3) or a lazy trajectory (DumpTrajectory or
+    TrajectoryStore) that is read in chunks of frames_per_chunk frames. If molecules
+    or masses are not given, they are taken from the trajectory (a TrajectoryStore
+    converted with a data file).
+    '''
+    if molecules is None:
+        molecules = frames.molecules
+    if masses is None:
+        masses = frames.masses
+    if masses is None:
+        raise ValueError('Atom masses are needed, e.g. from read_lammps_data(\'data.initial\')')
+    index, weights, molecular_masses = molecule_mapping(molecules, masses)
+    com = np.zeros((len(frames), len(molecular_masses), 3))
+    if isinstance(frames, np.ndarray):
+        chunks = (frames[start:start + frames_per_chunk] for start in range(0, len(frames), frames_per_chunk))
+    else:
+        chunks = frames.chunks(frames_per_chunk)
+    start = 0
+    for chunk in chunks:
+        com[start:start + len(chunk)] = center_of_mass(chunk, index, weights)
+        start += len(chunk)
+    return com
+
+
+def molecular_mean_squared_displacement(frames, molecules=None, masses=None, frames_per_chunk=256):
+    ''' Multi-origin mean squared displacement of the molecular centres of mass
+
+    The drift of the centre of all molecules is removed, as in
+    analyse.compute_multi_origin_mean_squared_displacement.
+
+    Returns::
+
+        MSD, counts, standard_error
+    '''
+    from analyse import compute_multi_origin_mean_squared_displacement
+    com = com_trajectory(frames, molecules, masses, frames_per_chunk)
+    return compute_multi_origin_mean_squared_displacement(com)
@@ -0,0 +1,156 @@
+#!/bin/python3
+r""" Online multi-tau correlator for long time series
+
+The multi-tau (hierarchical block) correlator keeps, for level :math:`l = 0, 1, \ldots`,
+the last p samples of the series averaged over blocks of :math:`2^l` samples.
+Level 0 gives the correlation functions at the lags :math:`t = 0, 1, \ldots, p-1`,
+and level :math:`l > 0` at the lags :math:`t = j 2^l` for :math:`j = p/2, \ldots, p-1`.
+The lags are thus spaced logarithmically with p/2 points per octave, and the memory
+is :math:`O(p \log N)` per pair of channels, independently of the length N of the series.
+
+For every lag, the sums of products, and of the left (earlier) and right (later)
+samples, are accumulated, so the correlation functions
+
+ .. math::
+
+     C_{ab}(t) = \frac{1}{N}\sum_{\tau} \Delta x_a(\tau) \Delta x_b(\tau + t)
+
+with the deviations from the mean of the whole series are normalized as
+analyse.time_correlation. The values at the lags of level 0 are exact, and those of
+higher levels are averaged over blocks of :math:`2^l` samples:
+
+    correlator = MultiTauCorrelator(['PotEng', 'c_virial'])
+    for chunk in iter_thermo_log('log.lammps', usecols=['PotEng', 'c_virial']):
+        correlator.update(chunk)
+    lags, C = correlator.result()
+
+"""
+
+import time
+
+import numpy as np
+
+
+class MultiTauCorrelator:
+    ''' Multi-tau correlation functions of all pairs of channels, fed sample chunks
+
+    points_per_level (p) must be even. Samples are given to update as a dictionary
+    of arrays, or an array of shape (samples, channels). result() can be called at
+    any time, e.g. while a simulation is still running.
+    '''
+
+    def __init__(self, names, points_per_level=16):
+        if points_per_level < 2 or points_per_level % 2:
+            raise ValueError('points_per_level must be an even number of at least 2')
+        self.names = list(names)
+        self.points_per_level = points_per_level
+        self.number_of_samples = 0
+        self.sums = np.zeros(len(self.names))
+        self.levels = []
+
+    def _new_level(self, level):
+        p, k = self.points_per_level, len(self.names)
+        first_lag = 0 if level == 0 else p // 2
+        return {
+            'lags': np.arange(first_lag, p),
+            'history': np.zeros((0, k)),
+            'carry': np.zeros((0, k)),
+            'count': np.zeros(p - first_lag, dtype=np.int64),
+            'products': np.zeros((p - first_lag, k, k)),
+            'left': np.zeros((p - first_lag, k)),
+            'right': np.zeros((p - first_lag, k))
+        }
+
+    def update(self, chunk):
+        ''' Add consecutive samples, as a dictionary of arrays or an array (samples, channels) '''
+        if isinstance(chunk, dict):
+            chunk = np.column_stack([np.asarray(chunk[name], dtype=float) for name in self.names])
+        samples = np.asarray(chunk, dtype=float).reshape(-1, len(self.names))
+        self.number_of_samples += len(samples)
+        self.sums += samples.sum(axis=0)
+        level = 0
+        while len(samples) > 0:
+            if level == len(self.levels):
+                self.levels.append(self._new_level(level))
+            samples = self._update_level(self.levels[level], samples)
+            level += 1
+
+    def _update_level(self, state, samples):
+        ''' Correlate new samples of a level, and return the block averages for the next level '''
+        p = self.points_per_level
+        h, m = len(state['history']), len(samples)
+        data = np.concatenate([state['history'], samples])
+        for i, j in enumerate(state['lags']):
+            start = max(h, j)  # Index of the first later (right) sample
+            if start >= h + m:
+                continue
+            left = data[start - j:h + m - j]
+            right = data[start:h + m]
+            state['count'][i] += len(right)
+            state['products'][i] += left.T @ right
+            state['left'][i] += left.sum(axis=0)
+            state['right'][i] += right.sum(axis=0)
+        state['history'] = data[-(p - 1):] if p > 1 else data[:0]
+        pending = np.concatenate([state['carry'], samples])
+        n = len(pending) // 2 * 2
+        state['carry'] = pending[n:]
+        return (pending[0:n:2] + pending[1:n:2]) / 2
+
+    def result(self, dt=1.0):
+        ''' Lag times (lag in samples times dt) and correlation functions of all pairs
+
+        Returns::
+
+            t, C
+
+        where C[a, b] is the correlation function of channels names[a] and names[b],
+        an array of shape (channels, channels, lags), comparable to time_correlation.
+        '''
+        n = self.number_of_samples
+        mean = self.sums / max(n, 1)
+        lags, values = [], []
+        for level, state in enumerate(self.levels):
+            used = state['count'] > 0
+            count = state['count'][used][:, np.newaxis, np.newaxis]
+            left = state['left'][used][:, :, np.newaxis] / count
+            right = state['right'][used][:, np.newaxis, :] / count
+            covariance = (state['products'][used] / count - left * mean[np.newaxis, np.newaxis, :]
+                          - mean[np.newaxis, :, np.newaxis] * right
+                          + mean[:, np.newaxis] * mean[np.newaxis, :])
+            t = state['lags'][used] * 2**level
+            lags.append(t)
+            values.append(covariance * ((n - t) / n)[:, np.newaxis, np.newaxis])
+        if not lags:
+            k = len(self.names)
+            return np.zeros(0), np.zeros((k, k, 0))
+        t = np.concatenate(lags)
+        C = np.moveaxis(np.concatenate(values), 0, -1)
+        return t * dt, C
+
+    def __len__(self):
+        return self.number_of_samples
+
+
+def correlate_thermo_log(filename='log.lammps', usecols=('PotEng', 'c_virial'), points_per_level=16,
+                         follow=False, report=None, bytes_per_range=2**25, **kwargs):
+    ''' Multi-tau correlation functions of thermo columns, streamed from a LAMMPS log file
+
+    With follow=True the log file of a running simulation is followed (see
+    thermo_log.follow_thermo_log, with kwargs as poll_interval and timeout).
+    If report is given, it is called as report(correlator) after every chunk.
+
+    Returns the MultiTauCorrelator.
+    '''
+    from thermo_log import iter_thermo_log, follow_thermo_log
+    correlator = MultiTauCorrelator(usecols, points_per_level)
+    if follow:
+        chunks = follow_thermo_log(filename, usecols=usecols, bytes_per_range=bytes_per_range, **kwargs)
+    else:
+        chunks = iter_thermo_log(filename, usecols=usecols, bytes_per_range=bytes_per_range)
+    wall_time = time.time()
+    for chunk in chunks:
+        correlator.update(chunk)
+        if report is not None:
+            report(correlator)
+    print(f'Correlated {len(correlator)} samples of {list(usecols)} in {time.time() - wall_time:.1f} s')
+    return correlator
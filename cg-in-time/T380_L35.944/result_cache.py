@@ -0,0 +1,195 @@
+#!/bin/python3
+""" Content-addressed cache of analysis results
+
+A result is stored under a key that is the hash of the name of the analysis, the
+fingerprints of its input files, its parameters and a version of the analysis code.
+If neither the inputs, the parameters nor the code changed, the stored arrays are
+returned instead of computing the result again:
+
+    cache = ResultCache()
+    result, hit = cache.cached('mean_squared_displacement', compute,
+                               inputs=['dump.constant_volume'], parameters={'time_step': 2e-15})
+
+Results are dictionaries of NumPy arrays (or scalars), or pandas DataFrames. Every entry
+is a directory with the arrays (arrays.npz) and a description (meta.json). When the cache
+grows beyond max_bytes, the least recently used entries are evicted. The cache directory
+is `~/.cache/cg_in_time/results`, or the value of the environment variable
+`RESULT_CACHE_DIR`.
+
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+CACHE_VERSION = 1
+
+# Modules of the analysis code; a change to any of them invalidates all results
+CODE_FILES = ['analyse.py', 'thermo_log.py', 'trajectory.py', 'binning.py', 'correlation.py',
+              'trajectory_store.py', 'molecules.py', 'dynamics.py',
+              'heterogeneity.py']
+
+
+def default_cache_dir():
+    ''' Directory for cached results '''
+    return os.environ.get('RESULT_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'cg_in_time', 'results'))
+
+
+def file_fingerprint(filename, sample_size=2**20):
+    ''' Fingerprint of a file from its size, modification time, and first and last bytes
+
+    Hashing the whole of a multi-gigabyte log or dump file would take as long as
+    parsing it, so only the first and last sample_size bytes are hashed.
+    '''
+    stat = os.stat(filename)
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        digest.update(file.read(sample_size))
+        if stat.st_size > sample_size:
+            file.seek(max(sample_size, stat.st_size - sample_size))
+            digest.update(file.read(sample_size))
+    return f'{stat.st_size}:{stat.st_mtime_ns}:{digest.hexdigest()}'
+
+
+def code_version(files=None):
+    ''' Hash of the source of the analysis modules (see CODE_FILES) '''
+    directory = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha1(str(CACHE_VERSION).encode())
+    for name in files or CODE_FILES:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                digest.update(file.read())
+    return digest.hexdigest()
+
+
+def _storable(array):
+    ''' Object arrays (e.g. string indices) as strings, so they are stored without pickle '''
+    array = np.asarray(array)
+    return array.astype(str) if array.dtype == object else array
+
+
+def _to_arrays(result):
+    ''' Arrays and description of a result (a dictionary or a DataFrame) '''
+    try:
+        import pandas as pd
+        if isinstance(result, pd.DataFrame):
+            arrays = {f'column_{i}': _storable(result[column].to_numpy()) for i, column in enumerate(result.columns)}
+            arrays['index'] = _storable(result.index.to_numpy())
+            return arrays, {'kind': 'dataframe', 'columns': [str(column) for column in result.columns]}
+    except ImportError:
+        pass
+    arrays = {f'column_{i}': _storable(value) for i, value in enumerate(result.values())}
+    return arrays, {'kind': 'dict', 'columns': [str(key) for key in result]}
+
+
+def _from_arrays(arrays, meta):
+    values = [arrays[f'column_{i}'] for i in range(len(meta['columns']))]
+    if meta['kind'] == 'dataframe':
+        import pandas as pd
+        return pd.DataFrame(dict(zip(meta['columns'], values)), index=arrays['index'])
+    return {column: value[()] if value.ndim == 0 else value for column, value in zip(meta['columns'], values)}
+
+
+class ResultCache:
+    ''' Directory of analysis results keyed by inputs, parameters and code version '''
+
+    def __init__(self, directory=None, max_bytes=2**32, version=None, verbose=False):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.version = version or code_version()
+        self.verbose = verbose
+
+    def key(self, name, inputs=(), parameters=None):
+        ''' Hash of the name, input file fingerprints, parameters and code version '''
+        description = {
+            'name': name,
+            'inputs': [[os.path.abspath(filename), file_fingerprint(filename)] for filename in inputs],
+            'parameters': parameters or {},
+            'version': self.version
+        }
+        text = json.dumps(description, sort_keys=True, default=str)
+        return f'{name}-{hashlib.sha1(text.encode()).hexdigest()[:20]}'
+
+    def load(self, key):
+        ''' Stored result, or None if there is no (complete) entry '''
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry, 'meta.json')) as file:
+                meta = json.load(file)
+            with np.load(os.path.join(entry, 'arrays.npz'), allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError, KeyError):
+            return None
+        try:
+            os.utime(os.path.join(entry, 'meta.json'))  # Mark as recently used
+        except OSError:  # E.g. a read-only or shared cache directory
+            pass
+        return _from_arrays(arrays, meta)
+
+    def store(self, key, result):
+        ''' Store a result, and evict old entries if the cache is too large '''
+        arrays, meta = _to_arrays(result)
+        entry = os.path.join(self.directory, key)
+        temporary = f'{entry}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(temporary, exist_ok=True)
+            np.savez(os.path.join(temporary, 'arrays.npz'), **arrays)
+            with open(os.path.join(temporary, 'meta.json'), 'w') as file:
+                json.dump(meta, file)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(temporary, entry)
+        except (OSError, ValueError) as error:
+            shutil.rmtree(temporary, ignore_errors=True)
+            if self.verbose:
+                print(f'Could not store {key} in {self.directory}: {error}')
+            return
+        self.evict()
+
+    def entries(self):
+        ''' List of (last use, size in bytes, path) of all entries '''
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            meta = os.path.join(path, 'meta.json')
+            if name.endswith('.tmp') or not os.path.exists(meta):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            entries.append((os.path.getmtime(meta), size, path))
+        return entries
+
+    def evict(self):
+        ''' Remove the least recently used entries until the cache is within max_bytes '''
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        while entries and total > self.max_bytes:
+            _, size, path = entries.pop(0)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            if self.verbose:
+                print(f'Evicted {path} from result cache')
+
+    def cached(self, name, compute, inputs=(), parameters=None):
+        ''' Stored result of compute(), or compute and store it
+
+        Returns the result, and whether it was found in the cache.
+        '''
+        key = self.key(name, inputs, parameters)
+        result = self.load(key)
+        if result is not None:
+            if self.verbose:
+                print(f'Result {name} loaded from cache')
+            return result, True
+        tic = time.perf_counter()
+        result = compute()
+        self.store(key, result)
+        if self.verbose:
+            print(f'Result {name} computed in {time.perf_counter() - tic:.1f} s')
+        return result, False
@@ -0,0 +1,463 @@
+#!/bin/python3
+""" Fast reading of thermodynamic data in LAMMPS log files
+
+The first time a log file is read, its thermo block is parsed and the columns are
+written to a cache directory as one NumPy file per column. Later reads memory-map
+these files instead of parsing the log again. The cache entry is keyed by the absolute
+path of the log file, and is invalidated if the size or modification time of the
+log file changes. The cache directory is `~/.cache/cg_in_time/thermo`, or the value
+of the environment variable `THERMO_CACHE_DIR`.
+
+"""
+
+import hashlib
+import json
+import os
+import re
+import warnings
+
+import numpy as np
+
+CACHE_VERSION = 1
+
+
+def default_cache_dir():
+    ''' Directory for cached thermo data '''
+    return os.environ.get('THERMO_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'cg_in_time', 'thermo'))
+
+
+def _fromstring(block):
+    ''' Parse whitespace separated numbers, or return None if the block has non-numbers '''
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(block, sep=' ')
+        except (ValueError, DeprecationWarning):
+            return None
+
+
+def locate_thermo_block(filename, offset=0, chunk_size=2**26):
+    ''' Find the first thermo block at or after a byte offset in a LAMMPS log file
+
+    The block starts after the line beginning with `Step`, and the byte range of the
+    numbers ends at the first line that is blank or starts with a letter (e.g. `Loop time`).
+
+    Returns::
+
+        columns, start, end
+
+    or None if there are no more thermo blocks.
+    '''
+    with open(filename, 'rb') as file:
+        file.seek(offset)
+        line = file.readline()
+        while line:
+            elements = line.split()
+            if len(elements) > 0 and elements[0] == b'Step':
+                break
+            line = file.readline()
+        else:
+            return None
+        columns = [e.decode() for e in elements]
+        start = file.tell()
+        # The search starts at the newline ending the header line
+        position = start - 1
+        file.seek(position)
+        end_of_block = re.compile(rb'\n[^ \t\d+\-.]')
+        tail = b''
+        chunk = file.read(chunk_size)
+        while chunk:
+            data = tail + chunk
+            found = end_of_block.search(data)
+            if found:
+                return columns, start, position - len(tail) + found.start() + 1
+            tail = data[-1:]
+            position += len(chunk)
+            chunk = file.read(chunk_size)
+    return columns, start, position
+
+
+def _line_aligned_ranges(filename, start, end, bytes_per_range):
+    ''' Split the byte range start:end into ranges that begin at the start of a line '''
+    edges = [start]
+    with open(filename, 'rb') as file:
+        for nominal in range(start + bytes_per_range, end, bytes_per_range):
+            if nominal <= edges[-1]:
+                continue
+            file.seek(nominal - 1)
+            file.readline()
+            if file.tell() < end:
+                edges.append(file.tell())
+    edges.append(end)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _local_slice(selection, first_line, number_of_lines):
+    ''' The part of a global frame selection that falls in lines first_line, first_line+1, ... '''
+    step = selection.step
+    lowest = max(selection.start, first_line)
+    first = selection.start + -(-(lowest - selection.start) // step) * step
+    stop = number_of_lines
+    if selection.stop is not None:
+        stop = min(stop, selection.stop - first_line)
+    return slice(first - first_line, max(stop, first - first_line), step)
+
+
+def _parse_range(filename, start, end, number_of_columns, usecols, dtype):
+    ''' Parse the thermo lines in a byte range
+
+    Returns the rows with the selected columns, the number of lines parsed and whether all
+    lines in the range belong to the thermo block.
+    '''
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        block = file.read(end - start)
+    number_of_lines = block.count(b'\n') + (0 if block.endswith(b'\n') or not block else 1)
+    data = _fromstring(block)
+    complete = data is not None and data.size == number_of_lines * number_of_columns
+    if not complete:
+        # The thermo block ends within this range
+        good = []
+        for line in block.splitlines():
+            if len(line.split()) != number_of_columns:
+                break
+            good.append(line)
+        number_of_lines = len(good)
+        data = _fromstring(b'\n'.join(good)) if good else np.zeros(0)
+    data = data.reshape(number_of_lines, number_of_columns)
+    if usecols is not None:
+        data = data[:, usecols]
+    return data.astype(dtype, copy=False), number_of_lines, complete
+
+
+def _column_indices(filename, columns, usecols):
+    ''' Indices and names of the selected thermo columns (all if usecols is None) '''
+    if usecols is None:
+        return None, columns
+    missing = [column for column in usecols if column not in columns]
+    if missing:
+        raise ValueError(f'Columns {missing} not in thermo data of {filename}: {columns}')
+    return [columns.index(column) for column in usecols], list(usecols)
+
+
+def parse_thermo_log(filename, usecols=None, dtype=float, selection=slice(0, None, 1),
+                     processes=None, bytes_per_range=2**25):
+    ''' Parse the first thermo block of a LAMMPS log file
+
+    The block starts after the line beginning with `Step`, and ends at the first line
+    with a different number of elements (as in thermo_data_as_dataframe).
+    The numbers are split into byte ranges on line boundaries, and the ranges are
+    parsed with a single NumPy call each in a pool of processes (default: one per CPU).
+    Only the columns named in usecols (default all) and the frames in the selection
+    (see frame_slice) are returned, in the chosen dtype.
+
+    Returns::
+
+        columns, data
+
+    where data is an array of shape (frames, columns).
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    block = locate_thermo_block(filename)
+    if block is None:
+        raise ValueError(f'No thermo header (Step ...) found in {filename}')
+    columns, start, end = block
+    number_of_columns = len(columns)
+    indices, columns = _column_indices(filename, columns, usecols)
+    ranges = _line_aligned_ranges(filename, start, end, bytes_per_range)
+    arguments = [(filename, range_start, range_end, number_of_columns, indices, dtype)
+                 for range_start, range_end in ranges]
+    processes = processes or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=min(processes, len(ranges))) if processes > 1 and len(ranges) > 1 else None
+    try:
+        if pool is None:
+            results = (_parse_range(*argument) for argument in arguments)
+        else:
+            results = pool.map(_parse_range, *zip(*arguments))
+        # The frame selection is applied in order, as the global line numbers are only
+        # known from the line counts of the preceding ranges
+        parts = []
+        first_line = 0
+        for data, number_of_lines, complete in results:
+            parts.append(data[_local_slice(selection, first_line, number_of_lines)])
+            first_line += number_of_lines
+            if not complete:
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    if len(parts) == 0:
+        return columns, np.zeros((0, len(columns)), dtype=dtype)
+    return columns, np.concatenate(parts)
+
+
+def iter_thermo_log(filename, usecols=None, dtype=float, bytes_per_range=2**25):
+    ''' Stream the first thermo block of a LAMMPS log file in chunks
+
+    Yields a dictionary of arrays for every byte range of about bytes_per_range bytes,
+    so the memory use is independent of the length of the log file.
+    '''
+    block = locate_thermo_block(filename)
+    if block is None:
+        raise ValueError(f'No thermo header (Step ...) found in {filename}')
+    columns, start, end = block
+    indices, names = _column_indices(filename, columns, usecols)
+    for range_start, range_end in _line_aligned_ranges(filename, start, end, bytes_per_range):
+        data, _, complete = _parse_range(filename, range_start, range_end, len(columns), indices, dtype)
+        yield {name: data[:, i] for i, name in enumerate(names)}
+        if not complete:
+            break
+
+
+def follow_thermo_log(filename, usecols=None, dtype=float, poll_interval=10.0, timeout=600.0,
+                      bytes_per_range=2**25):
+    ''' Stream the first thermo block of a LAMMPS log file that is still being written
+
+    Yields a dictionary of arrays of the complete thermo lines appended since the last
+    chunk. Stops when the thermo block ends (e.g. at `Loop time`), or when the file has
+    not grown for timeout seconds (None to wait forever). The file is checked for new
+    lines every poll_interval seconds.
+    '''
+    import time
+    last_growth = time.time()
+    block = locate_thermo_block(filename) if os.path.exists(filename) else None
+    while block is None:
+        if timeout is not None and time.time() - last_growth > timeout:
+            raise ValueError(f'No thermo header (Step ...) found in {filename}')
+        time.sleep(poll_interval)
+        block = locate_thermo_block(filename) if os.path.exists(filename) else None
+    columns, position, _ = block
+    indices, names = _column_indices(filename, columns, usecols)
+    while True:
+        with open(filename, 'rb') as file:
+            file.seek(position)
+            data = file.read(bytes_per_range)
+        data = data[:data.rfind(b'\n') + 1]  # Complete lines only
+        if not data:
+            if timeout is not None and time.time() - last_growth > timeout:
+                return
+            time.sleep(poll_interval)
+            continue
+        last_growth = time.time()
+        end = position + len(data)
+        rows, _, complete = _parse_range(filename, position, end, len(columns), indices, dtype)
+        if len(rows) > 0:
+            yield {name: rows[:, i] for i, name in enumerate(names)}
+        if not complete:
+            return
+        position = end
+
+
+def _cache_entry(filename, cache_dir):
+    path = os.path.abspath(filename)
+    key = hashlib.sha1(path.encode()).hexdigest()[:16]
+    stat = os.stat(path)
+    meta = {'version': CACHE_VERSION, 'source': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return os.path.join(cache_dir, key), meta
+
+
+def _load_cache(directory, meta):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as file:
+            stored = json.load(file)
+    except (OSError, ValueError):
+        return None
+    columns = stored.pop('columns', None)
+    if stored != meta or columns is None:
+        return None
+    try:
+        return {column: np.load(os.path.join(directory, f'column_{i}.npy'), mmap_mode='r')
+                for i, column in enumerate(columns)}
+    except (OSError, ValueError):
+        return None
+
+
+def _save_cache(directory, meta, columns, data):
+    os.makedirs(directory, exist_ok=True)
+    meta_filename = os.path.join(directory, 'meta.json')
+    if os.path.exists(meta_filename):
+        os.remove(meta_filename)
+    for i in range(len(columns)):
+        np.save(os.path.join(directory, f'column_{i}.npy'), np.ascontiguousarray(data[:, i]))
+    # Written last, so a cache entry is only used when complete
+    with open(meta_filename, 'w') as file:
+        json.dump(dict(meta, columns=columns), file)
+
+
+def read_thermo_log(filename='log.lammps', usecols=None, dtype=float, selection=slice(0, None, 1),
+                    processes=None, cache=True, cache_dir=None, verbose=False):
+    ''' Columns of the first thermo block of a LAMMPS log file
+
+    Returns a dictionary of arrays with the columns in usecols (default all) and the
+    frames in the selection (see frame_slice). With cache=True the arrays are
+    memory-mapped from the cache, and the log file is only parsed (all columns) if it
+    has no valid cache entry. With cache=False only the requested data is kept while
+    parsing. See parse_thermo_log for the processes argument.
+    '''
+    if not cache:
+        if verbose:
+            print(f'Reading data from {filename}')
+        columns, data = parse_thermo_log(filename, usecols=usecols, dtype=dtype,
+                                         selection=selection, processes=processes)
+        return {column: data[:, i] for i, column in enumerate(columns)}
+    directory, meta = _cache_entry(filename, cache_dir or default_cache_dir())
+    columns = _load_cache(directory, meta)
+    if columns is not None:
+        if verbose:
+            print(f'Loaded thermo data of {filename} from cache {directory}')
+    else:
+        if verbose:
+            print(f'Reading data from {filename}')
+        names, data = parse_thermo_log(filename, processes=processes)
+        try:
+            _save_cache(directory, meta, names, data)
+        except OSError as error:
+            if verbose:
+                print(f'Could not write cache {directory}: {error}')
+        columns = {column: data[:, i] for i, column in enumerate(names)}
+    if usecols is not None:
+        missing = [column for column in usecols if column not in columns]
+        if missing:
+            raise ValueError(f'Columns {missing} not in thermo data of {filename}: {list(columns)}')
+        columns = {column: columns[column] for column in usecols}
+    return {column: data[selection].astype(dtype, copy=False) for column, data in columns.items()}
+
+
+def frame_slice(first_frame=0, stride_frame=1, last_frame=None):
+    ''' Frames selected by the first_frame, stride_frame and last_frame arguments
+    of thermo_data_as_dataframe '''
+    start = -(-first_frame // stride_frame) * stride_frame
+    stop = last_frame + 1 if last_frame else None
+    return slice(start, stop, stride_frame)
+
+
+def _count_lines(filename, start, end, chunk_size=2**25):
+    ''' Number of newlines in the byte range start:end, read in chunks of chunk_size bytes '''
+    count = 0
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        for position in range(start, end, chunk_size):
+            count += file.read(min(chunk_size, end - position)).count(b'\n')
+    return count
+
+
+def _first_and_last_step(filename, start, end):
+    ''' Step of the first and the last line in the byte range of a thermo block '''
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        first = file.readline().split()
+        file.seek(max(start, end - 4096))
+        last = file.read(end - max(start, end - 4096)).splitlines()[-1].split()
+    return int(float(first[0])), int(float(last[0]))
+
+
+def thermo_runs(filenames):
+    ''' All thermo blocks in a list of LAMMPS log files (or a single log file)
+
+    Each `run` command in a log file gives a thermo block. Returns a list of dictionaries
+    with the filename, columns, byte range, number of lines and first and last step
+    of each block, in order.
+    '''
+    if isinstance(filenames, (str, os.PathLike)):
+        filenames = [filenames]
+    blocks = []
+    for filename in filenames:
+        offset = 0
+        block = locate_thermo_block(filename, offset)
+        while block is not None:
+            columns, start, end = block
+            number_of_lines = _count_lines(filename, start, end)
+            if number_of_lines > 0:
+                first_step, last_step = _first_and_last_step(filename, start, end)
+                blocks.append({
+                    'filename': filename, 'columns': columns, 'start': start, 'end': end,
+                    'number_of_lines': number_of_lines, 'first_step': first_step, 'last_step': last_step
+                })
+            offset = end
+            block = locate_thermo_block(filename, offset)
+    if len(blocks) == 0:
+        raise ValueError(f'No thermo data (Step ...) found in {filenames}')
+    for block in blocks[1:]:
+        if block['columns'] != blocks[0]['columns']:
+            raise ValueError(f'Thermo columns of {block["filename"]} differ: '
+                             f'{block["columns"]} and {blocks[0]["columns"]}')
+    return blocks
+
+
+def _is_continuation(block, previous):
+    ''' A block that does not start after the last step of the previous block
+    continues from its final configuration (e.g. a new log file starting at step 0) '''
+    return block['first_step'] <= previous['last_step']
+
+
+def read_thermo_runs(filenames, usecols=None, dtype=float, time_step=None, processes=None,
+                     bytes_per_range=2**25, verbose=False):
+    ''' Stitch the thermo blocks of restarts and continuation logs into one time series
+
+    filenames is a single log file (possibly with several `run` commands) or a list of
+    log files, e.g. ['log.lammps', 'log_2nd.lammps']. A block that continues from the final
+    configuration of the previous block is shifted to continue its Step axis, and its first
+    frame, which duplicates the last frame of the previous block, is dropped. The total
+    number of frames is counted before the columns are allocated, and all byte ranges are
+    parsed in one process pool and written directly into the preallocated arrays.
+
+    Returns a dictionary of arrays with the columns in usecols (default all), and
+    a Time column if time_step is given. Step is always kept in double precision.
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    blocks = thermo_runs(filenames)
+    all_columns = blocks[0]['columns']
+    columns = all_columns if usecols is None else list(usecols)
+    missing = [column for column in columns if column not in all_columns]
+    if missing:
+        raise ValueError(f'Columns {missing} not in thermo data: {all_columns}')
+    indices = [all_columns.index(column) for column in columns]
+    step_column = all_columns.index('Step')
+
+    # Count frames before allocating
+    duplicates = [False] + [_is_continuation(block, previous) for previous, block in zip(blocks[:-1], blocks[1:])]
+    number_of_frames = sum(block['number_of_lines'] for block in blocks) - sum(duplicates)
+    if verbose:
+        print(f'Found {len(blocks)} thermo blocks with {number_of_frames} frames in total')
+    data = np.zeros((number_of_frames, len(columns)), dtype=dtype)
+    steps = np.zeros(number_of_frames, dtype=float)
+
+    tasks, arguments = [], []
+    for b, block in enumerate(blocks):
+        for start, end in _line_aligned_ranges(block['filename'], block['start'], block['end'], bytes_per_range):
+            tasks.append(b)
+            arguments.append((block['filename'], start, end, len(all_columns), None, float))
+    processes = min(processes or os.cpu_count() or 1, len(arguments))
+    pool = ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+    try:
+        if pool is None:
+            results = (_parse_range(*argument) for argument in arguments)
+        else:
+            results = pool.map(_parse_range, *zip(*arguments))
+        frame, step_offset, last_step = 0, 0.0, None
+        current_block, block_ended = None, False
+        for b, (part, _, complete) in zip(tasks, results):
+            if b != current_block:
+                current_block, block_ended = b, False
+                if duplicates[b] and len(part) > 0 and last_step is not None:
+                    step_offset = last_step - part[0, step_column]
+                    part = part[1:]
+            if block_ended or len(part) == 0:
+                block_ended = block_ended or not complete
+                continue
+            n = min(len(part), number_of_frames - frame)
+            steps[frame:frame + n] = part[:n, step_column] + step_offset
+            data[frame:frame + n] = part[:n, indices]
+            frame += n
+            last_step = steps[frame - 1]
+            block_ended = not complete
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    out = {}
+    if time_step:
+        out['Time'] = steps[:frame] * time_step
+    for i, column in enumerate(columns):
+        out[column] = steps[:frame] if column == 'Step' else data[:frame, i]
+    return out
@@ -0,0 +1,178 @@
+#!/bin/python3
+""" Timing and memory traces of the analysis pipeline
+
+Stages of the analysis are wrapped in spans, that record the wall time, CPU time,
+memory and size of the arrays of every call to a JSON-lines trace file, one line per
+span. The memory is given as peak_rss, the high-water mark of the resident memory (RSS)
+of the process so far, and rss_growth, by how much the span raised that mark (zero for
+a span that stayed below the peak of an earlier one):
+
+    enable('trace.jsonl')
+    with span('fft', frames=len(x)) as record:
+        c = time_correlation(x)
+        record['bytes'] = c.nbytes
+
+or, for a function, with the decorator @traced('fft'). If tracing is not enabled
+(with enable, or the environment variable ANALYSIS_TRACE), spans only cost a check
+of a global variable. The traces of many state points are aggregated with
+
+    python3 tracing.py summary ../constant_volume
+
+which lists the total time of every stage in all `T*_L*/trace.jsonl` files.
+
+"""
+
+import functools
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+_trace = {'filename': os.environ.get('ANALYSIS_TRACE') or None, 'run': None, 'stack': []}
+
+
+def enable(filename='trace.jsonl'):
+    ''' Append spans to a JSON-lines file (None to disable tracing) '''
+    _trace['filename'] = filename
+    _trace['run'] = None
+
+
+def enabled():
+    return _trace['filename'] is not None
+
+
+def _run_id():
+    if _trace['run'] is None:
+        _trace['run'] = f'{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}'
+    return _trace['run']
+
+
+def _peak_rss():
+    ''' Maximum resident set size of the process so far, in bytes '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux reports kB
+
+
+def nbytes(obj):
+    ''' Size in bytes of arrays, Series and DataFrames (also in tuples, lists and dicts) '''
+    if isinstance(obj, (tuple, list)):
+        return sum(nbytes(item) for item in obj)
+    if isinstance(obj, dict):
+        return sum(nbytes(item) for item in obj.values())
+    if hasattr(obj, 'memory_usage') and hasattr(obj, 'columns'):  # DataFrame
+        return int(obj.memory_usage(index=False).sum())
+    return int(getattr(obj, 'nbytes', 0))
+
+
+@contextmanager
+def span(name, **attributes):
+    ''' Record the time and memory of a block of code as a span
+
+    Yields a dictionary, where attributes (e.g. bytes, or results as D) can be added.
+    '''
+    if not enabled():
+        yield {}
+        return
+    record = dict(attributes)
+    parent = _trace['stack'][-1] if _trace['stack'] else None
+    _trace['stack'].append(name)
+    start, tic, cpu = time.time(), time.perf_counter(), time.process_time()
+    rss = _peak_rss()
+    try:
+        yield record
+    finally:
+        wall, cpu = time.perf_counter() - tic, time.process_time() - cpu
+        _trace['stack'].pop()
+        peak_rss = _peak_rss()
+        entry = {'run': _run_id(), 'span': name, 'parent': parent, 'start': start, 'wall': wall, 'cpu': cpu,
+                 'peak_rss': peak_rss, 'rss_growth': peak_rss - rss, 'cwd': os.getcwd()}
+        entry.update(record)
+        try:
+            with open(_trace['filename'], 'a') as file:
+                file.write(json.dumps(entry, default=str) + '\n')
+        except OSError as error:
+            print(f'Could not write trace to {_trace["filename"]}: {error}')
+
+
+def traced(name):
+    ''' Decorator that records every call of a function as a span, with the size of the result '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return function(*args, **kwargs)
+            with span(name, function=function.__name__) as record:
+                result = function(*args, **kwargs)
+                record['bytes'] = nbytes(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def read_traces(filenames):
+    ''' All spans of JSON-lines trace files, skipping lines that are not valid JSON '''
+    spans = []
+    for filename in filenames:
+        with open(filename) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entry['trace'] = filename
+                spans.append(entry)
+    return spans
+
+
+def summarize(spans):
+    ''' Totals of every stage: calls, wall time, CPU time, peak RSS, RSS growth and bytes, sorted by wall time
+
+    Only top-level spans of a stage are counted, so time in nested spans of the
+    same name is not counted twice.
+    '''
+    stages = {}
+    for entry in spans:
+        if entry.get('parent') == entry['span']:
+            continue
+        stage = stages.setdefault(entry['span'], {'span': entry['span'], 'calls': 0, 'wall': 0.0, 'cpu': 0.0,
+                                                  'peak_rss': 0, 'rss_growth': 0, 'bytes': 0, 'traces': set()})
+        stage['calls'] += 1
+        stage['wall'] += entry['wall']
+        stage['cpu'] += entry['cpu']
+        stage['peak_rss'] = max(stage['peak_rss'], entry.get('peak_rss', 0))
+        stage['rss_growth'] = max(stage['rss_growth'], entry.get('rss_growth', 0))
+        stage['bytes'] += entry.get('bytes', 0) or 0
+        stage['traces'].add(entry['trace'])
+    table = sorted(stages.values(), key=lambda stage: stage['wall'], reverse=True)
+    for stage in table:
+        stage['traces'] = len(stage['traces'])
+    return table
+
+
+def main():
+    import argparse
+    from glob import glob
+    parser = argparse.ArgumentParser(description='Summarize analysis traces')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    summary = subparsers.add_parser('summary', help='Aggregate traces of state point directories')
+    summary.add_argument('root', nargs='?', default='.', help='Directory with the state point directories')
+    summary.add_argument('--pattern', default='T*_L*', help='Glob pattern of state point directories')
+    summary.add_argument('--trace', default='trace.jsonl', help='Name of the trace files')
+    args = parser.parse_args()
+    filenames = sorted(glob(os.path.join(args.root, args.pattern, args.trace)))
+    filenames += glob(os.path.join(args.root, args.trace))
+    spans = read_traces(filenames)
+    print(f'{len(spans)} spans in {len(filenames)} trace files')
+    table = summarize(spans)
+    total = sum(entry['wall'] for entry in spans if entry.get('parent') is None) or 1.0
+    print(f'{"Stage":>12} {"Calls":>7} {"Wall [s]":>10} {"Share":>7} {"CPU [s]":>10} '
+          f'{"Peak RSS [MiB]":>15} {"RSS growth [MiB]":>17} {"Data [MiB]":>11} {"Traces":>7}')
+    for stage in table:
+        print(f'{stage["span"]:>12} {stage["calls"]:>7} {stage["wall"]:>10.3f} {stage["wall"] / total:>7.1%} '
+              f'{stage["cpu"]:>10.3f} {stage["peak_rss"] / 2**20:>15.1f} {stage["rss_growth"] / 2**20:>17.1f} '
+              f'{stage["bytes"] / 2**20:>11.1f} '
+              f'{stage["traces"]:>7}')
+
+
+if __name__ == '__main__':
+    main()
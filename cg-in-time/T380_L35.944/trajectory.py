@@ -0,0 +1,288 @@
+#!/bin/python3
+""" Lazy random-access trajectories of LAMMPS dump files
+
+The dump file is scanned once to build an index of the byte offset, time step and
+box of every frame. The index is saved next to the dump file (as `<dump>.index.npz`),
+and is reused as long as the size and modification time of the dump is unchanged.
+Frames are then read by seeking straight to their offset:
+
+    traj = DumpTrajectory('dump.constant_volume')
+    first = traj[0]             # Positions of a single frame, shape (atoms, 3)
+    every_100th = traj[::100]   # Positions of a selection, shape (frames, atoms, 3)
+    log_spaced = traj[traj.log_spaced_indices()]
+
+"""
+
+import os
+
+import numpy as np
+
+INDEX_VERSION = 2
+
+
+def _dump_columns(columns):
+    ''' Map the columns of an ITEM: ATOMS header to the indices needed for positions
+
+    Unwrapped coordinates (xu or xsu) are preferred. Otherwise wrapped coordinates
+    (x or xs) are used, and unwrapped with the image flags (ix, iy, iz) if present.
+    '''
+    index = {name: i for i, name in enumerate(columns)}
+    for names, scaled in (('xu yu zu', False), ('xsu ysu zsu', True),
+                          ('x y z', False), ('xs ys zs', True)):
+        names = names.split()
+        if all(name in index for name in names):
+            break
+    else:
+        raise ValueError(f'No atomic positions among dump columns: {columns}')
+    images = None
+    if not names[0].endswith('u') and all(name in index for name in ('ix', 'iy', 'iz')):
+        images = [index['ix'], index['iy'], index['iz']]
+    return {
+        'id': index.get('id'),
+        'type': index.get('type'),
+        'position': [index[name] for name in names],
+        'image': images,
+        'scaled': scaled
+    }
+
+
+def _dump_positions(data, layout, box):
+    ''' Unwrapped and unscaled positions of a parsed ATOMS block '''
+    length = box[:, 1] - box[:, 0]
+    pos = data[:, layout['position']]
+    if layout['scaled']:
+        pos = box[:, 0] + pos * length
+    if layout['image'] is not None:
+        pos += data[:, layout['image']] * length
+    return pos
+
+
+def _frame_offsets(filename, chunk_size=2**26):
+    ''' Byte offsets of the ITEM: TIMESTEP lines in a LAMMPS dump file '''
+    key = b'ITEM: TIMESTEP'
+    offsets = []
+    position = 0
+    tail = b''
+    with open(filename, 'rb') as file:
+        chunk = file.read(chunk_size)
+        while chunk:
+            data = tail + chunk
+            start = position - len(tail)
+            found = data.find(key)
+            while found >= 0:
+                offsets.append(start + found)
+                found = data.find(key, found + 1)
+            tail = data[-(len(key) - 1):]
+            position += len(chunk)
+            chunk = file.read(chunk_size)
+    return np.array(offsets, dtype=np.int64)
+
+
+def log_spaced_lags(number_of_frames, points_per_decade=10):
+    ''' Unique lags 0, 1, 2, ... (in frames) spaced logarithmically up to the last frame '''
+    if number_of_frames < 2:
+        return np.arange(number_of_frames)
+    number_of_points = int(np.ceil(np.log10(number_of_frames - 1) * points_per_decade)) + 1
+    lags = np.round(np.logspace(0, np.log10(number_of_frames - 1), number_of_points)).astype(int)
+    return np.unique(np.append(0, lags))
+
+
+def build_dump_index(filename, verbose=False):
+    ''' Scan a LAMMPS dump file for frame offsets, time steps and boxes
+
+    Returns a dictionary of arrays, where frame i has its atom lines in the byte range
+    data_offsets[i]:ends[i] of the file. An incomplete last frame (of a dump that is
+    still being written) is left out, as in read_dump.
+    '''
+    offsets = _frame_offsets(filename)
+    number_of_frames = offsets.size
+    steps = np.zeros(number_of_frames, dtype=np.int64)
+    boxes = np.zeros((number_of_frames, 3, 2), dtype=float)
+    data_offsets = np.zeros(number_of_frames, dtype=np.int64)
+    number_of_atoms = None
+    columns = None
+    complete = True
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as file:
+        for frame, offset in enumerate(offsets):
+            file.seek(offset)
+            try:
+                line = file.readline()
+                while line and not line.startswith(b'ITEM: ATOMS'):
+                    if line.startswith(b'ITEM: TIMESTEP'):
+                        steps[frame] = int(file.readline())
+                    elif line.startswith(b'ITEM: NUMBER OF ATOMS'):
+                        n = int(file.readline())
+                        if number_of_atoms is None:
+                            number_of_atoms = n
+                        elif n != number_of_atoms:
+                            raise ValueError(f'Number of atoms changed from {number_of_atoms} to {n} in frame {frame}')
+                    elif line.startswith(b'ITEM: BOX BOUNDS'):
+                        for dim in 0, 1, 2:
+                            elms = file.readline().split()
+                            boxes[frame, dim] = float(elms[0]), float(elms[1])
+                    line = file.readline()
+            except (ValueError, IndexError):
+                if file.tell() < size:
+                    raise
+                line = b''  # Header cut off at the end of the file
+            if not line:
+                complete = False
+                break
+            if columns is None:
+                columns = line.decode().split()[2:]
+            data_offsets[frame] = file.tell()
+        if complete and number_of_frames > 0:
+            file.seek(data_offsets[-1])
+            block = file.read(size - data_offsets[-1])
+            complete = np.fromstring(block, sep=' ').size == number_of_atoms * len(columns)
+    ends = np.append(offsets[1:], size)
+    if not complete:
+        number_of_frames -= 1
+        offsets, data_offsets, ends = offsets[:-1], data_offsets[:-1], ends[:-1]
+        steps, boxes = steps[:-1], boxes[:-1]
+    if verbose:
+        print(f'Indexed {number_of_frames} frames of {number_of_atoms} atoms in {filename}')
+    return {
+        'offsets': offsets,
+        'data_offsets': data_offsets,
+        'ends': ends,
+        'steps': steps,
+        'boxes': boxes,
+        'number_of_atoms': number_of_atoms or 0,
+        'columns': np.array(columns or [], dtype=str),
+    }
+
+
+class DumpTrajectory:
+    ''' Lazy random-access view of the frames in a LAMMPS dump file
+
+    Indexing with an integer returns the unwrapped positions of that frame as an
+    array of shape (atoms, 3), sorted by atom id. Indexing with a slice, a list
+    or an array of frame indices returns an array of shape (frames, atoms, 3).
+    Only the requested frames are read from disk.
+    '''
+
+    def __init__(self, filename='dump.lammps', index_filename=None, verbose=False):
+        self.filename = filename
+        self.index_filename = index_filename or f'{filename}.index.npz'
+        self.verbose = verbose
+        index = self._load_index()
+        if index is None:
+            index = build_dump_index(filename, verbose=verbose)
+            self._save_index(index)
+        self.offsets = index['offsets']
+        self.data_offsets = index['data_offsets']
+        self.ends = index['ends']
+        self.steps = index['steps']
+        self.boxes = index['boxes']
+        self.number_of_atoms = int(index['number_of_atoms'])
+        self.columns = [str(c) for c in index['columns']]
+        self._layout = _dump_columns(self.columns) if self.columns else None
+        self._types = None
+
+    def _fingerprint(self):
+        stat = os.stat(self.filename)
+        return np.array([INDEX_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def _load_index(self):
+        if not os.path.exists(self.index_filename):
+            return None
+        try:
+            with np.load(self.index_filename) as data:
+                if not np.array_equal(data['fingerprint'], self._fingerprint()):
+                    return None
+                return {key: data[key] for key in data.files}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _save_index(self, index):
+        try:
+            np.savez(self.index_filename, fingerprint=self._fingerprint(), **index)
+        except OSError as error:
+            if self.verbose:
+                print(f'Could not save index to {self.index_filename}: {error}')
+
+    def __len__(self):
+        return self.offsets.size
+
+    def __repr__(self):
+        return f'DumpTrajectory({self.filename!r}, frames={len(self)}, atoms={self.number_of_atoms})'
+
+    @property
+    def types(self):
+        ''' Atom types, sorted by atom id '''
+        if self._types is None:
+            with open(self.filename, 'rb') as file:
+                self._types = self._read_frame(file, 0, return_types=True)[1]
+        return self._types
+
+    @property
+    def box(self):
+        ''' Box of the last frame, as returned by read_dump '''
+        return self.boxes[-1]
+
+    def _read_frame(self, file, frame, return_types=False):
+        n = self.number_of_atoms
+        file.seek(self.data_offsets[frame])
+        block = file.read(self.ends[frame] - self.data_offsets[frame])
+        data = np.fromstring(block, sep=' ')
+        if data.size != n * len(self.columns):
+            raise ValueError(f'Frame {frame} of {self.filename} is incomplete')
+        data = data.reshape(n, len(self.columns))
+        layout = self._layout
+        if layout['id'] is None:
+            ids = np.arange(n)
+        else:
+            ids = data[:, layout['id']].astype(int) - 1  # Note: LAMMPS start counting at one
+        pos = np.zeros((n, 3), dtype=float)
+        pos[ids] = _dump_positions(data, layout, self.boxes[frame])
+        if not return_types:
+            return pos
+        types = np.zeros(n, dtype=int)
+        if layout['type'] is not None:
+            types[ids] = data[:, layout['type']]
+        return pos, types
+
+    def indices(self, key):
+        ''' Frame indices selected by an integer, slice, list or array '''
+        if isinstance(key, slice):
+            return np.arange(len(self))[key]
+        indices = np.asarray(key, dtype=int)
+        indices = np.where(indices < 0, indices + len(self), indices)
+        if np.any((indices < 0) | (indices >= len(self))):
+            raise IndexError(f'Frame index out of range for trajectory of {len(self)} frames')
+        return indices
+
+    def __getitem__(self, key):
+        indices = self.indices(key)
+        if indices.ndim == 0:
+            with open(self.filename, 'rb') as file:
+                return self._read_frame(file, int(indices))
+        return self.read(indices)
+
+    def read(self, indices=None):
+        ''' Read selected frames (default all) into an array of shape (frames, atoms, 3) '''
+        if indices is None:
+            indices = np.arange(len(self))
+        frames = np.zeros((len(indices), self.number_of_atoms, 3), dtype=float)
+        with open(self.filename, 'rb') as file:
+            for i, frame in enumerate(indices):
+                frames[i] = self._read_frame(file, frame)
+        return frames
+
+    def __iter__(self):
+        with open(self.filename, 'rb') as file:
+            for frame in range(len(self)):
+                yield self._read_frame(file, frame)
+
+    def chunks(self, chunk_size=256, indices=None):
+        ''' Yield arrays of at most chunk_size consecutive selected frames '''
+        if indices is None:
+            indices = np.arange(len(self))
+        for start in range(0, len(indices), chunk_size):
+            yield self.read(indices[start:start + chunk_size])
+
+    def log_spaced_indices(self, points_per_decade=10):
+        ''' Unique frame indices 0, 1, 2, ... spaced logarithmically up to the last frame '''
+        return log_spaced_lags(len(self), points_per_decade)
@@ -0,0 +1,262 @@
+#!/bin/python3
+""" Compact on-disk trajectories converted from LAMMPS dump files
+
+A dump file is converted once into a directory of NumPy files:
+
+    positions.npy    Unwrapped positions, float32 array of shape (frames, atoms, 3)
+    types.npy        Atom types, sorted by atom id
+    molecules.npy    Molecule ids (from the dump, or a LAMMPS data file), or zeros
+    masses.npy       Atom masses (if a LAMMPS data file is given)
+    boxes.npy        Box bounds of every frame, shape (frames, 3, 2)
+    steps.npy        Time steps of every frame
+    meta.json        Size and modification time of the dump (and data) file, and the layout
+
+The positions are memory-mapped, so loading a store is near-instant, and slices
+are read from disk without parsing or copying. With compress=True, the positions are
+instead stored in compressed chunks of frames (positions_<chunk>.npz), that are
+decompressed when read. TrajectoryStore has the interface of trajectory.DumpTrajectory,
+so it can be given to the MSD functions of analyse.py:
+
+    store = open_store('dump.constant_volume', data_filename='data.initial')
+    MSD, counts, MSD_error = compute_multi_origin_mean_squared_displacement(store)
+
+"""
+
+import json
+import os
+
+import numpy as np
+
+STORE_VERSION = 1
+
+
+def read_lammps_data(filename='data.initial'):
+    ''' Atom ids, molecule ids, types and masses of a LAMMPS data file (atom style full)
+
+    Returns a dictionary of arrays sorted by atom id: id, molecule, type and mass.
+    '''
+    masses = {}
+    atoms = []
+    section = None
+    with open(filename) as file:
+        next(file)  # Title line
+        for line in file:
+            elements = line.split('#')[0].split()
+            if not elements:
+                continue
+            if elements[0].isalpha():
+                section = elements[0]
+                continue
+            if section == 'Masses':
+                masses[int(elements[0])] = float(elements[1])
+            elif section == 'Atoms':
+                atoms.append([int(elements[0]), int(elements[1]), int(elements[2])])
+    atoms = np.array(atoms, dtype=np.int64).reshape(-1, 3)
+    atoms = atoms[np.argsort(atoms[:, 0])]
+    return {
+        'id': atoms[:, 0],
+        'molecule': atoms[:, 1],
+        'type': atoms[:, 2],
+        'mass': np.array([masses.get(t, np.nan) for t in atoms[:, 2]])
+    }
+
+
+def _dump_molecules(trajectory):
+    ''' Molecule ids of the first frame of a dump with a mol column, or None '''
+    if 'mol' not in trajectory.columns:
+        return None
+    n = trajectory.number_of_atoms
+    with open(trajectory.filename, 'rb') as file:
+        file.seek(trajectory.data_offsets[0])
+        block = file.read(trajectory.ends[0] - trajectory.data_offsets[0])
+    data = np.fromstring(block, sep=' ').reshape(n, len(trajectory.columns))
+    molecules = np.zeros(n, dtype=np.int64)
+    ids = data[:, trajectory.columns.index('id')].astype(int) - 1
+    molecules[ids] = data[:, trajectory.columns.index('mol')]
+    return molecules
+
+
+def _file_fingerprint(filename):
+    stat = os.stat(filename)
+    return {'source': os.path.abspath(filename), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _source_fingerprint(filename):
+    return {'version': STORE_VERSION, **_file_fingerprint(filename)}
+
+
+def convert_dump(dump_filename, directory=None, data_filename=None, compress=False,
+                 frames_per_chunk=256, verbose=False):
+    ''' Convert a LAMMPS dump file into a trajectory store (default `<dump>.store`)
+
+    Returns the TrajectoryStore.
+    '''
+    from trajectory import DumpTrajectory
+    directory = directory or f'{dump_filename}.store'
+    os.makedirs(directory, exist_ok=True)
+    meta_filename = os.path.join(directory, 'meta.json')
+    if os.path.exists(meta_filename):
+        os.remove(meta_filename)  # The store is invalid until the conversion is complete
+    for name in os.listdir(directory):
+        if name.startswith('positions') or name == 'masses.npy':
+            os.remove(os.path.join(directory, name))
+    trajectory = DumpTrajectory(dump_filename, verbose=verbose)
+    number_of_frames, number_of_atoms = len(trajectory), trajectory.number_of_atoms
+    shape = (number_of_frames, number_of_atoms, 3)
+    if compress:
+        for chunk, start in enumerate(range(0, number_of_frames, frames_per_chunk)):
+            positions = trajectory.read(np.arange(start, min(start + frames_per_chunk, number_of_frames)))
+            np.savez_compressed(os.path.join(directory, f'positions_{chunk:05d}.npz'),
+                                positions=positions.astype(np.float32))
+    else:
+        positions = np.lib.format.open_memmap(os.path.join(directory, 'positions.npy'), mode='w+',
+                                              dtype=np.float32, shape=shape)
+        for start in range(0, number_of_frames, frames_per_chunk):
+            chunk = trajectory.read(np.arange(start, min(start + frames_per_chunk, number_of_frames)))
+            positions[start:start + len(chunk)] = chunk
+        positions.flush()
+        del positions
+    np.save(os.path.join(directory, 'types.npy'), trajectory.types)
+    molecules = _dump_molecules(trajectory)
+    if data_filename is not None:
+        data = read_lammps_data(data_filename)
+        if len(data['id']) != number_of_atoms:
+            raise ValueError(f'{data_filename} has {len(data["id"])} atoms, but {dump_filename} has {number_of_atoms}')
+        molecules = data['molecule']
+        np.save(os.path.join(directory, 'masses.npy'), data['mass'])
+    if molecules is None:
+        molecules = np.zeros(number_of_atoms, dtype=np.int64)
+    np.save(os.path.join(directory, 'molecules.npy'), molecules)
+    np.save(os.path.join(directory, 'boxes.npy'), trajectory.boxes)
+    np.save(os.path.join(directory, 'steps.npy'), trajectory.steps)
+    meta = _source_fingerprint(dump_filename)
+    meta.update({'number_of_frames': number_of_frames, 'number_of_atoms': number_of_atoms,
+                 'compressed': bool(compress), 'frames_per_chunk': frames_per_chunk,
+                 'data': None if data_filename is None else _file_fingerprint(data_filename)})
+    with open(meta_filename, 'w') as file:
+        json.dump(meta, file)
+    if verbose:
+        print(f'Converted {number_of_frames} frames of {number_of_atoms} atoms to {directory}')
+    return TrajectoryStore(directory)
+
+
+def open_store(dump_filename, directory=None, data_filename=None, compress=False, verbose=False):
+    ''' Trajectory store of a dump file, converted first if missing or out of date
+
+    With a data_filename, the store is also converted again if it was made from another
+    data file, or the data file has changed since.
+    '''
+    directory = directory or f'{dump_filename}.store'
+    try:
+        with open(os.path.join(directory, 'meta.json')) as file:
+            meta = json.load(file)
+        fingerprint = _source_fingerprint(dump_filename)
+        current = all(meta.get(key) == value for key, value in fingerprint.items())
+        current = current and meta['compressed'] == bool(compress)
+        if data_filename is not None:
+            current = current and meta.get('data') == _file_fingerprint(data_filename)
+        if current:
+            return TrajectoryStore(directory)
+    except (OSError, ValueError, KeyError):
+        pass
+    return convert_dump(dump_filename, directory, data_filename=data_filename, compress=compress, verbose=verbose)
+
+
+class TrajectoryStore:
+    ''' Memory-mapped (or chunk compressed) trajectory converted from a dump file
+
+    Indexing with an integer returns the unwrapped positions of a frame, shape (atoms, 3),
+    and indexing with a slice, list or array returns shape (frames, atoms, 3), as
+    DumpTrajectory. For an uncompressed store, the positions attribute is the
+    memory-mapped float32 array of all frames.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as file:
+            self.meta = json.load(file)
+        self.number_of_atoms = self.meta['number_of_atoms']
+        self.types = np.load(os.path.join(directory, 'types.npy'))
+        self.molecules = np.load(os.path.join(directory, 'molecules.npy'))
+        masses = os.path.join(directory, 'masses.npy')
+        self.masses = np.load(masses) if os.path.exists(masses) else None
+        self.boxes = np.load(os.path.join(directory, 'boxes.npy'))
+        self.steps = np.load(os.path.join(directory, 'steps.npy'))
+        if self.meta['compressed']:
+            self.positions = None
+            self._chunk = (None, None)
+        else:
+            self.positions = np.load(os.path.join(directory, 'positions.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return self.meta['number_of_frames']
+
+    def __repr__(self):
+        return f'TrajectoryStore({self.directory!r}, frames={len(self)}, atoms={self.number_of_atoms})'
+
+    @property
+    def box(self):
+        ''' Box of the last frame, as returned by read_dump '''
+        return self.boxes[-1]
+
+    def _compressed_chunk(self, chunk):
+        if self._chunk[0] != chunk:
+            filename = os.path.join(self.directory, f'positions_{chunk:05d}.npz')
+            with np.load(filename) as data:
+                self._chunk = (chunk, data['positions'])
+        return self._chunk[1]
+
+    def indices(self, key):
+        ''' Frame indices selected by an integer, slice, list or array '''
+        if isinstance(key, slice):
+            return np.arange(len(self))[key]
+        indices = np.asarray(key, dtype=int)
+        indices = np.where(indices < 0, indices + len(self), indices)
+        if np.any((indices < 0) | (indices >= len(self))):
+            raise IndexError(f'Frame index out of range for trajectory of {len(self)} frames')
+        return indices
+
+    def __getitem__(self, key):
+        if self.positions is not None:
+            return self.positions[key]
+        indices = self.indices(key)
+        if indices.ndim == 0:
+            size = self.meta['frames_per_chunk']
+            return self._compressed_chunk(int(indices) // size)[int(indices) % size]
+        return self.read(indices)
+
+    def read(self, indices=None):
+        ''' Positions of selected frames (default all, without copying if not compressed) '''
+        if self.positions is not None:
+            return self.positions if indices is None else self.positions[np.asarray(indices)]
+        if indices is None:
+            indices = np.arange(len(self))
+        size = self.meta['frames_per_chunk']
+        frames = np.zeros((len(indices), self.number_of_atoms, 3), dtype=np.float32)
+        for i, frame in enumerate(indices):
+            frames[i] = self._compressed_chunk(frame // size)[frame % size]
+        return frames
+
+    def __iter__(self):
+        for frame in range(len(self)):
+            yield self[frame]
+
+    def chunks(self, chunk_size=256, indices=None):
+        ''' Yield arrays of at most chunk_size consecutive selected frames '''
+        if indices is None:
+            indices = np.arange(len(self))
+        for start in range(0, len(indices), chunk_size):
+            selection = indices[start:start + chunk_size]
+            if self.positions is not None and np.all(np.diff(selection) == 1):
+                yield self.positions[selection[0]:selection[-1] + 1]
+            else:
+                yield self.read(selection)
+
+    def log_spaced_indices(self, points_per_decade=10):
+        ''' Unique frame indices 0, 1, 2, ... spaced logarithmically up to the last frame '''
+        from trajectory import log_spaced_lags
+        return log_spaced_lags(len(self), points_per_decade)
+
+    def nbytes_on_disk(self):
+        ''' Total size of the files of the store '''
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory))
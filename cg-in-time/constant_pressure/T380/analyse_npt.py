@@ -5,6 +5,7 @@ J. Chem. D Phys., 1972, 56, 503-516
 """
 
 import os
+import sys
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -12,140 +13,119 @@ import numpy as np
 current_directory = os.path.dirname(os.path.realpath(__file__))
 print(f'Current directory: {current_directory}')
 
-def thermo_data_as_dataframe(filename='log.lammps', time_step=None,
-                             first_frame=0, stride_frame=1, last_frame=None, verbose=False):
-    """ Read thermodynamic data from LAMMPS log file """
-    import pandas as pd
-    if verbose:
-        print(f'Reading data from {filename}')
-    with open(filename) as file:
-        not_found_beginning = True
-        while not_found_beginning:
-            elements = file.readline().split()
-            if len(elements) > 0:
-                if elements[0] == 'Step':
-                    not_found_beginning = False
-        columns = elements
-        elements = file.readline().split()
-        data = []
-        frame = 0
-        while len(elements) == len(columns):
-            frame = frame + 1
-            if verbose and frame % 100_000 == 0:
-                print(f'Frame {frame}')
-            if frame > first_frame and (frame-1)%stride_frame==0:
-                data.append([float(x) for x in elements])
-            if last_frame and frame > last_frame:
-                break
-            elements = file.readline().split()
-    dataframe = pd.DataFrame(columns=columns, data=data)
-    if time_step:
-        dataframe.insert(loc=0, column='Time', value=dataframe['Step'] * time_step)
-    return dataframe
-
-# Load data
+# Streaming reader of LAMMPS log files, shared with the main analysis folder
+sys.path.insert(0, os.path.join(current_directory, '..', '..', 'T380_L35.944'))
+from thermo_log import iter_thermo_log
+
+from fluctuations import (FluctuationAccumulator, npt_response_with_errors,
+                          energy_to_SI, k_B, N_A)
+
+# Load data in a single pass, in constant memory
+filename = '../../../log-file/constant_pressure/log.otp'
 time_step = 2e-15  # s
 print(f'Time step: {time_step} s')
 first_frame = 2**21
-df = thermo_data_as_dataframe(filename='../../../log-file/constant_pressure/log.otp', time_step=time_step, first_frame=first_frame, verbose=True)
-print(f'Columns: {df.columns}')
-print(f'Number of frames: {len(df)}')
-
-print(f'Time of first frame: {df["Time"].iloc[0]} s')
-print(f'Time of last frame: {df["Time"].iloc[-1]} s')
-print(f'Elapsed time: {df["Time"].iloc[-1] - df["Time"].iloc[0]} s')
+number_of_blocks = 8  # For error estimates, between number_of_blocks and twice as many blocks
+n_boxcar = 2048  # Frames per boxcar average in plots
+names = ['Step', 'Temp', 'Press', 'PotEng', 'KinEng', 'Volume']
+thermo_all = FluctuationAccumulator(names, decimation=n_boxcar)
+# The blocks double in length as frames come in, so the log is not counted beforehand
+thermo = FluctuationAccumulator(names, block_frames=n_boxcar, decimation=n_boxcar, max_blocks=2 * number_of_blocks)
+frame = 0
+first_step, last_step = None, None
+for chunk in iter_thermo_log(filename, usecols=names):
+    skip = max(first_frame - frame, 0)
+    frame += len(chunk['Step'])
+    thermo_all.update(chunk)
+    thermo.update({name: data[skip:] for name, data in chunk.items()})
+    if first_step is None and skip < len(chunk['Step']):
+        first_step = chunk['Step'][skip]
+    if len(chunk['Step']) > 0:
+        last_step = chunk['Step'][-1]
+    print(f'Frame {frame}')
+print(f'Columns: {names}')
+print(f'Number of frames: {thermo.count}')
+
+print(f'Time of first frame: {first_step * time_step} s')
+print(f'Time of last frame: {last_step * time_step} s')
+print(f'Elapsed time: {(last_step - first_step) * time_step} s')
 
 # Constants
 print('..:: Constants ::..')
-pressure_to_SI = 101325  # atm to Pa
-kcal_to_joules = 4184  # kcal/mol to J/mol
-N_A = 6.02214076e23  # Avogadro's number
-energy_to_SI = kcal_to_joules / N_A  # kcal/mol to J/unit
-volume_to_SI = 1e-30  # Angstrom^3 to m^3
-k_B = 1.38064852e-23  # J/K
 print(f'k_B:         {k_B:6.2e} J/K')
 number_of_molecules = 125
 print(f'Number of molecules: {number_of_molecules}')
 molar_mass = 230.3038 # g/mol
 print(f'Molar mass: {molar_mass} g/mol')
 
+values, errors = npt_response_with_errors(thermo, number_of_molecules)
 
 # Average values
 print('..:: Average values ::..')
-temperature = df['Temp'].mean()
+temperature = values['temperature']
 print(f'Temperature: {temperature:6.0f} K')
-pressure = df['Press'].mean()
+pressure = values['pressure']
 print(f'Pressure:    {pressure:6.2f} atm')
-pressure_SI = pressure * pressure_to_SI
+pressure_SI = values['pressure_SI']
 print(f'Pressure:    {pressure_SI:6.0f} Pa')
-potential_energy = df['PotEng'].mean()
+potential_energy = thermo.mean[names.index('PotEng')]
 print(f'Pot. energy: {potential_energy:6.0f} Kcal/mole')
 potential_energy_SI = potential_energy * energy_to_SI
 print(f'Pot. energy: {potential_energy_SI:6.2e} J/unit')
-volume = df['Volume'].mean()
+volume = values['volume']
 print(f'Volume:      {volume:6.0f} Å^3')
-volume_SI = volume * volume_to_SI
+volume_SI = values['volume_SI']
 print(f'Volume:      {volume_SI:6.2e} m^3')
-volume_molar = volume_SI * N_A / number_of_molecules
+volume_molar = values['volume_molar']
 print(f'Volume:      {volume_molar:6.2e} m^3/mol')
 print(f'Volume:      {volume_molar*1e6:6.2f} cm^3/mol')
 
 
-# Compute isobaric heat capacity from enthalpy fluctuations
+# Isobaric heat capacity from enthalpy fluctuations
 #  C_P = ( <H^2> - <H>^2 ) / ( k_B * T^2 )
-enthalpy = (df['PotEng'] + df['KinEng'])*energy_to_SI + pressure_SI * df['Volume'] * volume_to_SI
 # Equation 2.93 in Allen and Tildesley
-c_p = enthalpy.var() / (k_B * temperature**2) / number_of_molecules
+c_p = values['c_p']
 print(f'c_P (SI):         {c_p:6.2e} J/K/atom')
-c_p_molar = c_p * N_A
-print(f'c_P:         {c_p_molar:6.2f} J/mol/K')
+c_p_molar = values['c_p_molar']
+print(f'c_P:         {c_p_molar:6.2f} +/- {errors["c_p_molar"]:6.2f} J/mol/K')
 print(f'c_P:         {c_p*N_A/molar_mass:6.2f} J/g/K')
 
-# Compute isothermal compressibility from volume fluctuations
+# Isothermal compressibility from volume fluctuations
 #  kappa_T = ( <V^2> - <V>^2 ) / ( k_B * T * <V>)
 # Equation 2.93 in Allen and Tildesley
-kappa_T = (df['Volume']*volume_to_SI).var() / (k_B * temperature * volume*volume_to_SI)
-print(f'kappa_T:     {kappa_T:6.2e} Pa^-1')
-bulk_modulus = 1/kappa_T
-print(f'Bulk modulus:{bulk_modulus/1e9:6.2f} GPa')
+kappa_T = values['kappa_T']
+print(f'kappa_T:     {kappa_T:6.2e} +/- {errors["kappa_T"]:6.2e} Pa^-1')
+bulk_modulus = values['bulk_modulus']
+print(f'Bulk modulus:{bulk_modulus/1e9:6.2f} +/- {errors["bulk_modulus"]/1e9:6.2f} GPa')
 
-# Compute isobaric expansion coefficient from volume and enthalpy fluctuations
+# Isobaric expansion coefficient from volume and enthalpy fluctuations
 #  alpha = cov(V, H) / ( k_B * T^2 * V )
 # Equation 2.94 in Allen and Tildesley
-alpha_p = np.cov(df['Volume']*volume_to_SI, enthalpy)[0, 1] / (k_B * temperature**2 * volume*volume_to_SI)
-print(f'alpha_p:     {alpha_p:6.2e} K^-1')
+alpha_p = values['alpha_p']
+print(f'alpha_p:     {alpha_p:6.2e} +/- {errors["alpha_p"]:6.2e} K^-1')
 
 
 # Print to csv file
 with open('thermo.csv', 'w') as file:
     file.write(f'Temperature,Pressure,Volume,Enthalpy,c_p,kappa_T,alpha_p\n')
-    file.write(f'{temperature},{pressure_SI},{volume_molar},{enthalpy.mean()},{c_p_molar},{kappa_T},{alpha_p}\n')
-
-
-def run_avg(data, n):
-    """ Box car average of data with n points """
-    return np.convolve(data, np.ones(n)/n, mode='valid')
+    file.write(f'{temperature},{pressure_SI},{volume_molar},{values["enthalpy"]},{c_p_molar},{kappa_T},{alpha_p}\n')
 
 # Plot
 plot_data = True
 
-# Plot potential energy as a function of time using a box car average of n = 1000 points
+# Plot potential energy as a function of time using box car averages of n_boxcar points
 if plot_data:
-    df_all = thermo_data_as_dataframe(filename='../../../log-file/constant_pressure/log.otp', time_step=time_step, first_frame=0)
-    n_boxcar = 2048
-
-    # Make a function that replace the above code
-    def plot_data(df_all, df, x, y, label, filename):
+    def plot_data(x, y, label, filename):
         plt.figure()
-        plt.plot(run_avg(df_all[x], n_boxcar) * 1e9, run_avg(df_all[y], n_boxcar), 'k-', label='All data')
-        plt.plot(run_avg(df[x], n_boxcar) * 1e9, run_avg(df[y], n_boxcar), 'r-', label='Selected for analysis')
+        plt.plot(thermo_all.decimated[x] * time_step * 1e9, thermo_all.decimated[y], 'k-', label='All data')
+        plt.plot(thermo.decimated[x] * time_step * 1e9, thermo.decimated[y], 'r-', label='Selected for analysis')
         plt.xlabel('Time (ns)')
         plt.ylabel(label)
         plt.savefig(filename, dpi=300)
 
 
-    plot_data(df_all, df, 'Time', 'PotEng', 'Potential energy (kcal/mol)', 'potential_energy.png')
-    plot_data(df_all, df, 'Time', 'Volume', 'Volume (Å^3)', 'volume.png')
+    plot_data('Step', 'PotEng', 'Potential energy (kcal/mol)', 'potential_energy.png')
+    plot_data('Step', 'Volume', 'Volume (Å^3)', 'volume.png')
 
 # Make a function that generate a LaTex file. It should have the PNG images, and a table with the computed values
 #  (temperature, pressure, volume, enthalpy, c_p, kappa_T, alpha_p)
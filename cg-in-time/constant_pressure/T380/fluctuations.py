@@ -0,0 +1,183 @@
+""" Single-pass fluctuation statistics of NPT thermodynamic data
+
+The means and covariances of the thermodynamic columns are accumulated chunk by chunk
+with pairwise co-moment updates (Chan, Golub and LeVeque), so response functions can be
+computed from arbitrarily long LAMMPS logs in constant memory.
+
+"""
+
+import numpy as np
+
+# Unit conversions
+pressure_to_SI = 101325  # atm to Pa
+kcal_to_joules = 4184  # kcal/mol to J/mol
+N_A = 6.02214076e23  # Avogadro's number
+energy_to_SI = kcal_to_joules / N_A  # kcal/mol to J/unit
+volume_to_SI = 1e-30  # Angstrom^3 to m^3
+k_B = 1.38064852e-23  # J/K
+
+
+def _statistics(chunk):
+    ''' Count, mean and co-moment matrix of an array (frames, variables) '''
+    mean = chunk.mean(axis=0)
+    deviation = chunk - mean
+    return len(chunk), mean, deviation.T @ deviation
+
+
+def _merge(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+    ''' Merge the count, mean and co-moment matrix of two samples '''
+    if count_a == 0:
+        return count_b, mean_b, m2_b
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / count
+    m2 = m2_a + m2_b + np.outer(delta, delta) * count_a * count_b / count
+    return count, mean, m2
+
+
+class FluctuationAccumulator:
+    ''' Streaming mean and covariance of several variables
+
+    Every update merges the statistics of a chunk into the running totals, and into
+    the statistics of blocks of block_frames consecutive frames for error estimates.
+    With max_blocks, the number of blocks is kept below max_blocks by merging pairs of
+    neighbouring blocks and doubling block_frames whenever max_blocks are completed, so
+    the blocks grow with the data and the total length need not be known in advance.
+    If decimation is set, non-overlapping boxcar averages over that many frames
+    are kept for plotting (see decimated).
+    '''
+
+    def __init__(self, names, block_frames=None, decimation=None, max_blocks=None):
+        self.names = list(names)
+        self.block_frames = block_frames
+        self.max_blocks = max_blocks
+        self.decimation = decimation
+        self.count, self.mean, self.m2 = self._empty()
+        self.blocks = []
+        self._block = self._empty()
+        self._decimated = []
+        self._remainder = np.zeros((0, len(self.names)))
+
+    def _empty(self):
+        size = len(self.names)
+        return 0, np.zeros(size), np.zeros((size, size))
+
+    def update(self, chunk):
+        ''' Add a chunk of frames, given as a dictionary of arrays or an array (frames, variables) '''
+        if isinstance(chunk, dict):
+            chunk = np.column_stack([np.asarray(chunk[name], dtype=float) for name in self.names])
+        chunk = np.asarray(chunk, dtype=float).reshape(-1, len(self.names))
+        if len(chunk) == 0:
+            return
+        self.count, self.mean, self.m2 = _merge(self.count, self.mean, self.m2, *_statistics(chunk))
+        if self.block_frames:
+            rest = chunk
+            while len(rest) > 0:
+                n = self.block_frames - self._block[0]
+                self._block = _merge(*self._block, *_statistics(rest[:n]))
+                if self._block[0] == self.block_frames:
+                    self.blocks.append(self._block)
+                    self._block = self._empty()
+                    if self.max_blocks and len(self.blocks) >= self.max_blocks:
+                        self._coarsen_blocks()
+                rest = rest[n:]
+        if self.decimation:
+            data = np.concatenate([self._remainder, chunk])
+            n = len(data) // self.decimation * self.decimation
+            self._decimated.append(data[:n].reshape(-1, self.decimation, len(self.names)).mean(axis=1))
+            self._remainder = data[n:]
+
+    def _coarsen_blocks(self):
+        ''' Merge pairs of neighbouring blocks, and double the block length '''
+        pairs = [_merge(*a, *b) for a, b in zip(self.blocks[0::2], self.blocks[1::2])]
+        if len(self.blocks) % 2:
+            # An odd last block is continued as the current block, of the new length
+            self._block = _merge(*self.blocks[-1], *self._block)
+        self.blocks = pairs
+        self.block_frames *= 2
+
+    @property
+    def covariance(self):
+        ''' Sample covariance matrix (as np.cov and pandas var, with ddof=1) '''
+        return self.m2 / max(self.count - 1, 1)
+
+    def block_statistics(self):
+        ''' Count, mean and covariance of every completed block '''
+        return [(count, mean, m2 / max(count - 1, 1)) for count, mean, m2 in self.blocks]
+
+    @property
+    def decimated(self):
+        ''' Dictionary of the boxcar averaged series of every variable '''
+        data = np.concatenate(self._decimated) if self._decimated else np.zeros((0, len(self.names)))
+        return {name: data[:, i] for i, name in enumerate(self.names)}
+
+
+def npt_response(names, mean, covariance, number_of_molecules):
+    r''' Isobaric response functions from the means and covariances of thermodynamic data
+
+    names must include Temp, Press, PotEng, KinEng and Volume (LAMMPS real units).
+    The enthalpy is :math:`H = U + K + \langle p\rangle V`, and (Allen and Tildesley,
+    Eqs. 2.93-2.94)
+
+     .. math::
+
+         c_P = \frac{\langle (\Delta H)^2\rangle}{k_B T^2}
+
+         \kappa_T = \frac{\langle (\Delta V)^2\rangle}{k_B T \langle V\rangle}
+
+         \alpha_p = \frac{\langle \Delta V \Delta H\rangle}{k_B T^2 \langle V\rangle}
+
+    Returns a dictionary with the temperature (K), pressure (atm and Pa), volume (Å^3, m^3
+    and m^3/mol), enthalpy (J), c_p (J/K per molecule and J/mol/K), kappa_T (1/Pa), alpha_p (1/K)
+    and bulk modulus (Pa).
+    '''
+    index = {name: i for i, name in enumerate(names)}
+    temperature = mean[index['Temp']]
+    pressure = mean[index['Press']]
+    pressure_SI = pressure * pressure_to_SI
+    volume = mean[index['Volume']]
+    volume_SI = volume * volume_to_SI
+    # H as a linear combination of the variables
+    weights = np.zeros(len(names))
+    weights[index['PotEng']] = energy_to_SI
+    weights[index['KinEng']] = energy_to_SI
+    weights[index['Volume']] = pressure_SI * volume_to_SI
+    enthalpy = weights @ mean
+    enthalpy_variance = weights @ covariance @ weights
+    volume_variance = covariance[index['Volume'], index['Volume']] * volume_to_SI**2
+    volume_enthalpy_covariance = covariance[index['Volume']] @ weights * volume_to_SI
+    c_p = enthalpy_variance / (k_B * temperature**2) / number_of_molecules
+    kappa_T = volume_variance / (k_B * temperature * volume_SI)
+    alpha_p = volume_enthalpy_covariance / (k_B * temperature**2 * volume_SI)
+    return {
+        'temperature': temperature,
+        'pressure': pressure,
+        'pressure_SI': pressure_SI,
+        'volume': volume,
+        'volume_SI': volume_SI,
+        'volume_molar': volume_SI * N_A / number_of_molecules,
+        'enthalpy': enthalpy,
+        'c_p': c_p,
+        'c_p_molar': c_p * N_A,
+        'kappa_T': kappa_T,
+        'alpha_p': alpha_p,
+        'bulk_modulus': 1 / kappa_T
+    }
+
+
+def npt_response_with_errors(accumulator, number_of_molecules):
+    ''' Response functions of all data, and their standard errors from the blocks
+
+    Returns two dictionaries: the values, and the standard errors of the mean of the
+    block estimates (NaN if there are fewer than two blocks).
+    '''
+    values = npt_response(accumulator.names, accumulator.mean, accumulator.covariance, number_of_molecules)
+    blocks = [npt_response(accumulator.names, mean, covariance, number_of_molecules)
+              for _, mean, covariance in accumulator.block_statistics()]
+    errors = {}
+    for key in values:
+        if len(blocks) < 2:
+            errors[key] = np.nan
+        else:
+            errors[key] = np.std([block[key] for block in blocks], ddof=1) / np.sqrt(len(blocks))
+    return values, errors
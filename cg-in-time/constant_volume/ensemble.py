@@ -0,0 +1,252 @@
+#!/bin/python3
+""" Analyse all constant volume state points in parallel
+
+The state points are discovered from directory names as `T<temperature>_L<box length>`
+(with an optional suffix, e.g. `T380_L35.944_c0`). In every directory, the pipeline of
+analyse.py (in ../T380_L35.944) is run without plots: thermodynamic statistics
+(thermo_stats.csv), the energy time correlation (time_correlation.csv) and the mean squared
+displacement (mean_squared_displacement.csv) with the diffusion coefficient, and optionally
+the four-point susceptibility (four_point_susceptibility.csv, with --chi4). The state points
+are analysed in a process pool, and the results are collected in ortho_terphenyl.csv,
+as read by msd.py. A failing state point is reported, but does not stop the others.
+
+    python3 ensemble.py                       # Default state points, as in msd.py
+    python3 ensemble.py 'T600*' --processes 4 --output T600.csv
+    python3 ensemble.py --chi4 --thresholds 0.3 0.5 --molecular
+
+"""
+
+import os
+import re
+import resource
+import sys
+import time
+from glob import glob
+
+import numpy as np
+
+ANALYSIS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'T380_L35.944')
+sys.path.insert(0, ANALYSIS_DIR)
+
+# State points of ortho_terphenyl.csv (see msd.py)
+DEFAULT_PATTERNS = ['T700*', 'T600*', 'T540*', 'T500*', 'T480*', 'T460*', 'T450*', 'T440*',
+                    'T420_L??.???', 'T400*', 'T380_L35.944_c0']
+STATE_POINT = re.compile(r'^T(\d+(?:\.\d*)?)_L(\d+(?:\.\d*)?)(?:_(.+))?$')
+NUMBER_OF_MOLECULES = 125
+
+
+def discover_state_points(patterns=None, root='.'):
+    ''' State point directories matching glob patterns (default DEFAULT_PATTERNS)
+
+    Returns a list of dictionaries with the directory, Temperature, Box_Length and
+    suffix (or None), sorted by directory name.
+    '''
+    directories = set()
+    for pattern in patterns or DEFAULT_PATTERNS:
+        directories.update(os.path.normpath(d) for d in glob(os.path.join(root, pattern)))
+    state_points = []
+    for directory in sorted(directories):
+        match = STATE_POINT.match(os.path.basename(directory))
+        if match is None or not os.path.isdir(directory):
+            continue
+        state_points.append({
+            'directory': directory,
+            'Temperature': float(match.group(1)),
+            'Box_Length': float(match.group(2)),
+            'suffix': match.group(3)
+        })
+    return state_points
+
+
+def _write_if_changed(text, filename):
+    ''' Write text to a file, unless the file already has that content '''
+    if os.path.exists(filename):
+        with open(filename) as file:
+            if file.read() == text:
+                return False
+    with open(filename, 'w') as file:
+        file.write(text)
+    return True
+
+
+def analyse_state_point(directory, time_step=2e-15, first_frame=0, frame_stride=1, last_frame=None,
+                        log_filename='log.lammps', dump_filename='dump.constant_volume', cache=True,
+                        chi4=False, thresholds=(0.3, 0.5, 1.0), molecular=False, data_filename='data.initial'):
+    ''' Run the analysis pipeline of analyse.py in a state point directory, without plots
+
+    Writes thermo_stats.csv, thermo_stats.txt, time_correlation.csv and
+    mean_squared_displacement.csv to the directory, and with chi4=True also
+    four_point_susceptibility.csv (of molecular centres of mass with molecular=True).
+    The results are taken from the result cache (see result_cache.py) if the inputs and
+    parameters are unchanged, and files with unchanged content are not rewritten.
+
+    Returns a dictionary with the mean pressure and density, the diffusion coefficient,
+    and with chi4=True the maximum of chi_4 (of the first threshold) and its time.
+    '''
+    from analyse import (thermo_statistics, thermo_summary, energy_time_correlation,
+                         mean_squared_displacement, diffusion_coefficient, dynamic_susceptibility)
+    from tracing import span
+    log_filename = os.path.join(directory, log_filename)
+    selection = dict(time_step=time_step, first_frame=first_frame, stride_frame=frame_stride, last_frame=last_frame)
+    # The state points already run in parallel, so each log is parsed in a single process
+    processes = 1
+
+    # Thermodynamic summary
+    with span('thermo'):
+        thermo_stats = thermo_statistics(log_filename, cache=cache, processes=processes, **selection)
+    with span('write', filename='thermo_stats.csv'):
+        _write_if_changed(thermo_stats.to_csv(), os.path.join(directory, 'thermo_stats.csv'))
+        _write_if_changed(thermo_summary(thermo_stats), os.path.join(directory, 'thermo_stats.txt'))
+
+    # Energy time correlation
+    with span('correlation'):
+        correlation = energy_time_correlation(log_filename, cache=cache, processes=processes, **selection)
+    with span('write', filename='time_correlation.csv'):
+        _write_if_changed(correlation.to_csv(index=False), os.path.join(directory, 'time_correlation.csv'))
+
+    # Mean squared displacement
+    with span('msd') as record:
+        msd = mean_squared_displacement(os.path.join(directory, dump_filename), time_step, cache=cache)
+        D = diffusion_coefficient(msd.Time, msd.MSD)
+        record['D'] = D
+    with span('write', filename='mean_squared_displacement.csv'):
+        _write_if_changed(msd.to_csv(index=False), os.path.join(directory, 'mean_squared_displacement.csv'))
+
+    result = {
+        'Pressure': float(thermo_stats.loc['mean', 'Press']),
+        'Density': float(thermo_stats.loc['mean', 'Density']),
+        'Diffusion_Coefficient': D
+    }
+
+    # Four-point susceptibility
+    if chi4:
+        from heterogeneity import chi4_peak
+        with span('chi4', molecular=molecular):
+            susceptibility = dynamic_susceptibility(os.path.join(directory, dump_filename),
+                                                    os.path.join(directory, data_filename), time_step,
+                                                    thresholds, molecular=molecular, cache=cache)
+        filename = 'four_point_susceptibility' + ('_molecular' if molecular else '') + '.csv'
+        with span('write', filename=filename):
+            _write_if_changed(susceptibility.to_csv(index=False), os.path.join(directory, filename))
+        result['Chi4_Peak'], result['Chi4_Peak_Time'] = chi4_peak(susceptibility.Time,
+                                                                  susceptibility[f'chi4_{thresholds[0]:.2f}'])
+    return result
+
+
+def _run(state_point, parameters, trace=False):
+    ''' Analyse a state point, and catch any error (runs in a worker process) '''
+    import traceback
+    if trace:
+        from tracing import enable
+        enable(os.path.join(state_point['directory'], 'trace.jsonl'))
+    tic = time.perf_counter()
+    try:
+        result = analyse_state_point(state_point['directory'], **parameters)
+        error = None
+    except Exception:
+        result = None
+        error = traceback.format_exc()
+    return {
+        'result': result,
+        'error': error,
+        'wall_time': time.perf_counter() - tic,
+        'peak_memory': max(resource.getrusage(who).ru_maxrss  # Including any child processes
+                           for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)) * 1024  # Linux reports kB
+    }
+
+
+def run_ensemble(state_points, processes=None, output='ortho_terphenyl.csv', trace=False, **parameters):
+    ''' Analyse state points in a process pool, and write the table of results
+
+    Every state point is analysed in a fresh worker process, so the reported peak
+    memory (maximum resident set size) is that of the state point alone. Python < 3.11
+    cannot replace workers after a task, so there the workers are spawned (without the
+    memory of the parent) but reused, and the peak memory is the maximum of the state
+    points analysed by the same worker so far.
+    With trace=True, the spans of every state point are appended to trace.jsonl
+    in its directory (see tracing.py).
+    keyword arguments are passed on to analyse_state_point.
+
+    Returns a DataFrame of the successful state points, and a list of reports
+    (directory, status, wall time, peak memory and error) of all state points.
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    import pandas as pd
+    if sys.version_info >= (3, 11):
+        pool_options = {'max_tasks_per_child': 1}
+    else:
+        from multiprocessing import get_context
+        pool_options = {'mp_context': get_context('spawn')}
+    tic = time.perf_counter()
+    rows, reports = [], []
+    with ProcessPoolExecutor(max_workers=processes, **pool_options) as executor:
+        futures = [executor.submit(_run, state_point, parameters, trace) for state_point in state_points]
+        for state_point, future in zip(state_points, futures):
+            try:
+                outcome = future.result()
+            except Exception as error:  # E.g. a worker killed by running out of memory
+                outcome = {'result': None, 'error': repr(error), 'wall_time': np.nan, 'peak_memory': np.nan}
+            directory = state_point['directory']
+            status = 'ok' if outcome['error'] is None else 'failed'
+            print(f'{directory}: {status} in {outcome["wall_time"]:.1f} s, '
+                  f'peak memory {outcome["peak_memory"] / 2**20:.0f} MiB')
+            reports.append({'directory': directory, 'status': status, 'wall_time': outcome['wall_time'],
+                            'peak_memory': outcome['peak_memory'], 'error': outcome['error']})
+            if outcome['error'] is not None:
+                print(outcome['error'], file=sys.stderr)
+                continue
+            L = state_point['Box_Length']
+            rows.append({
+                'Temperature': state_point['Temperature'],
+                'Pressure': outcome['result']['Pressure'],
+                'Density': outcome['result']['Density'],
+                'Box_Length': L,
+                'Number_Density': NUMBER_OF_MOLECULES / L**3,
+                'Diffusion_Coefficient': outcome['result']['Diffusion_Coefficient'],
+                'Chi4_Peak': outcome['result'].get('Chi4_Peak'),
+                'Chi4_Peak_Time': outcome['result'].get('Chi4_Peak_Time'),
+                'directory': os.path.basename(directory)
+            })
+    columns = ['Temperature', 'Pressure', 'Density', 'Box_Length', 'Number_Density',
+               'Diffusion_Coefficient', 'directory']
+    if parameters.get('chi4'):
+        columns[-1:-1] = ['Chi4_Peak', 'Chi4_Peak_Time']
+    df = pd.DataFrame(rows, columns=columns)
+    if output and len(df) > 0:
+        df.to_csv(output, index=False)
+    failed = [report['directory'] for report in reports if report['status'] != 'ok']
+    print(f'Analysed {len(rows)} of {len(state_points)} state points in {time.perf_counter() - tic:.1f} s')
+    if failed:
+        print(f'Failed state points: {failed}')
+    return df, reports
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Analyse constant volume state points in parallel')
+    parser.add_argument('patterns', nargs='*', help='Glob patterns of state point directories (default as msd.py)')
+    parser.add_argument('--processes', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--output', default='ortho_terphenyl.csv', help='Table of results')
+    parser.add_argument('--time-step', type=float, default=2e-15, help='Time step in seconds')
+    parser.add_argument('--first-frame', type=int, default=0)
+    parser.add_argument('--frame-stride', type=int, default=1)
+    parser.add_argument('--last-frame', type=int, default=None)
+    parser.add_argument('--chi4', action='store_true', help='Compute the four-point susceptibility chi_4(t)')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.3, 0.5, 1.0],
+                        help='Overlap thresholds of chi_4(t) [Å]')
+    parser.add_argument('--molecular', action='store_true', help='chi_4(t) of molecular centres of mass')
+    parser.add_argument('--trace', action='store_true', help='Write trace.jsonl in every state point directory')
+    args = parser.parse_args()
+    state_points = discover_state_points(args.patterns)
+    print(f'State points: {[state_point["directory"] for state_point in state_points]}')
+    df, reports = run_ensemble(state_points, processes=args.processes, output=args.output, trace=args.trace,
+                               time_step=args.time_step, first_frame=args.first_frame,
+                               frame_stride=args.frame_stride, last_frame=args.last_frame,
+                               chi4=args.chi4, thresholds=args.thresholds, molecular=args.molecular)
+    print(df)
+    if any(report['status'] != 'ok' for report in reports):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
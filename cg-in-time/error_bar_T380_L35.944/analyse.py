@@ -2,61 +2,121 @@
 
 import numpy as np
 
+def _count_dump_frames(filename, chunk_size=2**26):
+    ''' Count frames in a LAMMPS dump file by scanning raw bytes for the TIMESTEP item '''
+    key = b'ITEM: TIMESTEP'
+    count = 0
+    tail = b''
+    with open(filename, 'rb') as file:
+        chunk = file.read(chunk_size)
+        while chunk:
+            data = tail + chunk
+            count += data.count(key)
+            tail = data[-(len(key) - 1):]
+            chunk = file.read(chunk_size)
+    return count
+
+
+def _dump_columns(columns):
+    ''' Map the columns of an ITEM: ATOMS header to the indices needed for positions
+
+    Unwrapped coordinates (xu or xsu) are preferred. Otherwise wrapped coordinates
+    (x or xs) are used, and unwrapped with the image flags (ix, iy, iz) if present.
+    '''
+    index = {name: i for i, name in enumerate(columns)}
+    for names, scaled in (('xu yu zu', False), ('xsu ysu zsu', True),
+                          ('x y z', False), ('xs ys zs', True)):
+        names = names.split()
+        if all(name in index for name in names):
+            break
+    else:
+        raise ValueError(f'No atomic positions among dump columns: {columns}')
+    images = None
+    if not names[0].endswith('u') and all(name in index for name in ('ix', 'iy', 'iz')):
+        images = [index['ix'], index['iy'], index['iz']]
+    return {
+        'id': index.get('id'),
+        'type': index.get('type'),
+        'position': [index[name] for name in names],
+        'image': images,
+        'scaled': scaled
+    }
+
+
+def _dump_positions(data, layout, box):
+    ''' Unwrapped and unscaled positions of a parsed ATOMS block '''
+    length = box[:, 1] - box[:, 0]
+    pos = data[:, layout['position']]
+    if layout['scaled']:
+        pos = box[:, 0] + pos * length
+    if layout['image'] is not None:
+        pos += data[:, layout['image']] * length
+    return pos
+
+
 def read_dump(filename='dump.lammps', verbose=False):
-    c = 0
-    box=[[0, 10],[0, 10],[0, 10]]
-    with open(filename) as file:
+    ''' Read unwrapped positions from a LAMMPS dump file
+
+    The frames are counted in a fast scan of the file, so positions can be written
+    straight into a preallocated array of shape (frames, atoms, 3). The columns of the
+    ATOMS header are mapped once per file, and each ATOMS block is parsed with a single
+    NumPy call. Scaled coordinates are converted with the box of their own frame,
+    so boxes that change between frames are handled.
+
+    Returns::
+
+        frames, box, types
+
+    where box is the box of the last frame.
+    '''
+    from itertools import islice
+    number_of_frames = _count_dump_frames(filename)
+    if verbose:
+        print(f'{number_of_frames=}')
+    frames = np.zeros((number_of_frames, 0, 3), dtype=float)
+    types = np.zeros(0, dtype=int)
+    box = np.array([[0, 10], [0, 10], [0, 10]], dtype=float)
+    columns, layout = None, None
+    frame = 0
+    with open(filename, 'rb') as file:
         line = file.readline()
-        frames=[]
         while line:
-            c = c + 1
-            if 'ITEM: NUMBER OF ATOMS' in line:
-                line = file.readline()
-                number_of_atoms = int(line)
-                types = np.zeros(number_of_atoms, dtype=int)
-                if verbose:
-                    print(f'{number_of_atoms=}')
-            if 'ITEM: BOX BOUNDS' in line:
+            if line.startswith(b'ITEM: NUMBER OF ATOMS'):
+                number_of_atoms = int(file.readline())
+                if frame == 0:
+                    frames = np.zeros((number_of_frames, number_of_atoms, 3), dtype=float)
+                    types = np.zeros(number_of_atoms, dtype=int)
+                    if verbose:
+                        print(f'{number_of_atoms=}')
+                elif number_of_atoms != frames.shape[1]:
+                    raise ValueError(f'Number of atoms changed from {frames.shape[1]} to {number_of_atoms} in frame {frame}')
+            elif line.startswith(b'ITEM: BOX BOUNDS'):
                 for dim in 0, 1, 2:
                     elms = file.readline().split()
-                    box[dim] = [float(elms[0]), float(elms[1])]
-                if verbose:
-                    print(f'{box=}')
-            if 'ITEM: ATOMS' in line:
-                pos = np.zeros((number_of_atoms, 3), dtype=float)
-                elms = line.split()
-                columns = elms[2:]
-                if verbose:
-                    print(f'{columns=}')
-                def find(c, s):
-                    for i, e in enumerate(c):
-                        if s in e:
-                            return i
-                idx_id = find(columns, 'id')
-                idx_type = find(columns, 'type')
-                idx_xs = find(columns, 'xs')
-                idx_ys = find(columns, 'ys')
-                idx_zs = find(columns, 'zs')
-                idx_ix = find(columns, 'ix')
-                idx_iy = find(columns, 'iy')
-                idx_iz = find(columns, 'iz')                
-                for _ in range(number_of_atoms):
-                    elms = file.readline().split()
-                    i = int(elms[idx_id])-1  # Note: LAMMPS start counting at zero
-                    t = int(elms[idx_type])
-                    x = (float(elms[idx_xs])+float(elms[idx_ix]))
-                    x = x*(box[0][1]-box[0][0])
-                    y = (float(elms[idx_ys])+float(elms[idx_iy]))
-                    y = y*(box[1][1]-box[1][0])
-                    z = (float(elms[idx_zs])+float(elms[idx_iz]))
-                    z = z*(box[0][1]-box[0][0])
-                    types[i] = t
-                    pos[i, 0] = x
-                    pos[i, 1] = y
-                    pos[i, 2] = z
-                frames.append(pos)
+                    box[dim] = float(elms[0]), float(elms[1])
+            elif line.startswith(b'ITEM: ATOMS'):
+                if line.split()[2:] != columns:
+                    columns = line.split()[2:]
+                    layout = _dump_columns([c.decode() for c in columns])
+                    if verbose:
+                        print(f'{columns=}')
+                block = b''.join(islice(file, number_of_atoms))
+                data = np.fromstring(block, sep=' ')
+                if data.size != number_of_atoms * len(columns):
+                    if file.read(1):
+                        raise ValueError(f'Frame {frame} of {filename} is incomplete')
+                    break  # Incomplete last frame, e.g. of a running simulation
+                data = data.reshape(number_of_atoms, len(columns))
+                if layout['id'] is None:
+                    ids = np.arange(number_of_atoms)
+                else:
+                    ids = data[:, layout['id']].astype(int) - 1  # Note: LAMMPS start counting at one
+                frames[frame, ids] = _dump_positions(data, layout, box)
+                if layout['type'] is not None:
+                    types[ids] = data[:, layout['type']]
+                frame = frame + 1
             line = file.readline()
-    return np.array(frames), np.array(box), types
+    return frames[:frame], box, types
 
 def remove_drift(frames):
     """ Remove drift of geometric_center"""